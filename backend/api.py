@@ -1,12 +1,26 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Callable
+from datetime import datetime, timezone
+from email.utils import format_datetime
+import hashlib
+import json
 import uvicorn
 
-from core.query_data import query_rag
-from config import TOP_K
-from utils.chat_db import create_chat, save_message, get_chat_list, get_chat_messages, delete_chat
+from core.query_data import query_rag, prefetch_retrieval
+from core.intent_router import get_route_stats
+from core.conversation import update_summary
+from config import TOP_K, PREFETCH_MIN_CHARS
+from utils.chat_db import (
+    create_chat, get_chat_list, get_chat_messages, delete_chat, close_connections, search_messages,
+    get_chat_list_version, get_chat_version, get_chat_title, init_database
+)
+from utils.chat_writer import get_chat_writer
+from utils.chat_maintenance import BackgroundVacuum, is_archived, restore_chat, delete_archive
+from utils.response_cache import get_chat_cache, invalidate_chat
+from utils.index_versions import BackgroundIndexGC
+from utils.prefetch_cache import get_prefetch_cache
 
 app = FastAPI(
     title="NourAI API",
@@ -20,6 +34,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "Last-Modified"],
 )
 
 class ClinicalData(BaseModel):
@@ -38,8 +53,15 @@ class QueryRequest(BaseModel):
     top_k: int = TOP_K
     clinical_data: Optional[ClinicalData] = None
     chat_id: Optional[str] = None
+    debug: bool = False  # Include the retrieval trace in the response
+
+class PrefetchRequest(BaseModel):
+    query: str  # Draft question as typed so far
+    top_k: int = TOP_K
+    chat_id: Optional[str] = None  # Chats with history are skipped; one prefetch at a time per chat
 
 class Source(BaseModel):
+    doc_id: Optional[str] = None
     title: str
     organization: str
     organization_acronym: Optional[str] = ""
@@ -52,6 +74,7 @@ class QueryResponse(BaseModel):
     query: str
     answer: str
     sources: list[Source]
+    trace: Optional[Dict[str, Any]] = None
 
 class ChatCreateRequest(BaseModel):
     title: str
@@ -61,6 +84,11 @@ class ChatCreateResponse(BaseModel):
 
 class ChatListResponse(BaseModel):
     chats: List[Dict[str, Any]]
+    next_cursor: Optional[str] = None
+
+class ChatSearchResponse(BaseModel):
+    results: List[Dict[str, Any]]
+    next_offset: Optional[int] = None
 
 class MessageSaveRequest(BaseModel):
     role: str
@@ -72,6 +100,35 @@ class MessageSaveResponse(BaseModel):
 
 class ChatMessagesResponse(BaseModel):
     messages: List[Dict[str, Any]]
+    next_cursor: Optional[str] = None
+
+
+_vacuum = None
+_index_gc = None
+
+
+@app.on_event("startup")
+def startup():
+    """
+    Give space freed by deleted/archived chats back to the filesystem, and
+    delete retired index versions after their grace period, in the background.
+    Chat database migrations run here rather than on the first request.
+    """
+    global _vacuum, _index_gc
+    init_database()
+    _vacuum = BackgroundVacuum()
+    _index_gc = BackgroundIndexGC()
+
+
+@app.on_event("shutdown")
+def shutdown():
+    """Commit queued chat messages before the process exits."""
+    if _vacuum:
+        _vacuum.stop()
+    if _index_gc:
+        _index_gc.stop()
+    get_chat_writer().stop()
+    close_connections()
 
 
 @app.get("/")
@@ -82,102 +139,249 @@ def root():
         "version": "2.0.0",
         "endpoints": {
             "query": "POST /api/query",
+            "prefetch": "POST /api/prefetch",
             "create_chat": "POST /api/chats",
             "list_chats": "GET /api/chats",
+            "search_chats": "GET /api/chats/search?q=",
             "get_chat": "GET /api/chats/{chat_id}",
             "save_message": "POST /api/chats/{chat_id}/messages",
             "delete_chat": "DELETE /api/chats/{chat_id}",
+            "route_stats": "GET /api/stats/routes",
+            "prefetch_stats": "GET /api/stats/prefetch",
             "health": "GET /api/health"
         }
     }
 
 
+def http_date(timestamp: Optional[str]) -> Optional[str]:
+    """SQLite CURRENT_TIMESTAMP (UTC) -> RFC 7231 date for Last-Modified."""
+    if not timestamp:
+        return None
+    return format_datetime(datetime.strptime(timestamp, '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc), usegmt=True)
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return etag in candidates or "*" in candidates
+
+
+def conditional_json(request: Request, key: tuple, load_version: Callable[[], Any], load_payload: Callable[[], dict]) -> Response:
+    """
+    Serve a chat GET from the response cache, answering 304 when the
+    client's If-None-Match still matches. On a miss the ETag comes from a
+    cheap version query, so an unchanged resource is revalidated without
+    loading or serializing it, and writes to other chats don't change it.
+    Versions are tuples whose first item is the updated_at timestamp.
+    """
+    cache = get_chat_cache()
+    entry = cache.get(key)
+
+    if entry is None:
+        generation = cache.generation
+        version = load_version()
+        etag = '"' + hashlib.sha1(repr(version).encode()).hexdigest()[:20] + '"'
+        last_modified = http_date(version[0] if version else None)
+        if etag_matches(request, etag):
+            return not_modified(etag, last_modified)
+        body = json.dumps(load_payload(), ensure_ascii=False).encode("utf-8")
+        entry = cache.put(key, etag, last_modified, body, generation)
+    elif etag_matches(request, entry.etag):
+        return not_modified(entry.etag, entry.last_modified)
+
+    return Response(content=entry.body, media_type="application/json", headers=cache_headers(entry.etag, entry.last_modified))
+
+
+def cache_headers(etag: str, last_modified: Optional[str]) -> dict:
+    # no-cache: browsers may store the response but must revalidate it every time
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if last_modified:
+        headers["Last-Modified"] = last_modified
+    return headers
+
+
+def not_modified(etag: str, last_modified: Optional[str]) -> Response:
+    return Response(status_code=304, headers=cache_headers(etag, last_modified))
+
+
+def restore_archived_chat(chat_id: str) -> bool:
+    """
+    Bring an archived chat back on first access. True if the chat is live
+    afterwards, including when a concurrent request restored it first.
+    """
+    if not (is_archived(chat_id) and restore_chat(chat_id)):
+        return get_chat_title(chat_id) is not None
+    invalidate_chat(chat_id)
+    return True
+
+
+def require_chat(chat_id: str):
+    """404 unless the chat exists, restoring it first if it was archived."""
+    if get_chat_title(chat_id) is None and not restore_archived_chat(chat_id):
+        raise HTTPException(status_code=404, detail="Chat not found")
+
+
+def flush_chat_writes(chat_id: Optional[str] = None):
+    """Read-your-writes for queued messages; 503 while a failed batch waits for its retry."""
+    if not get_chat_writer().flush(chat_id):
+        raise HTTPException(status_code=503, detail="Chat messages could not be saved yet, retrying")
+
+
+def refresh_chat_summary(chat_id: str):
+    """Background task: commit the new exchange, then update the chat summary."""
+    try:
+        if not get_chat_writer().flush(chat_id):
+            print(f"Skipping summary for chat {chat_id}: its messages are not committed yet")
+            return
+        update_summary(chat_id)
+    except Exception as e:
+        print(f"Error updating summary for chat {chat_id}: {e}")
+
+
 @app.post("/api/query", response_model=QueryResponse)
-def query(request: QueryRequest):
+def query(request: QueryRequest, background_tasks: BackgroundTasks):
     """
     Query the RAG system and optionally save to chat history.
+    With a chat_id the answer takes the conversation so far into account.
     """
     try:
         clinical_dict = None
         if request.clinical_data:
             clinical_dict = request.clinical_data.model_dump(exclude_none=True) # Convert to dict excluding None values
 
+        if request.chat_id:
+            require_chat(request.chat_id)
+            flush_chat_writes(request.chat_id)  # History must include the previous exchange
+
         result = query_rag(
             query_text=request.query,
             top_k=request.top_k,
-            clinical_data=clinical_dict
+            clinical_data=clinical_dict,
+            chat_id=request.chat_id,
+            trace=request.debug
         )
 
-        # Save messages to chat if chat_id is provided
+        # Queue messages for the background writer so persistence stays off the response path
         if request.chat_id:
             try:
-                # Save user message
-                user_msg_id = save_message(request.chat_id, "user", request.query)
-                print(f"Successfully saved user message with ID: {user_msg_id}")
-
-                # Save assistant message with sources as citations
-                try:
-                    citations = [{
-                        "id": f"cite-{i}",
-                        "label": f"[{i + 1}]",
-                        "organization": source.organization,
-                        "year": source.year,
-                        "title": source.title,
-                        "url": source.link,
-                        "excerpt": f"Similitud: {source.similarity}"
-                    } for i, source in enumerate(result["sources"])]
-
-                    assistant_msg_id = save_message(request.chat_id, "assistant", result["answer"], citations, result["sources"])
-                except Exception as cite_error:
-                    print(f"Error creating citations: {cite_error}")
-                    # Save without citations if citations fail, but with sources
-                    assistant_msg_id = save_message(request.chat_id, "assistant", result["answer"], sources=result["sources"])
-                print(f"Successfully saved assistant message with ID: {assistant_msg_id}")
+                writer = get_chat_writer()
+                writer.enqueue(request.chat_id, "user", request.query)
+                # Citations are rebuilt from the stored sources when the chat is read
+                writer.enqueue(request.chat_id, "assistant", result["answer"], sources=result["sources"])
+
+                # Fold older turns into the rolling summary after the response is sent
+                background_tasks.add_task(refresh_chat_summary, request.chat_id)
             except Exception as save_error:
                 # Log but don't fail the query if saving fails
-                print(f"Error: Failed to save chat message: {save_error}")
+                print(f"Error: Failed to queue chat messages: {save_error}")
                 import traceback
                 traceback.print_exc()
 
         return QueryResponse(
             query=request.query,
             answer=result["answer"],
-            sources=[Source(**s) for s in result["sources"]] # Convert source dicts to Source models
+            sources=[Source(**s) for s in result["sources"]], # Convert source dicts to Source models
+            trace=result.get("trace")
         )
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 # Chat management endpoints
+@app.post("/api/prefetch")
+def prefetch(request: PrefetchRequest):
+    """
+    Warm retrieval for a draft question while the user is typing, so the
+    following /api/query with the same or a very similar text only generates.
+    """
+    draft = request.query.strip()
+    if len(draft) < PREFETCH_MIN_CHARS:
+        return {"status": "skipped"}
+
+    try:
+        # The last exchange may still be queued; it decides whether the chat has history
+        if request.chat_id and not get_chat_writer().flush(request.chat_id):
+            return {"status": "skipped"}
+        return prefetch_retrieval(draft, top_k=request.top_k, chat_id=request.chat_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Prefetch failed: {str(e)}")
+
+
 @app.post("/api/chats", response_model=ChatCreateResponse)
 def create_new_chat(request: ChatCreateRequest):
     """Create a new chat thread."""
     try:
         chat_id = create_chat(request.title)
+        invalidate_chat(chat_id)
         return ChatCreateResponse(chat_id=chat_id)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to create chat: {str(e)}")
 
 
 @app.get("/api/chats", response_model=ChatListResponse)
-def list_chats(limit: int = 50):
-    """Get list of chats."""
+def list_chats(request: Request, limit: int = 50, cursor: Optional[str] = None):
+    """
+    Get a page of chats; pass next_cursor back as cursor for the following page.
+    Supports If-None-Match revalidation via ETag.
+    """
     try:
-        chats = get_chat_list(limit)
-        return ChatListResponse(chats=chats)
+        if not get_chat_writer().flush():
+            print("Listing chats while some messages are waiting for a retry")
+
+        def load_payload():
+            chats, next_cursor = get_chat_list(limit, cursor)
+            return ChatListResponse(chats=chats, next_cursor=next_cursor).model_dump()
+
+        return conditional_json(request, ("chats", limit, cursor), get_chat_list_version, load_payload)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to list chats: {str(e)}")
 
 
+@app.get("/api/chats/search", response_model=ChatSearchResponse)
+def search_chats(q: str, limit: int = Query(20, ge=1), offset: int = Query(0, ge=0)):
+    """
+    Full-text search over chat messages with ranked, highlighted snippets.
+    Only the CHAT_SEARCH_MAX_CANDIDATES most recent matches are ranked and paged.
+    """
+    try:
+        if not get_chat_writer().flush():
+            print("Searching chats while some messages are waiting for a retry")
+        results, next_offset = search_messages(q, limit, offset)
+        return ChatSearchResponse(results=results, next_offset=next_offset)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to search chats: {str(e)}")
+
+
 @app.get("/api/chats/{chat_id}", response_model=ChatMessagesResponse)
-def get_chat(chat_id: str):
-    """Get all messages for a specific chat."""
+def get_chat(chat_id: str, request: Request, limit: Optional[int] = None, cursor: Optional[str] = None):
+    """
+    Get messages for a specific chat. Without a limit the whole conversation
+    is returned; with one, the newest page comes first and next_cursor loads
+    older messages. Archived chats are restored on first access. Supports
+    If-None-Match revalidation via ETag.
+    """
     try:
-        messages = get_chat_messages(chat_id)
-        if not messages:
-            raise HTTPException(status_code=404, detail="Chat not found")
-        return ChatMessagesResponse(messages=messages)
+        flush_chat_writes(chat_id)
+
+        def load_version():
+            version = get_chat_version(chat_id)
+            if version is None and restore_archived_chat(chat_id):
+                version = get_chat_version(chat_id)
+            # Older pages (with a cursor) may be empty, but the chat itself must exist
+            if version is None or (cursor is None and not version[1]):
+                raise HTTPException(status_code=404, detail="Chat not found")
+            return version
+
+        def load_payload():
+            messages, next_cursor = get_chat_messages(chat_id, limit, cursor)
+            return ChatMessagesResponse(messages=messages, next_cursor=next_cursor).model_dump()
+
+        return conditional_json(request, ("chat", chat_id, limit, cursor), load_version, load_payload)
     except HTTPException:
         raise
     except Exception as e:
@@ -188,8 +392,11 @@ def get_chat(chat_id: str):
 def save_chat_message(chat_id: str, request: MessageSaveRequest):
     """Save a message to a chat."""
     try:
-        message_id = save_message(chat_id, request.role, request.content, request.citations)
+        require_chat(chat_id)
+        message_id = get_chat_writer().enqueue(chat_id, request.role, request.content, request.citations)
         return MessageSaveResponse(message_id=message_id)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to save message: {str(e)}")
 
@@ -198,8 +405,11 @@ def save_chat_message(chat_id: str, request: MessageSaveRequest):
 def delete_chat_endpoint(chat_id: str):
     """Delete a chat and all its messages."""
     try:
+        get_chat_writer().flush(chat_id)  # Don't let queued messages land after the chat is gone
         success = delete_chat(chat_id)
-        if not success:
+        archived = delete_archive(chat_id)
+        invalidate_chat(chat_id)
+        if not success and not archived:
             raise HTTPException(status_code=404, detail="Chat not found")
         return {"message": "Chat deleted successfully"}
     except HTTPException:
@@ -208,6 +418,18 @@ def delete_chat_endpoint(chat_id: str):
         raise HTTPException(status_code=500, detail=f"Failed to delete chat: {str(e)}")
 
 
+@app.get("/api/stats/routes")
+def route_stats():
+    """Latency per query route (meal plan vs informational) since startup"""
+    return {"routes": get_route_stats().summary()}
+
+
+@app.get("/api/stats/prefetch")
+def prefetch_stats():
+    """Prefetch hit rate and retrieval seconds reused since startup"""
+    return get_prefetch_cache().stats()
+
+
 @app.get("/api/health")
 def health():
     """Health check"""
@@ -5,7 +5,9 @@ from pathlib import Path
 BASE_DIR = Path(__file__).parent
 DATA_DIR = BASE_DIR / "data"
 PDF_DIR = DATA_DIR / "pdfs"
-CHROMA_PATH = str(DATA_DIR / "chroma")
+CHROMA_PATH = str(DATA_DIR / "chroma") # Legacy single-directory index, used until a versioned build exists
+INDEX_DIR = DATA_DIR / "index" # Versioned Chroma builds plus the CURRENT pointer file
+EMBEDDING_CACHE_PATH = str(DATA_DIR / "embedding_cache.db")
 
 
 PDF_DIR.mkdir(parents=True, exist_ok=True)
@@ -22,14 +24,75 @@ LLM_MODEL = "llama3.2:3b" # llama3.2:3b, llama3, mistral:instruct
 
 TEMPERATURE = 0.3 # 0.0
 
-# Chunking
-CHUNK_SIZE = 500
-CHUNK_OVERLAP = 200 
+# Chunking (small-to-big: child chunks are embedded, their parent sections are sent to the LLM)
+CHUNK_SIZE = 400 # Child chunk size
+CHUNK_OVERLAP = 50
+PARENT_CHUNK_SIZE = 2000 # Parent section size, None indexes flat chunks without parents
+PARENT_CHUNK_OVERLAP = 0
+
+# Near-duplicate chunk removal (MinHash + LSH)
+DEDUP_THRESHOLD = 0.85 # Estimated Jaccard similarity to treat chunks as duplicates, None disables
+MINHASH_PERMUTATIONS = 128
+LSH_BANDS = 32
+
+# Ingestion
+INGEST_BATCH_SIZE = 500 # Chunks written to Chroma (and checkpointed) per batch
+INGEST_PREFETCH_BATCHES = 2 # Batches queued on the embedding workers ahead of the one being written
+EMBEDDING_BATCH_SIZE = 64 # Texts per model.encode call
+EMBEDDING_WORKERS = max(1, (os.cpu_count() or 1) // 4) # CPU processes used to embed during ingestion
+EMBEDDING_THREADS_PER_WORKER = 4 # torch threads pinned per worker process
+
+# Index versions (blue/green rebuilds)
+INDEX_GC_GRACE_SECONDS = 600 # Keep a retired version this long so in-flight queries can finish
+INDEX_GC_INTERVAL_SECONDS = 300 # How often the API deletes versions past their grace period
+INDEX_SMOKE_QUERY = "recomendaciones de alimentación para personas con diabetes"
 
 # Retrieval
 TOP_K = 10 # Number of similar documents to retrieve
 SIMILARITY_THRESHOLD = 0.4 
 
+# Diversity selection (maximal marginal relevance) over the chunks above the threshold
+MMR_LAMBDA = 0.7 # 1.0 ranks by relevance only, lower values penalize chunks similar to ones already picked; None disables
+MMR_MAX_CHUNKS = 6 # Max chunks sent to the LLM
+MMR_TOKEN_BUDGET = 2000 # Approximate tokens of retrieved context (parent sections) sent to the LLM
+
+# Speculative prefetch (retrieval warmed while the user is typing)
+PREFETCH_TTL_SECONDS = 60
+PREFETCH_MAX_ENTRIES = 512
+PREFETCH_MIN_SIMILARITY = 0.97 # Cosine similarity for a question to reuse a draft's retrieval
+PREFETCH_MIN_CHARS = 12 # Shorter drafts are not worth prefetching
+
+# Conversation memory
+MEMORY_TURNS = 3 # Most recent user/assistant exchanges kept verbatim
+MEMORY_TOKEN_BUDGET = 1200 # Max tokens of history (summary + verbatim turns) added to the prompt
+MEMORY_TURN_MAX_TOKENS = 300 # Long answers (e.g. meal plans) are cut to this many tokens in history
+SUMMARY_MAX_TOKENS = 300
+
+# Intent routing (short informational questions skip the meal-plan instructions)
+ROUTER_ENABLED = True
+INFO_LLM_MODEL = LLM_MODEL # Model for informational answers; a smaller/faster one can be set here
+INFO_NUM_PREDICT = 400 # Max tokens for informational answers, meal plans stay unbounded
+ROUTER_MARGIN = 0.02 # Min exemplar similarity gap for the embedding classifier to pick informational
+
+# Chat database maintenance
+CHAT_ARCHIVE_DIR = DATA_DIR / "archive" # Compressed cold storage for chats past retention
+CHAT_RETENTION_DAYS = 180 # Archive chats not updated in this many days, None disables
+CHAT_RETENTION_MAX_CHATS = None # Keep at most this many chats in the live database, None disables
+CHAT_VACUUM_INTERVAL_SECONDS = 3600 # How often the API returns free pages to the filesystem
+CHAT_VACUUM_PAGES = 2000 # Max pages freed per incremental vacuum step, keeps each write lock short
+
+# Chat search
+CHAT_SEARCH_MAX_CANDIDATES = 1000 # Most recent matching messages ranked per search; older matches are not returned
+
+# Chat write-behind queue
+CHAT_OUTBOX_PATH = DATA_DIR / "chat_outbox.db" # Messages accepted but not yet committed, replayed after a crash
+CHAT_WRITER_RETRY_SECONDS = 5 # Wait between retry rounds for messages that failed on their own
+CHAT_WRITER_MAX_ATTEMPTS = 12 # Failed rounds before a message is quarantined in the outbox
+
+# Chat API response cache (ETag revalidation)
+CHAT_CACHE_MAX_ENTRIES = 256
+CHAT_CACHE_TTL_SECONDS = 30 # Bounds staleness from writes made outside the API process
+
 # System Prompt
 SYSTEM_PROMPT = """Eres Nourai, asistente de nutrición educativa basado en guías oficiales (FAO, OPS, OMS).
 
@@ -73,6 +136,22 @@ NOTA AL FINAL DEL MENSAJE SIEMPRE:
 
 """
 
+# Shorter system prompt for informational questions (no meal-plan table instructions)
+COMPACT_SYSTEM_PROMPT = """Eres Nourai, asistente de nutrición educativa basado en guías oficiales (FAO, OPS, OMS).
+
+REGLAS CRÍTICAS (NO NEGOCIABLES):
+1. Usas EXCLUSIVAMENTE la información del contexto científico proporcionado
+2. NUNCA inventes datos, cifras, estadísticas o información que no esté en el contexto
+3. Si algo NO está mencionado directamente en el contexto, puedes decir: "Según la información disponible..."
+4. NUNCA menciones las fuentes o nombres de documentos en tu respuesta
+5. Si la pregunta es sobre el paciente ("yo", "mi", "debería") → USA sus datos; si es general → responde de forma genérica
+6. Responde de forma breve y directa
+
+NOTA AL FINAL DEL MENSAJE SIEMPRE:
+- "Nota: Esta información educativa se basa en guías oficiales de nutrición. Consulta con un profesional de salud certificado para asesoramiento médico personalizado."
+
+"""
+
 # Prompt template for RAG
 PROMPT_TEMPLATE = """Contexto de documentos científicos:
 
@@ -83,3 +162,24 @@ PROMPT_TEMPLATE = """Contexto de documentos científicos:
 Pregunta: {question}
 
 Responde basándote únicamente en el contexto anterior."""
+
+# Rewrites a follow-up into a standalone question for retrieval
+CONDENSE_PROMPT = """Dada la conversación previa y una pregunta de seguimiento, reescribe la pregunta de seguimiento para que se entienda por sí sola, sin la conversación. Responde SOLO con la pregunta reescrita.
+
+Conversación previa:
+{history}
+
+Pregunta de seguimiento: {question}
+
+Pregunta independiente:"""
+
+# Folds older messages into the chat's rolling summary
+SUMMARY_PROMPT = """Resume la conversación entre un usuario y Nourai, asistente de nutrición. Conserva datos del paciente, preferencias, restricciones y temas tratados. Máximo {max_words} palabras.
+
+Resumen actual:
+{summary}
+
+Nuevos mensajes:
+{messages}
+
+Resumen actualizado:"""
@@ -0,0 +1,108 @@
+import sys
+from pathlib import Path
+
+# Add parent directory to path to import config when running script on terminal
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from langchain_community.llms.ollama import Ollama
+
+from config import (
+    LLM_MODEL, MEMORY_TURNS, MEMORY_TOKEN_BUDGET, MEMORY_TURN_MAX_TOKENS,
+    SUMMARY_MAX_TOKENS, CONDENSE_PROMPT, SUMMARY_PROMPT
+)
+from utils.chat_db import get_chat_messages, get_messages_between, get_chat_summary, update_chat_summary
+
+ROLE_LABELS = {"user": "Usuario", "assistant": "Asistente"}
+
+# Cap per summary update so a long backlog is folded over several calls, not one huge prompt
+SUMMARY_FOLD_MAX_MESSAGES = 20
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token) for budgeting."""
+    return len(text) // 4 + 1
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    max_chars = max_tokens * 4
+    return text if len(text) <= max_chars else text[:max_chars].rstrip() + "…"
+
+
+def load_conversation(chat_id: str) -> dict:
+    """
+    Bounded conversation memory for a chat: its rolling summary plus the
+    last MEMORY_TURNS exchanges verbatim, trimmed to MEMORY_TOKEN_BUDGET.
+    """
+    summary, _ = get_chat_summary(chat_id)
+    summary = truncate_to_tokens(summary, SUMMARY_MAX_TOKENS) if summary else ""
+
+    recent, _ = get_chat_messages(chat_id, limit=MEMORY_TURNS * 2)
+    turns = [(m["role"], truncate_to_tokens(m["content"], MEMORY_TURN_MAX_TOKENS)) for m in recent]
+
+    # Drop the oldest verbatim turns until everything fits the budget
+    budget = MEMORY_TOKEN_BUDGET - estimate_tokens(summary)
+    while turns and sum(estimate_tokens(content) for _, content in turns) > budget:
+        turns.pop(0)
+
+    return {"summary": summary, "turns": turns}
+
+
+def format_history(history: dict) -> str:
+    """Render conversation memory as plain text."""
+    lines = []
+    if history["summary"]:
+        lines.append(f"Resumen: {history['summary']}")
+    for role, content in history["turns"]:
+        lines.append(f"{ROLE_LABELS.get(role, role)}: {content}")
+    return "\n".join(lines)
+
+
+def build_history_context(history: dict) -> str:
+    """History section for the generation prompt."""
+    text = format_history(history)
+    if not text:
+        return ""
+    return f"\n\nCONVERSACIÓN PREVIA:\n{text}\n"
+
+
+def condense_question(question: str, history: dict) -> str:
+    """Rewrite a follow-up question so retrieval works without the conversation."""
+    text = format_history(history)
+    if not text:
+        return question
+
+    model = Ollama(model=LLM_MODEL, temperature=0, num_predict=96)
+    standalone = model.invoke(CONDENSE_PROMPT.format(history=text, question=question)).strip()
+
+    return standalone or question
+
+
+def update_summary(chat_id: str):
+    """
+    Fold messages that have left the verbatim window into the chat's rolling
+    summary. Only messages newer than the previous summary are sent to the LLM.
+    """
+    summary, summary_upto = get_chat_summary(chat_id)
+
+    recent, _ = get_chat_messages(chat_id, limit=MEMORY_TURNS * 2)
+    if not recent:
+        return
+
+    to_fold = get_messages_between(chat_id, summary_upto, recent[0]["id"])[:SUMMARY_FOLD_MAX_MESSAGES]
+    if not to_fold:
+        return
+
+    messages_text = "\n".join(
+        f"{ROLE_LABELS.get(m['role'], m['role'])}: {truncate_to_tokens(m['content'], MEMORY_TURN_MAX_TOKENS)}"
+        for m in to_fold
+    )
+    prompt = SUMMARY_PROMPT.format(
+        max_words=int(SUMMARY_MAX_TOKENS * 0.75),
+        summary=summary or "(vacío)",
+        messages=messages_text
+    )
+
+    model = Ollama(model=LLM_MODEL, temperature=0, num_predict=SUMMARY_MAX_TOKENS)
+    new_summary = truncate_to_tokens(model.invoke(prompt).strip(), SUMMARY_MAX_TOKENS)
+
+    update_chat_summary(chat_id, new_summary, to_fold[-1]["id"])
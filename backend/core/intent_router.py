@@ -0,0 +1,142 @@
+import re
+import sys
+import threading
+from collections import defaultdict, deque
+from pathlib import Path
+
+# Add parent directory to path to import config when running script on terminal
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import numpy as np
+
+from config import (
+    LLM_MODEL, SYSTEM_PROMPT, COMPACT_SYSTEM_PROMPT, INFO_LLM_MODEL, INFO_NUM_PREDICT,
+    ROUTER_ENABLED, ROUTER_MARGIN
+)
+from utils.embedding_function import get_embedding_function
+
+MEAL_PLAN = "meal_plan"
+INFORMATIONAL = "informational"
+
+# Prompt, model and output cap per route
+ROUTES = {
+    MEAL_PLAN: {"system_prompt": SYSTEM_PROMPT, "model": LLM_MODEL, "num_predict": None},
+    INFORMATIONAL: {"system_prompt": COMPACT_SYSTEM_PROMPT, "model": INFO_LLM_MODEL, "num_predict": INFO_NUM_PREDICT},
+}
+
+# Requests for a plan/menu are unambiguous enough to route without embeddings
+PLAN_PATTERNS = [re.compile(pattern, re.IGNORECASE) for pattern in (
+    r"\bplan(es)?\s+(alimenticio|de\s+comidas|de\s+alimentaci[oó]n|nutricional|semanal|de\s+dieta)",
+    r"\bmen[uú]s?\s+(semanal|de\s+la\s+semana|para)",
+    r"\bdieta\s+(semanal|para\s+(mi|m[ií]|una\s+semana|bajar|perder|subir|ganar|adelgazar))",
+    r"\b(hazme|dame|arma|[aá]rmame|crea|cr[eé]ame|dise[nñ]a|dis[eé][nñ]ame|genera|prop[oó]n(me)?)\b.*\b(dieta|plan|men[uú])",
+    r"\b(7|siete)\s+d[ií]as\b",
+    r"\bqu[eé]\s+(debo|deber[ií]a|puedo)\s+comer\b",
+)]
+
+# Short factual questions
+INFO_PATTERNS = [re.compile(pattern, re.IGNORECASE) for pattern in (
+    r"^\s*¿?\s*(cu[aá]nt[oa]s?|qu[eé]\s+(es|son|significa)|cu[aá]l(es)?|por\s*qu[eé]|c[oó]mo\s+afecta|para\s+qu[eé])\b",
+)]
+INFO_MAX_WORDS = 25
+
+EXEMPLARS = {
+    MEAL_PLAN: [
+        "Hazme un plan de alimentación para esta semana",
+        "Necesito una dieta para bajar de peso",
+        "¿Qué debo comer si tengo diabetes?",
+        "Dame un menú semanal vegetariano",
+        "Organiza mis comidas del día con porciones",
+    ],
+    INFORMATIONAL: [
+        "¿Cuánta fibra se recomienda al día?",
+        "¿Qué es el índice glucémico?",
+        "¿Cuáles son los beneficios de la vitamina D?",
+        "¿Cuántas personas tienen diabetes en América Latina?",
+        "¿Por qué es importante reducir el consumo de sodio?",
+    ],
+}
+
+_exemplar_embeddings = None
+
+
+def normalize_rows(vectors) -> np.ndarray:
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def get_exemplar_embeddings() -> dict:
+    """Embed the route exemplars once and cache them."""
+    global _exemplar_embeddings
+
+    if _exemplar_embeddings is None:
+        embedding_function = get_embedding_function()
+        _exemplar_embeddings = {
+            route: normalize_rows(embedding_function.embed_documents(texts))
+            for route, texts in EXEMPLARS.items()
+        }
+
+    return _exemplar_embeddings
+
+
+def classify_intent(query_text: str, query_embedding=None) -> tuple:
+    """
+    Pick a route for a question: rules first, then nearest exemplar by
+    cosine similarity (reusing the retrieval embedding when the caller has
+    one for this exact text). Ambiguous questions get the full meal-plan
+    prompt. Returns (route, how it was decided).
+    """
+    if not ROUTER_ENABLED:
+        return MEAL_PLAN, "disabled"
+
+    if any(pattern.search(query_text) for pattern in PLAN_PATTERNS):
+        return MEAL_PLAN, "rule"
+    if len(query_text.split()) <= INFO_MAX_WORDS and any(pattern.search(query_text) for pattern in INFO_PATTERNS):
+        return INFORMATIONAL, "rule"
+
+    if query_embedding is None:
+        query_embedding = get_embedding_function().embed_query(query_text)
+    query_vector = normalize_rows(query_embedding)[0]
+
+    scores = {route: float((vectors @ query_vector).max()) for route, vectors in get_exemplar_embeddings().items()}
+    if scores[INFORMATIONAL] - scores[MEAL_PLAN] >= ROUTER_MARGIN:
+        return INFORMATIONAL, "embedding"
+    return MEAL_PLAN, "embedding"
+
+
+class RouteStats:
+    """Recent end-to-end latencies per route, for the stats endpoint."""
+
+    def __init__(self, window: int = 1000):
+        self._latencies = defaultdict(lambda: deque(maxlen=window))
+        self._counts = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def record(self, route: str, seconds: float):
+        with self._lock:
+            self._latencies[route].append(seconds)
+            self._counts[route] += 1
+
+    def summary(self) -> dict:
+        with self._lock:
+            snapshot = {route: list(values) for route, values in self._latencies.items()}
+            counts = dict(self._counts)
+
+        summary = {}
+        for route, values in snapshot.items():
+            p50, p90, p99 = np.percentile(values, [50, 90, 99])
+            summary[route] = {
+                "count": counts[route],
+                "mean_seconds": round(float(np.mean(values)), 3),
+                "p50_seconds": round(float(p50), 3),
+                "p90_seconds": round(float(p90), 3),
+                "p99_seconds": round(float(p99), 3),
+            }
+        return summary
+
+
+_route_stats = RouteStats()
+
+
+def get_route_stats() -> RouteStats:
+    return _route_stats
@@ -0,0 +1,64 @@
+import argparse
+import sys
+from pathlib import Path
+
+# Add parent directory to path to import config when running script on terminal
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from config import CHAT_RETENTION_DAYS, CHAT_RETENTION_MAX_CHATS
+from utils.chat_maintenance import (
+    run_maintenance, restore_chat, list_archived, database_size, format_bytes
+)
+
+
+def print_size(label: str, size: dict):
+    print(f"   {label}: {format_bytes(size['file_bytes'])} "
+          f"({format_bytes(size['free_bytes'])} free, WAL {format_bytes(size['wal_bytes'])})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Archive old chats and compact the chat database")
+    parser.add_argument("--days", type=int, default=CHAT_RETENTION_DAYS,
+                        help="Archive chats not updated in this many days")
+    parser.add_argument("--max-chats", type=int, default=CHAT_RETENTION_MAX_CHATS,
+                        help="Keep at most this many chats in the live database")
+    parser.add_argument("--no-retention", action="store_true", help="Only clean orphans and vacuum")
+    parser.add_argument("--no-vacuum", action="store_true", help="Skip the incremental vacuum")
+    parser.add_argument("--restore", metavar="CHAT_ID", help="Restore an archived chat and exit")
+    parser.add_argument("--list-archived", action="store_true", help="List archived chat IDs and exit")
+    parser.add_argument("--stats", action="store_true", help="Print database size and exit")
+    args = parser.parse_args()
+
+    if args.restore:
+        if not restore_chat(args.restore):
+            print(f"No archive found for {args.restore}")
+            sys.exit(1)
+        return
+
+    if args.list_archived:
+        archived = list_archived()
+        print("\n".join(archived))
+        print(f"\n{len(archived)} archived chats")
+        return
+
+    if args.stats:
+        print("\nChat database")
+        print_size("Size", database_size())
+        return
+
+    days, max_chats = (None, None) if args.no_retention else (args.days, args.max_chats)
+    report = run_maintenance(days, max_chats, vacuum=not args.no_vacuum)
+
+    print("\nChat database maintenance")
+    print(f"   Archived chats: {report['archived']}")
+    print(f"   Orphans removed: {report['orphans']['messages']} messages, "
+          f"{report['orphans']['message_sources']} sources")
+    if "pages_freed" in report:
+        print(f"   Pages freed: {report['pages_freed']}")
+    print_size("Before", report["size_before"])
+    print_size("After", report["size_after"])
+    print("   Timings: " + ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in report["timings"].items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+import argparse
+import sys
+from pathlib import Path
+
+# Add parent directory to path to import config when running script on terminal
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from langchain_community.vectorstores import Chroma
+from langchain_core.documents import Document
+
+from core.populate_database import validate_index, make_chunk_id
+from utils.embedding_function import get_embedding_function
+from utils.index_versions import get_active_chroma_path, create_version_dir, activate_version, gc_versions
+from utils.document_index_utils import get_document_catalog, normalize_path, UNINDEXED_PREFIX
+
+
+def compact_metadata(metadata: dict) -> dict:
+    """Map legacy per-chunk citation fields to {doc_id, chunk_index}."""
+    if "doc_id" in metadata:
+        return metadata
+
+    catalog = get_document_catalog()
+    source = metadata.get("source", "")
+
+    doc = catalog.find_by_path(source) if source else None
+    if doc is None and metadata.get("title"):
+        doc = catalog.find_by_title(metadata["title"])
+
+    if doc:
+        doc_id = doc["id"]
+    else:
+        doc_id = UNINDEXED_PREFIX + normalize_path(source or metadata.get("filename", "unknown"))
+
+    compact = {"doc_id": doc_id, "chunk_index": metadata.get("chunk_index", 0)}
+    if metadata.get("duplicate_doc_ids"):
+        compact["duplicate_doc_ids"] = metadata["duplicate_doc_ids"]
+    return compact
+
+
+def migrate(page_size: int):
+    """
+    Copy the active collection into a new index version with compact
+    metadata (embeddings are reused, nothing is re-embedded), validate it
+    and swap it in. Chunks get the deterministic doc_id:chunk_index ids of
+    add_to_chroma, so a later incremental populate overwrites them instead
+    of adding copies. Chunks whose index is missing or repeated are
+    renumbered after the highest index of their document.
+    """
+    source_path = get_active_chroma_path()
+    source_db = Chroma(persist_directory=source_path, embedding_function=get_embedding_function())
+    total = source_db._collection.count()
+
+    target_path = create_version_dir()
+    target_db = Chroma(persist_directory=str(target_path), embedding_function=get_embedding_function())
+    print(f"Migrating {total} chunks from {source_path} to {target_path.name}")
+
+    # Highest legacy index per document, so renumbered chunks never take an index that is in use
+    last_index = {}  # doc_id -> highest chunk_index assigned
+    for offset in range(0, total, page_size):
+        page = source_db._collection.get(offset=offset, limit=page_size, include=["metadatas"])
+        for metadata in map(compact_metadata, (m or {} for m in page["metadatas"])):
+            last_index[metadata["doc_id"]] = max(last_index.get(metadata["doc_id"], 0), metadata["chunk_index"])
+
+    migrated = 0
+    used_ids = set()
+    renumbered = 0
+    for offset in range(0, total, page_size):
+        page = source_db._collection.get(
+            offset=offset,
+            limit=page_size,
+            include=["embeddings", "documents", "metadatas"]
+        )
+        metadatas = [compact_metadata(m or {}) for m in page["metadatas"]]
+        ids = []
+        for metadata, text in zip(metadatas, page["documents"]):
+            chunk_id = make_chunk_id(Document(page_content=text, metadata=metadata))
+            if chunk_id in used_ids:
+                last_index[metadata["doc_id"]] += 1
+                metadata["chunk_index"] = last_index[metadata["doc_id"]]
+                chunk_id = make_chunk_id(Document(page_content=text, metadata=metadata))
+                renumbered += 1
+            used_ids.add(chunk_id)
+            ids.append(chunk_id)
+
+        target_db._collection.add(
+            ids=ids,
+            embeddings=page["embeddings"],
+            documents=page["documents"],
+            metadatas=metadatas
+        )
+        migrated += len(page["ids"])
+        print(f"\r  {migrated}/{total} chunks", end="", flush=True)
+    print()
+    if renumbered:
+        print(f"  {renumbered} chunks had a missing or repeated chunk_index and were renumbered")
+
+    if not validate_index(str(target_path), total):
+        print(f"Keeping the current index; failed migration left at {target_path}")
+        return
+
+    activate_version(target_path)
+    gc_versions()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate chunk metadata to compact document IDs")
+    parser.add_argument("--page-size", type=int, default=1000, help="Chunks copied per page")
+    args = parser.parse_args()
+
+    migrate(args.page_size)
+
+    print("\nDone!")
+
+
+if __name__ == "__main__":
+    main()
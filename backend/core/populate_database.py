@@ -1,5 +1,8 @@
 import argparse
-import shutil
+import json
+import math
+import time
+from collections import deque
 from pathlib import Path
 import sys
 
@@ -10,29 +13,96 @@ from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_core.documents import Document
 from langchain_community.vectorstores import Chroma
 
-from config import PDF_DIR, CHROMA_PATH, CHUNK_SIZE, CHUNK_OVERLAP
+from config import (
+    PDF_DIR, CHUNK_SIZE, CHUNK_OVERLAP, PARENT_CHUNK_SIZE, PARENT_CHUNK_OVERLAP, EMBEDDING_MODEL, EMBEDDING_BATCH_SIZE,
+    EMBEDDING_WORKERS, EMBEDDING_THREADS_PER_WORKER, INGEST_BATCH_SIZE, INGEST_PREFETCH_BATCHES,
+    DEDUP_THRESHOLD, MINHASH_PERMUTATIONS, LSH_BANDS, INDEX_SMOKE_QUERY
+)
 
 from utils.pdf_utils import load_pdfs_from_directory
 from utils.embedding_function import get_embedding_function
+from utils.embedding_cache import EmbeddingCache
+from utils.embedding_engine import EmbeddingEngine
+from utils.dedup import find_near_duplicates
+from utils.index_versions import get_active_chroma_path, create_version_dir, activate_version, gc_versions
+from utils.ingest_checkpoint import IngestCheckpoint, fingerprint_chunks
+from utils.parent_store import ParentStore
 
 
-def create_chunk_metadata(document: dict, chunk_index: int) -> dict:
-    """Build metadata for a document chunk."""
-    return {
-        "source": document["source"],
-        "filename": document["filename"],
-        "title": document.get("title", document["filename"]),
-        "organization": document.get("organization", "Organización no especificada"),
-        "organization_acronym": document.get("organization_acronym", ""),
-        "year": document.get("year"),
-        "author": document.get("author", "Autor no especificado"),
-        "link": document.get("link"),
+def create_chunk_metadata(document: dict, chunk_index: int, parent_id: str = None) -> dict:
+    """
+    Build metadata for a document chunk.
+    Only the document ID (and parent section ID) is stored; citation fields
+    are resolved from the document catalog at query time.
+    """
+    metadata = {
+        "doc_id": document["doc_id"],
         "chunk_index": chunk_index
     }
+    if parent_id is not None:
+        metadata["parent_id"] = parent_id
+    return metadata
+
+
+def deduplicate_chunks(chunks: list[Document], threshold: float) -> list[Document]:
+    """
+    Drop near-duplicate chunks across documents. Chunks of the same
+    document are never merged, so repeated headers or table rows within a
+    document are kept. The kept chunk records every other document it
+    stood for in `duplicate_doc_ids`.
+    """
+    duplicates = find_near_duplicates(
+        [chunk.page_content for chunk in chunks],
+        threshold=threshold,
+        num_perm=MINHASH_PERMUTATIONS,
+        bands=LSH_BANDS,
+        groups=[chunk.metadata["doc_id"] for chunk in chunks]
+    )
+
+    merged_doc_ids = {}
+    for dup_idx, rep_idx in duplicates.items():
+        merged_doc_ids.setdefault(rep_idx, []).append(chunks[dup_idx].metadata["doc_id"])
+
+    kept = []
+    for i, chunk in enumerate(chunks):
+        if i in duplicates:
+            continue
+        if merged_doc_ids.get(i):
+            # Chroma metadata only holds scalars, so the list is stored as JSON
+            chunk.metadata["duplicate_doc_ids"] = json.dumps(merged_doc_ids[i], ensure_ascii=False)
+        kept.append(chunk)
 
+    before_chars = sum(len(chunk.page_content) for chunk in chunks)
+    after_chars = sum(len(chunk.page_content) for chunk in kept)
+    shrink = (1 - len(kept) / len(chunks)) * 100 if chunks else 0.0
+    print(f"Deduplication (threshold {threshold}): {len(chunks)} -> {len(kept)} chunks "
+          f"({len(duplicates)} removed, {shrink:.1f}% smaller, {before_chars - after_chars} chars saved)")
 
-def chunk_documents(documents: list[dict]) -> list[Document]:
-    """Split all documents into chunks."""
+    return kept
+
+
+def split_parents(document: dict, parent_chunk_size: int) -> list[tuple]:
+    """(parent_id, text) sections of a document; the whole text is one section when parents are disabled."""
+    if parent_chunk_size is None:
+        return [(None, document["content"])]
+
+    parent_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=parent_chunk_size,
+        chunk_overlap=PARENT_CHUNK_OVERLAP,
+        length_function=len,
+    )
+    return [(f"{document['doc_id']}:p{i}", text) for i, text in enumerate(parent_splitter.split_text(document["content"]))]
+
+
+def chunk_documents(documents: list[dict], dedup_threshold: float = DEDUP_THRESHOLD,
+                    parent_chunk_size: int = PARENT_CHUNK_SIZE) -> tuple:
+    """
+    Split all documents into chunks, dropping near-duplicates across documents.
+    With parent_chunk_size, documents are first split into parent sections and
+    the chunks (children) are cut from those, each carrying its parent_id.
+    Returns (chunks, {parent_id: (doc_id, text)}) with only the parents some
+    kept chunk points to.
+    """
     # Create text splitter once for all documents
     text_splitter = RecursiveCharacterTextSplitter(
         chunk_size=CHUNK_SIZE,
@@ -41,67 +111,283 @@ def chunk_documents(documents: list[dict]) -> list[Document]:
     )
 
     all_chunks = []
+    parents = {}
 
     for doc in documents:
-        text_chunks = text_splitter.split_text(doc["content"])
+        sections = split_parents(doc, parent_chunk_size)
+        chunk_index = 0
 
-        for i, chunk_text in enumerate(text_chunks):
-            chunk = Document(
-                page_content=chunk_text,
-                metadata=create_chunk_metadata(doc, i)
-            )
-            all_chunks.append(chunk)
+        for parent_id, section_text in sections:
+            if parent_id is not None:
+                parents[parent_id] = (doc["doc_id"], section_text)
+
+            for chunk_text in text_splitter.split_text(section_text):
+                chunk = Document(
+                    page_content=chunk_text,
+                    metadata=create_chunk_metadata(doc, chunk_index, parent_id)
+                )
+                all_chunks.append(chunk)
+                chunk_index += 1
+
+        if parent_chunk_size is None:
+            print(f"Created {chunk_index} chunks from {doc['filename']}")
+        else:
+            print(f"Created {chunk_index} chunks in {len(sections)} parent sections from {doc['filename']}")
+
+    if dedup_threshold is not None:
+        all_chunks = deduplicate_chunks(all_chunks, dedup_threshold)
+
+    used = {chunk.metadata.get("parent_id") for chunk in all_chunks}
+    parents = {parent_id: parent for parent_id, parent in parents.items() if parent_id in used}
+
+    return all_chunks, parents
+
+
+def make_chunk_id(chunk: Document) -> str:
+    """Deterministic chunk ID so re-adding a chunk overwrites it instead of duplicating it."""
+    return f"{chunk.metadata['doc_id']}:{chunk.metadata['chunk_index']}"
 
-        print(f"Created {len(text_chunks)} chunks from {doc['filename']}")
 
-    return all_chunks
+def format_duration(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}"
 
 
-def add_to_chroma(chunks: list[Document]):
+def print_progress(done_chunks: int, total_chunks: int, done_batches: int, total_batches: int, rate: float):
+    """Single-line progress with an ETA from the throughput measured in this run."""
+    eta = format_duration((total_chunks - done_chunks) / rate) if rate else "--:--:--"
+    print(f"\r  Batch {done_batches}/{total_batches} | {done_chunks}/{total_chunks} chunks | "
+          f"{rate:.1f} chunks/s | ETA {eta}", end="", flush=True)
+
+
+def add_to_chroma(chunks: list[Document], persist_directory: str, workers: int = EMBEDDING_WORKERS,
+                  checkpoint: IngestCheckpoint = None):
     """
     Add chunks to ChromaDB in batches.
+    Embeddings are looked up in the persistent embedding cache first,
+    so only chunks whose text changed get re-embedded. Misses are embedded
+    by a multi-process engine when more than one worker is requested; the
+    next batches' misses are queued on it while the current batch is
+    written, and the parent process never loads the model.
+    With a checkpoint, already committed batches are skipped and progress
+    is recorded after every batch.
     """
+    engine = None
+    if workers > 1:
+        engine = EmbeddingEngine(workers, EMBEDDING_THREADS_PER_WORKER)
+        embedding_function = None  # Chroma only receives precomputed vectors
+    else:
+        embedding_function = get_embedding_function()
 
     db = Chroma(
-        persist_directory=CHROMA_PATH,
-        embedding_function=get_embedding_function()
+        persist_directory=persist_directory,
+        embedding_function=embedding_function
     )
+    cache = EmbeddingCache(EMBEDDING_MODEL)
 
-    batch_size = 5000
     total = len(chunks)
+    batches = [chunks[i:i + INGEST_BATCH_SIZE] for i in range(0, total, INGEST_BATCH_SIZE)]
+
+    def submit_batch(batch_index: int) -> tuple:
+        """Look a batch up in the cache and queue its misses on the engine."""
+        texts = [chunk.page_content for chunk in batches[batch_index]]
+        hashes, cached, pending = cache.lookup(texts)
+        return texts, hashes, cached, pending, engine.submit(list(pending.values()))
+
+    def collect_batch(texts: list, hashes: list, cached: dict, pending: dict, submission: list) -> tuple:
+        new_items = dict(zip(pending, engine.collect(submission)))
+        cache.put_many(new_items)
+        cached.update(new_items)
+        return texts, [cached[h] for h in hashes]
+
+    # A file is complete once the batch holding its last chunk is committed
+    file_last_batch = {}
+    for batch_index, batch in enumerate(batches):
+        for chunk in batch:
+            file_last_batch[chunk.metadata["doc_id"]] = batch_index
+
+    start_batch = checkpoint.completed_batches if checkpoint else 0
+    done_chunks = sum(len(batch) for batch in batches[:start_batch])
+    processed = 0
+    start_time = time.time()
+
+    in_flight = deque()
+    next_submit = start_batch
 
-    for i in range(0, total, batch_size):
-        batch = chunks[i:i + batch_size]
-        #print(f"Adding batch {i // batch_size + 1} ({len(batch)} chunks)")
-        db.add_documents(batch)
+    try:
+        for batch_index in range(start_batch, len(batches)):
+            batch = batches[batch_index]
+
+            if engine:
+                while next_submit < min(batch_index + 1 + INGEST_PREFETCH_BATCHES, len(batches)):
+                    in_flight.append(submit_batch(next_submit))
+                    next_submit += 1
+                texts, embeddings = collect_batch(*in_flight.popleft())
+            else:
+                texts = [chunk.page_content for chunk in batch]
+                embeddings = cache.embed(texts, embedding_function.embed_documents, batch_size=EMBEDDING_BATCH_SIZE)
+
+            # Upsert with deterministic IDs: replaying a half-written batch never duplicates
+            db._collection.upsert(
+                ids=[make_chunk_id(chunk) for chunk in batch],
+                embeddings=embeddings,
+                documents=texts,
+                metadatas=[chunk.metadata for chunk in batch]
+            )
+
+            if checkpoint:
+                checkpoint.completed_batches = batch_index + 1
+                checkpoint.completed_files = [name for name, last in file_last_batch.items() if last <= batch_index]
+                checkpoint.save()
+
+            processed += len(batch)
+            done_chunks += len(batch)
+            rate = processed / (time.time() - start_time)
+            print_progress(done_chunks, total, batch_index + 1, len(batches), rate)
+        print()
+    finally:
+        cache.close()
+        if engine:
+            engine.close()
+
+    if cache.hit_ratio is not None:
+        print(f"Embedding cache: {cache.hits} hits, {cache.misses} misses ({cache.hit_ratio*100:.1f}% hit ratio)")
+    if engine and engine.embedded:
+        print(f"Embedded {engine.embedded} chunks with {workers} workers at {engine.throughput:.1f} chunks/sec")
 
     #print(f"Total documents in database: {db._collection.count()}")
 
 
-def clear_database():
-    """Clear the ChromaDB database."""
-    if Path(CHROMA_PATH).exists():
-        shutil.rmtree(CHROMA_PATH)
-        print("Database cleared")
+def write_parents(parents: dict, persist_directory: str):
+    """Store parent sections next to the vectors of an index version."""
+    if not parents:
+        return
+
+    store = ParentStore(persist_directory)
+    try:
+        items = list(parents.items())
+        for i in range(0, len(items), INGEST_BATCH_SIZE):
+            store.put_many(dict(items[i:i + INGEST_BATCH_SIZE]))
+    finally:
+        store.close()
+
+    text_chars = sum(len(text) for _, text in parents.values())
+    file_bytes = store.db_path.stat().st_size
+    print(f"Stored {len(parents)} parent sections ({text_chars} chars in a {file_bytes} byte store)")
+
+
+def validate_index(persist_directory: str, expected_chunks: int, expected_parents: int = 0) -> bool:
+    """Check a freshly built index before it is made active."""
+    db = Chroma(
+        persist_directory=persist_directory,
+        embedding_function=get_embedding_function()
+    )
+
+    count = db._collection.count()
+    if count != expected_chunks:
+        print(f"Validation failed: expected {expected_chunks} chunks, found {count}")
+        return False
+
+    results = db.similarity_search_with_score(INDEX_SMOKE_QUERY, k=1)
+    if not results:
+        print("Validation failed: smoke query returned no results")
+        return False
+
+    if expected_parents:
+        store = ParentStore(persist_directory)
+        parent_count = store.count()
+        store.close()
+        if parent_count != expected_parents:
+            print(f"Validation failed: expected {expected_parents} parent sections, found {parent_count}")
+            return False
+
+    print(f"Validation passed: {count} chunks, smoke query OK")
+    return True
+
+
+def run_ingestion(chunks: list[Document], parents: dict, reset: bool, resume: bool, workers: int):
+    """
+    Ingest chunks (and their parent sections) under a durable checkpoint.
+    With reset, a new index version is built next to the active one and
+    swapped in atomically once validated, so the API keeps serving the old
+    version during the build. With resume, an interrupted run over the same
+    chunks continues from its last committed batch.
+    """
+    # Versions retired by earlier rebuilds are past their grace period by now
+    gc_versions()
+
+    fingerprint = fingerprint_chunks([make_chunk_id(chunk) for chunk in chunks],
+                                     [chunk.page_content for chunk in chunks])
+    total_batches = math.ceil(len(chunks) / INGEST_BATCH_SIZE)
+
+    checkpoint = IngestCheckpoint.load() if resume else None
+    if checkpoint and (checkpoint.fingerprint != fingerprint or checkpoint.reset != reset
+                       or not Path(checkpoint.target).exists()):
+        print("Checkpoint does not match the current documents or mode; starting over")
+        checkpoint = None
+
+    if checkpoint:
+        print(f"Resuming: {checkpoint.completed_batches}/{total_batches} batches and "
+              f"{len(checkpoint.completed_files)} files already committed")
+    else:
+        if reset:
+            target = str(create_version_dir())
+            print(f"Building index version {Path(target).name}")
+        else:
+            target = get_active_chroma_path()
+        checkpoint = IngestCheckpoint(target, fingerprint, total_batches, reset)
+        checkpoint.save()
+
+    # Parents first: rewriting them is idempotent, so a resumed run can simply repeat it
+    write_parents(parents, checkpoint.target)
+    add_to_chroma(chunks, checkpoint.target, workers=workers, checkpoint=checkpoint)
+    IngestCheckpoint.clear()
+
+    if not reset:
+        return
+
+    if not validate_index(checkpoint.target, len(chunks), len(parents)):
+        print(f"Keeping the current index; failed build left at {checkpoint.target}")
+        return
+
+    activate_version(Path(checkpoint.target))
+    gc_versions()
+
 
 def main():
     parser = argparse.ArgumentParser(description="Populate ChromaDB with PDFs")
-    parser.add_argument("--reset", action="store_true", help="Clear database before populating")
+    parser.add_argument("--reset", action="store_true",
+                        help="Rebuild the index into a new version and swap it in when validated")
+    parser.add_argument("--dedup-threshold", type=float, default=DEDUP_THRESHOLD,
+                        help="Similarity above which chunks are treated as near-duplicates")
+    parser.add_argument("--no-dedup", action="store_true", help="Keep near-duplicate chunks")
+    parser.add_argument("--no-parents", action="store_true",
+                        help="Index flat chunks without parent sections")
+    parser.add_argument("--workers", type=int, default=EMBEDDING_WORKERS,
+                        help="Embedding worker processes (1 embeds in-process)")
+    parser.add_argument("--resume", action="store_true",
+                        help="Continue an interrupted run from its last committed batch")
     args = parser.parse_args()
 
-    if args.reset:
-        clear_database()
-
     documents = load_pdfs_from_directory(PDF_DIR)
 
     if not documents:
         print("No documents found!")
         return
 
-    chunks = chunk_documents(documents)
-    print(f"Total chunks: {len(chunks)}")
+    chunks, parents = chunk_documents(
+        documents,
+        dedup_threshold=None if args.no_dedup else args.dedup_threshold,
+        parent_chunk_size=None if args.no_parents else PARENT_CHUNK_SIZE
+    )
+    print(f"Total chunks: {len(chunks)}" + (f" in {len(parents)} parent sections" if parents else ""))
 
-    add_to_chroma(chunks)
+    try:
+        run_ingestion(chunks, parents, reset=args.reset, resume=args.resume, workers=args.workers)
+    except KeyboardInterrupt:
+        print("\nInterrupted. Run again with --resume to continue from the last committed batch.")
+        sys.exit(130)
 
     print("\nDone!")
 
@@ -1,16 +1,29 @@
 import argparse
+import hashlib
+import json
 import sys
+import time
 from pathlib import Path
 
 # Add parent directory to path to import config when running script on terminal
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
+import numpy as np
 from langchain_community.vectorstores import Chroma
+from langchain_core.documents import Document
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_community.llms.ollama import Ollama
 
-from config import CHROMA_PATH, LLM_MODEL, TOP_K, SIMILARITY_THRESHOLD, SYSTEM_PROMPT, PROMPT_TEMPLATE, TEMPERATURE
+from config import TOP_K, SIMILARITY_THRESHOLD, PROMPT_TEMPLATE, TEMPERATURE, MMR_LAMBDA, MMR_MAX_CHUNKS, MMR_TOKEN_BUDGET
 from utils.embedding_function import get_embedding_function
+from utils.index_versions import get_active_chroma_path
+from utils.document_index_utils import resolve_doc_id
+from utils.parent_store import get_parent_store
+from utils.prefetch_cache import get_prefetch_cache, get_prefetch_slots, normalize_query
+from core.conversation import (
+    load_conversation, condense_question, format_history, build_history_context, estimate_tokens
+)
+from core.intent_router import ROUTES, classify_intent, get_route_stats
 
 
 def build_clinical_context(clinical_data: dict) -> str:
@@ -60,6 +73,89 @@ def expand_diet_query(query_text: str) -> str:
     return query_text
 
 
+def search_with_embeddings(db: Chroma, query_embedding: list, k: int) -> tuple:
+    """
+    Nearest chunks as (doc, distance) pairs, closest first, plus their stored
+    embeddings as a (k, dim) array, from a single collection query.
+    """
+    results = db._collection.query(
+        query_embeddings=[query_embedding],
+        n_results=k,
+        include=["documents", "metadatas", "distances", "embeddings"]
+    )
+    docs = [
+        (Document(page_content=text, metadata=metadata or {}), distance)
+        for text, metadata, distance in zip(results["documents"][0], results["metadatas"][0], results["distances"][0])
+    ]
+    return docs, np.asarray(results["embeddings"][0], dtype=np.float32)
+
+
+def mmr_select(query_embedding: list, embeddings: np.ndarray, token_counts: list,
+               lambda_mult: float = MMR_LAMBDA, max_chunks: int = MMR_MAX_CHUNKS,
+               token_budget: int = MMR_TOKEN_BUDGET) -> tuple:
+    """
+    Maximal marginal relevance over candidate embeddings: repeatedly pick the
+    chunk maximizing lambda * sim(query) - (1 - lambda) * max sim(picked),
+    skipping chunks that no longer fit the token budget. Cosine similarities
+    come from one matrix product. The first pick is always kept so a single
+    long chunk still produces an answer. Returns (indices, scores) in pick order.
+    """
+    vectors = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+    query_vector = np.asarray(query_embedding, dtype=np.float32)
+    relevance = vectors @ (query_vector / np.linalg.norm(query_vector))
+    pairwise = vectors @ vectors.T
+
+    tokens = np.asarray(token_counts)
+    available = np.ones(len(vectors), dtype=bool)
+    redundancy = np.zeros(len(vectors), dtype=np.float32)
+    remaining = token_budget
+    selected, scores = [], []
+
+    while len(selected) < max_chunks:
+        if selected:
+            available &= tokens <= remaining
+        if not available.any():
+            break
+        mmr = np.where(available, lambda_mult * relevance - (1 - lambda_mult) * redundancy, -np.inf)
+        best = int(np.argmax(mmr))
+        selected.append(best)
+        scores.append(float(mmr[best]))
+        available[best] = False
+        redundancy = np.maximum(redundancy, pairwise[best])
+        remaining -= tokens[best]
+
+    return selected, scores
+
+
+def expand_to_parents(chunks: list, store, token_budget: int = MMR_TOKEN_BUDGET) -> list:
+    """
+    Replace each (chunk, similarity) by its parent section, best chunk first.
+    Parents already used are skipped, and so are parents that no longer fit
+    the token budget (the first one is always kept). Chunks without a stored
+    parent are used as they are.
+    """
+    parent_texts = store.get_many([doc.metadata["parent_id"] for doc, _ in chunks if "parent_id" in doc.metadata])
+
+    expanded = []
+    seen = set()
+    remaining = token_budget
+    for doc, similarity in chunks:
+        parent_id = doc.metadata.get("parent_id")
+        if parent_id in parent_texts:
+            if parent_id in seen:
+                continue
+            seen.add(parent_id)
+            doc = Document(page_content=parent_texts[parent_id], metadata=doc.metadata)
+
+        tokens = estimate_tokens(doc.page_content)
+        if expanded and tokens > remaining:
+            continue
+        expanded.append((doc, similarity))
+        remaining -= tokens
+
+    return expanded
+
+
 def filter_by_similarity(results: list) -> list:
     """Filter search results by similarity threshold."""
     filtered = []
@@ -71,8 +167,16 @@ def filter_by_similarity(results: list) -> list:
 
 
 def extract_source_info(doc, score: float) -> dict:
-    """Extract source metadata from a document."""
+    """Extract source metadata from a document, resolving compact doc IDs through the catalog."""
+    if "doc_id" in doc.metadata:
+        return {
+            **resolve_doc_id(doc.metadata["doc_id"]),
+            "similarity": f"{score*100:.1f}%"
+        }
+
+    # Chunks indexed before metadata was compacted carry the full citation fields
     return {
+        "doc_id": None,
         "title": doc.metadata.get("title", doc.metadata.get("filename", "Unknown")),
         "organization": doc.metadata.get("organization", "Organización no especificada"),
         "organization_acronym": doc.metadata.get("organization_acronym", ""),
@@ -83,53 +187,244 @@ def extract_source_info(doc, score: float) -> dict:
     }
 
 
-def query_rag(query_text: str, top_k: int = TOP_K, clinical_data: dict = None) -> dict:
+def extract_sources(docs: list) -> list:
     """
-    Query the RAG system and get an answer with sources.
+    Source info for each (doc, similarity), each followed by the documents
+    whose identical text was merged into that chunk at ingestion
+    (`duplicate_doc_ids`), so those documents are still cited.
+    """
+    sources = []
+    for doc, score in docs:
+        sources.append(extract_source_info(doc, score))
+        for doc_id in json.loads(doc.metadata.get("duplicate_doc_ids") or "[]"):
+            sources.append({**resolve_doc_id(doc_id), "similarity": f"{score*100:.1f}%"})
+    return sources
+
+
+def trace_chunk(doc, distance: float = None, similarity: float = None) -> dict:
+    chunk = {"content": doc.page_content, "metadata": doc.metadata}
+    if distance is not None:
+        chunk["distance"] = distance
+    chunk["similarity"] = similarity if similarity is not None else 1 / (1 + distance)
+    return chunk
+
+
+def generation_stats(info: dict) -> dict:
+    """Token counts and decode speed from Ollama's final response (durations are in ns)."""
+    stats = {
+        "prompt_tokens": info.get("prompt_eval_count"),
+        "completion_tokens": info.get("eval_count"),
+    }
+    if info.get("eval_count") and info.get("eval_duration"):
+        stats["tokens_per_second"] = info["eval_count"] / (info["eval_duration"] / 1e9)
+    return stats
+
+
+class StageTimer:
+    """Seconds spent in each stage, measured between consecutive lap() calls."""
+
+    def __init__(self):
+        self.timings = {}
+        self.start = self._last = time.perf_counter()
+
+    def lap(self, stage: str):
+        now = time.perf_counter()
+        self.timings[stage] = now - self._last
+        self._last = now
+
+    def mark(self):
+        """Start the next stage now without recording the time since the last lap."""
+        self._last = time.perf_counter()
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start
+
+
+def embed_question(question: str) -> tuple:
+    """Expanded search text for a question and its query embedding."""
+    search_query = expand_diet_query(question)
+    return search_query, get_embedding_function().embed_query(search_query)
+
+
+def retrieve(question: str, search_query: str, query_embedding: list, top_k: int, index_path: str) -> dict:
+    """
+    Everything between embedding and prompt building, which depends only on
+    the question: route, nearest chunks, similarity filter, MMR selection and
+    parent expansion. Returns the trace fields, "context_docs" as
+    (doc, similarity) pairs for the prompt and the stage timings; this is
+    what the prefetch cache stores.
     """
-    # Load the vector database
+    timer = StageTimer()
+    retrieval = {"timings": timer.timings, "question": question, "search_query": search_query}
+
+    # The retrieval embedding is reused only when expansion left the question unchanged
+    route, route_method = classify_intent(question, query_embedding if search_query == question else None)
+    retrieval["route"] = route
+    retrieval["route_method"] = route_method
+    timer.lap("route")
+
     db = Chroma(
-        persist_directory=CHROMA_PATH,
+        persist_directory=index_path,
         embedding_function=get_embedding_function()
     )
+    results, candidate_embeddings = search_with_embeddings(db, query_embedding, top_k)
+    retrieval["retrieved"] = [trace_chunk(doc, distance=distance) for doc, distance in results]
+    timer.lap("search")
 
-    # Search the database
-    search_query = expand_diet_query(query_text)
-    results = db.similarity_search_with_score(search_query, k=top_k)
+    # Filter by similarity threshold
+    context_docs = filter_by_similarity(results)
+    retrieval["filtered"] = [trace_chunk(doc, similarity=similarity) for doc, similarity in context_docs]
+
+    # Diversify: results are sorted by distance, so the filtered chunks are a prefix of the candidates
+    if context_docs and MMR_LAMBDA is not None:
+        selected, mmr_scores = mmr_select(
+            query_embedding,
+            candidate_embeddings[:len(context_docs)],
+            [estimate_tokens(doc.page_content) for doc, _ in context_docs]
+        )
+        context_docs = [context_docs[i] for i in selected]
+        retrieval["mmr"] = {"lambda": MMR_LAMBDA, "selected": selected, "scores": mmr_scores}
+    retrieval["selected"] = [trace_chunk(doc, similarity=similarity) for doc, similarity in context_docs]
+    timer.lap("mmr")
+
+    # Small-to-big: the LLM gets the parent sections of the selected chunks
+    parent_store = get_parent_store(index_path)
+    if context_docs and parent_store is not None:
+        context_docs = expand_to_parents(context_docs, parent_store)
+    retrieval["context"] = [trace_chunk(doc, similarity=similarity) for doc, similarity in context_docs]
+    retrieval["context_docs"] = context_docs
+    timer.lap("parents")
+
+    return retrieval
+
+
+def prefetch_key(query_text: str, history: dict, top_k: int, index_path: str) -> tuple:
+    """
+    Prefetch cache key for a question as typed. In a chat the standalone
+    rewrite depends on the conversation, so the key includes a digest of the
+    history; a draft prefetched without history never matches a follow-up.
+    """
+    history_text = format_history(history) if history else ""
+    history_digest = hashlib.sha1(history_text.encode("utf-8")).hexdigest() if history_text else None
+    return (history_digest, normalize_query(query_text), top_k, index_path)
 
-    if not results:
-        return {
-            "answer": "No encontré información relevante en la base de datos.",
-            "sources": []
-        }
 
-    # Filter by similarity threshold
-    filtered_results = filter_by_similarity(results)
+def prefetch_retrieval(query_text: str, top_k: int = TOP_K, chat_id: str = None) -> dict:
+    """
+    Run retrieval for a draft question ahead of time so a following
+    query_rag with the same or a very similar text goes straight to
+    building the prompt. Follow-ups in a chat with history are skipped:
+    their retrieval needs the condensed question, an LLM call that would
+    queue on the model ahead of real queries. Only the newest draft of a
+    chat waits for that chat's slot.
+    """
+    if chat_id and format_history(load_conversation(chat_id)):
+        return {"status": "skipped"}
 
-    if not filtered_results:
-        return {
-            "answer": "No encontré documentos con suficiente relevancia. Intenta reformular tu pregunta.",
-            "sources": []
-        }
+    index_path = get_active_chroma_path()
+    cache = get_prefetch_cache()
+    key = prefetch_key(query_text, None, top_k, index_path)
+
+    def work() -> dict:
+        if cache.contains(key):
+            return {"status": "cached"}
+
+        timer = StageTimer()
+        search_query, query_embedding = embed_question(query_text)
+        timer.lap("question")
+        retrieval = retrieve(query_text, search_query, query_embedding, top_k, index_path)
+        timer.lap("retrieval")
 
-    # Build context from filtered documents
-    context_text = "\n\n---\n\n".join([doc.page_content for doc, _ in filtered_results])
+        cache.put(key, retrieval, query_embedding, timer.timings["question"], timer.timings["retrieval"])
+        return {"status": "warmed", "seconds": round(timer.elapsed(), 3)}
+
+    return get_prefetch_slots().run(chat_id, work)
+
+
+def query_rag(query_text: str, top_k: int = TOP_K, clinical_data: dict = None, chat_id: str = None,
+              trace: bool = False) -> dict:
+    """
+    Query the RAG system and get an answer with sources.
+    With a chat_id, retrieval uses a standalone rewrite of the question and
+    the prompt includes the chat's bounded conversation memory.
+    With trace=True the result also has a "trace" with the retrieved,
+    filtered and selected chunks, the context sections, the final prompt,
+    per-stage timings in seconds and the LLM's token counts and tokens/sec.
+    Informational questions are routed to a compact prompt (and optionally
+    a smaller model); meal-plan requests keep the full system prompt.
+    Chunks above the similarity threshold are narrowed to a diverse subset
+    with MMR, then replaced by their deduplicated parent sections when the
+    index has them. Retrieval prefetched for the same draft in the same
+    conversation is reused without condensing; otherwise a prefetch for a
+    very similar standalone question is.
+    """
+    timer = StageTimer()
+    timings = timer.timings
+    details = {"timings": timings}
+
+    def finish(answer: str, sources: list) -> dict:
+        result = {"answer": answer, "sources": sources}
+        timings["total"] = timer.elapsed()
+        get_route_stats().record(details["route"], timings["total"])
+        if trace:
+            result["trace"] = details
+        return result
+
+    history = load_conversation(chat_id) if chat_id else None
+    timer.lap("history")
+
+    # Reuse prefetched retrieval: the same draft and conversation first (looked up
+    # before condensing, which is an LLM call), then the nearest cached embedding
+    index_path = get_active_chroma_path()
+    prefetch_cache = get_prefetch_cache()
+    retrieval = prefetch_cache.get(prefetch_key(query_text, history, top_k, index_path))
+    details["prefetch"] = "exact" if retrieval else None
+
+    if retrieval is None:
+        retrieval_question = condense_question(query_text, history) if history else query_text
+        timer.lap("condense")
+        search_query, query_embedding = embed_question(retrieval_question)
+        timer.lap("embed")
+        retrieval = prefetch_cache.get_similar(query_embedding, top_k, index_path)
+        details["prefetch"] = "similar" if retrieval else None
+
+    if retrieval is None:
+        retrieval = retrieve(retrieval_question, search_query, query_embedding, top_k, index_path)
+        timings.update(retrieval["timings"])
+        timer.mark()
+    else:
+        timer.lap("prefetch")
+
+    details.update({key: value for key, value in retrieval.items() if key not in ("timings", "context_docs")})
+    context_docs = retrieval["context_docs"]
+    route_config = ROUTES[retrieval["route"]]
+
+    if not retrieval["retrieved"]:
+        return finish("No encontré información relevante en la base de datos.", [])
+
+    if not context_docs:
+        return finish("No encontré documentos con suficiente relevancia. Intenta reformular tu pregunta.", [])
+
+    # Build context from selected documents
+    context_text = "\n\n---\n\n".join([doc.page_content for doc, _ in context_docs])
 
     clinical_context = build_clinical_context(clinical_data)
+    history_context = build_history_context(history) if history else ""
     prompt_template = ChatPromptTemplate.from_template(PROMPT_TEMPLATE)
     prompt = prompt_template.format(context=context_text, question=query_text)
-    full_prompt = f"{SYSTEM_PROMPT}{clinical_context}\n\n{prompt}"
+    full_prompt = f"{route_config['system_prompt']}{clinical_context}{history_context}\n\n{prompt}"
+    details["prompt"] = full_prompt
+    timer.lap("prompt")
 
-    model = Ollama(model=LLM_MODEL, temperature=TEMPERATURE)
-    response_text = model.invoke(full_prompt)
+    model = Ollama(model=route_config["model"], temperature=TEMPERATURE, num_predict=route_config["num_predict"])
+    generation = model.generate([full_prompt]).generations[0][0]
+    response_text = generation.text
+    timer.lap("llm")
+    details["llm_stats"] = generation_stats(generation.generation_info or {})
 
+    sources = extract_sources(context_docs)
 
-    sources = [extract_source_info(doc, score) for doc, score in filtered_results]
-
-    return {
-        "answer": response_text,
-        "sources": sources
-    }
+    return finish(response_text, sources)
 
 
 def main():
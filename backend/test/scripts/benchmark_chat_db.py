@@ -0,0 +1,126 @@
+import io
+import sys
+import sqlite3
+import time
+import argparse
+import tempfile
+import threading
+from pathlib import Path
+from contextlib import redirect_stdout, redirect_stderr
+
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+import utils.chat_db as chat_db
+
+
+def baseline_connection() -> sqlite3.Connection:
+    """The connection path before pooling: a fresh, untuned connection per call."""
+    return sqlite3.connect(chat_db.CHAT_DB_PATH)
+
+
+def run_load(writers: int, readers: int, ops: int, messages_per_chat: int) -> tuple:
+    """Fill chats, then run writer and reader threads. Returns (counts, elapsed seconds)."""
+    # Chats are pre-filled so readers have realistic conversations to load
+    with redirect_stdout(io.StringIO()), redirect_stderr(io.StringIO()):
+        chat_ids = [chat_db.create_chat(f"bench {i}") for i in range(writers)]
+        for chat_id in chat_ids:
+            for j in range(messages_per_chat):
+                chat_db.save_message(chat_id, "user", f"mensaje de prueba {j} " * 20)
+
+    counts = {"write": 0, "read": 0, "error": 0}
+    lock = threading.Lock()
+
+    def writer(chat_id):
+        for i in range(ops):
+            try:
+                chat_db.save_message(chat_id, "assistant", f"respuesta {i} " * 50,
+                                     sources=[{"title": "Guía", "similarity": "80.0%"}])
+                key = "write"
+            except Exception:
+                key = "error"
+            with lock:
+                counts[key] += 1
+
+    def reader(index):
+        for i in range(ops):
+            try:
+                chat_db.get_chat_messages(chat_ids[(index + i) % len(chat_ids)])
+                key = "read"
+            except Exception:
+                key = "error"
+            with lock:
+                counts[key] += 1
+
+    threads = [threading.Thread(target=writer, args=(chat_id,)) for chat_id in chat_ids]
+    threads += [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+
+    start = time.perf_counter()
+    with redirect_stdout(io.StringIO()), redirect_stderr(io.StringIO()):
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    elapsed = time.perf_counter() - start
+
+    return counts, elapsed
+
+
+def run_benchmark(writers: int, readers: int, ops: int, messages_per_chat: int,
+                  baseline: bool = False) -> dict:
+    """
+    Concurrent save_message / get_chat_messages load against a scratch
+    database. Returns throughput per operation type. With baseline=True
+    every call opens its own default connection (rollback journal, no
+    PRAGMAs), as chat_db did before connections were pooled and tuned.
+    """
+    # chat_db opens (and migrates) a database only on first use, so switching the
+    # path before any call keeps data/chats.db untouched
+    original_path = chat_db.CHAT_DB_PATH
+    original_get_connection = chat_db.get_connection
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        chat_db.CHAT_DB_PATH = Path(tmp_dir) / "bench_chats.db"
+        try:
+            if baseline:
+                # Schema and migrations come from the pooled path; WAL persists
+                # in the file, so switch back to the default journal
+                with chat_db.get_connection() as conn:
+                    conn.execute("PRAGMA journal_mode=DELETE")
+                chat_db.close_connections()
+                chat_db.get_connection = baseline_connection
+            counts, elapsed = run_load(writers, readers, ops, messages_per_chat)
+        finally:
+            # Release the scratch file before the directory is removed
+            chat_db.get_connection = original_get_connection
+            chat_db.close_connections()
+            chat_db.CHAT_DB_PATH = original_path
+
+    return {
+        "elapsed_seconds": elapsed,
+        "writes_per_second": counts["write"] / elapsed,
+        "reads_per_second": counts["read"] / elapsed,
+        "errors": counts["error"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark concurrent chat database load")
+    parser.add_argument('--writers', type=int, default=4, help='Writer threads (one chat each)')
+    parser.add_argument('--readers', type=int, default=4, help='Reader threads')
+    parser.add_argument('--ops', type=int, default=200, help='Operations per thread')
+    parser.add_argument('--messages-per-chat', type=int, default=50, help='Messages pre-filled per chat')
+    parser.add_argument('--baseline', action='store_true',
+                        help='Open a fresh untuned connection per call, as before pooling, for comparison')
+    args = parser.parse_args()
+
+    result = run_benchmark(args.writers, args.readers, args.ops, args.messages_per_chat, args.baseline)
+
+    mode = "baseline, connection per call" if args.baseline else "pooled connections"
+    print(f"\nChat DB benchmark ({mode}; {args.writers} writers, {args.readers} readers, {args.ops} ops each)")
+    print(f"   Elapsed: {result['elapsed_seconds']:.2f}s")
+    print(f"   save_message: {result['writes_per_second']:.1f} ops/s")
+    print(f"   get_chat_messages: {result['reads_per_second']:.1f} ops/s")
+    print(f"   Errors: {result['errors']}")
+
+
+if __name__ == "__main__":
+    main()
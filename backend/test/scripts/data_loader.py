@@ -1,7 +1,12 @@
+import sys
 import json
 from pathlib import Path
 from typing import List
 
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from utils.document_index_utils import get_document_catalog
+
 
 def load_test_cases() -> List[dict]:
     """Load test cases from dataset.json."""
@@ -17,39 +22,19 @@ def load_test_cases() -> List[dict]:
 
 
 def extract_doc_ids_from_sources(sources: List[dict]) -> List[str]:
-    """Extract document IDs from RAG sources using documents_index.json."""
-    doc_index_path = Path(__file__).parent.parent.parent / "documents_index.json"
-
-    if not doc_index_path.exists():
-        return [source.get('title', f"doc_{i}") for i, source in enumerate(sources)]
-
-    with open(doc_index_path, 'r', encoding='utf-8') as f:
-        doc_index = json.load(f)
+    """Extract document IDs from RAG sources using the shared document catalog."""
+    catalog = get_document_catalog()
 
-    # Map title to ID
-    title_to_id = {}
-    for org_name, org_data in doc_index.get('organizations', {}).items():
-        for doc in org_data.get('documents', []):
-            title = doc.get('title', '')
-            doc_id = doc.get('id', '')
-            if title and doc_id:
-                title_to_id[title.lower()] = doc_id
-
-    # Match sources to IDs
     doc_ids = []
     for source in sources:
-        title = source.get('title', '').lower()
-        doc_id = title_to_id.get(title)
-
-        # Partial match if exact not found
-        if not doc_id:
-            for t, did in title_to_id.items():
-                if title in t or t in title:
-                    doc_id = did
-                    break
-
-        if doc_id:
-            doc_ids.append(doc_id)
+        if source.get('doc_id'):
+            doc_ids.append(source['doc_id'])
+            continue
+
+        doc = catalog.find_by_title(source.get('title', ''), partial=True)
+
+        if doc:
+            doc_ids.append(doc['id'])
         else:
             doc_ids.append(source.get('title', f"unknown_{len(doc_ids)}"))
 
@@ -1,7 +1,8 @@
 import sys
 import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from pathlib import Path
-from typing import List
+from typing import List, Optional
 from datetime import datetime
 from datasets import Dataset
 from ragas import evaluate
@@ -17,91 +18,276 @@ sys.path.insert(0, str(Path(__file__).parent.parent.parent))
 
 from core.query_data import query_rag
 from config import TOP_K
-from ragas_config import configure_ragas_with_openai
-from retrieval import get_retrieved_contexts
+from utils.embedding_function import get_embedding_function
+from ragas_config import configure_judge, judge_run_config, JUDGE_MAX_WORKERS
 from data_loader import extract_doc_ids_from_sources
-from metrics import calculate_bleu, calculate_rouge, calculate_manual_precision_recall
+from metrics import (
+    calculate_bleu, calculate_rouge, calculate_manual_precision_recall, latency_summary, lexical_judge_scores
+)
+from result_cache import ResultCache
 
+RAGAS_METRICS = [
+    faithfulness,
+    answer_relevancy,
+    context_recall,
+    context_precision,
+    answer_correctness,
+]
 
-def run_evaluation(test_cases: List[dict], verbose: bool = False) -> dict:
-    """Execute complete evaluation using RAGAS."""
-    # RAGAS configuration
-    ragas_llm, ragas_embeddings = configure_ragas_with_openai()
 
-    # Data collection
-    questions = []
-    answers = []
-    contexts_list = []
-    ground_truths = []
-    latencies = []
-    retrieved_docs_list = []
-    relevant_docs_list = []
-    test_ids = []
-    categories = []
-    difficulties = []
-    bleu_scores_list = []
-    rouge_scores_list = []
-    success_count = 0
+def evaluate_case(test_case: dict) -> dict:
+    """Run one test case through the RAG system and score it with BLEU/ROUGE."""
+    query = test_case['query']
+    expected_answer = test_case['expected_answer']
+
+    start_time = time.time()
+
+    # RAG execution; the trace carries the chunks the LLM actually saw
+    result = query_rag(
+        query_text=query,
+        top_k=TOP_K,
+        clinical_data=test_case.get('clinical_data'),
+        trace=True
+    )
+
+    generated_answer = result['answer']
+    contexts = [chunk['content'] for chunk in result['trace'].get('context', [])]
+    retrieved_docs = extract_doc_ids_from_sources(result['sources'])
+    latency = time.time() - start_time
+
+    return {
+        'test_id': test_case['id'],
+        'category': test_case.get('category', 'unknown'),
+        'difficulty': test_case.get('difficulty', 'medium'),
+        'question': query,
+        'answer': generated_answer,
+        'contexts': contexts,
+        'ground_truth': expected_answer,
+        'latency': latency,
+        'route': result['trace']['route'],
+        'timings': result['trace']['timings'],
+        'llm_stats': result['trace'].get('llm_stats', {}),
+        'retrieved_docs': retrieved_docs,
+        'relevant_docs': test_case['relevant_docs'],
+        'bleu': calculate_bleu(generated_answer, expected_answer),
+        'rouge': calculate_rouge(generated_answer, expected_answer),
+    }
+
+
+def print_progress(done: int, total: int, failed: int, elapsed: float):
+    """Single-line progress with throughput and ETA."""
+    rate = done / elapsed if elapsed > 0 else 0
+    eta = (total - done) / rate if rate > 0 else 0
+    print(f"\r   [{done}/{total}] {done - failed} ok, {failed} failed | "
+          f"{rate * 60:.1f} cases/min | ETA {eta:.0f}s   ", end="", flush=True)
+
+
+def run_cases(test_cases: List[dict], workers: int = 1, timeout: Optional[float] = None,
+              verbose: bool = False, cache: Optional[ResultCache] = None,
+              reuse: bool = True) -> List[Optional[dict]]:
+    """
+    Evaluate cases with up to `workers` running at once. Results keep the
+    dataset order; a case that raises or runs longer than `timeout` seconds
+    yields None. Timed-out calls can't be interrupted, so they finish in the
+    background and their result is discarded.
+    With a cache, each completed case is persisted immediately and, if
+    `reuse`, cases already cached for the current config are not rerun.
+    Records note whether they came from the cache and, if run now, how
+    many workers ran alongside them, so latency reports can tell them apart.
+    """
+    records = [None] * len(test_cases)
+    started = {}  # case index -> start time, set once a worker picks it up
+
+    to_run = []
+    for i, test_case in enumerate(test_cases):
+        cached = cache.load(test_case) if cache and reuse else None
+        if cached:
+            records[i] = cached
+            records[i]['cached'] = True
+        else:
+            to_run.append(i)
+    if cache:
+        print(f"   Result cache {cache.config_hash}: {len(test_cases) - len(to_run)} cached, {len(to_run)} to run")
+    total = len(to_run)
+    if not to_run:
+        return records
+
+    def run(index: int, test_case: dict) -> dict:
+        started[index] = time.monotonic()
+        record = evaluate_case(test_case)
+        record['cached'] = False
+        record['workers'] = workers
+        return record
+
+    get_embedding_function()  # Load the model once before threads race to create it
+
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="eval")
+    futures = {executor.submit(run, i, test_cases[i]): i for i in to_run}
+    pending = set(futures)
+    done_count = 0
+    failed = 0
+    run_start = time.monotonic()
+
+    def report_failure(index: int, message: str):
+        print(f"\n   {test_cases[index]['id']}: {message}")
+
+    try:
+        while pending:
+            finished, pending = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+
+            for future in finished:
+                index = futures[future]
+                done_count += 1
+                try:
+                    records[index] = future.result()
+                    if cache:
+                        cache.save(test_cases[index], records[index])
+                    if verbose:
+                        record = records[index]
+                        print(f"\n   {record['test_id']} completed in {record['latency']:.2f}s")
+                        print(f"   Answer: {record['answer'][:100]}...")
+                        print(f"   Retrieved docs: {len(record['retrieved_docs'])}")
+                except Exception as e:
+                    failed += 1
+                    report_failure(index, f"Error: {str(e)}")
+
+            if timeout:
+                now = time.monotonic()
+                for future in list(pending):
+                    index = futures[future]
+                    if index in started and now - started[index] > timeout:
+                        pending.remove(future)
+                        done_count += 1
+                        failed += 1
+                        report_failure(index, f"Timed out after {timeout:g}s")
+
+            print_progress(done_count, total, failed, time.monotonic() - run_start)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
 
+    elapsed = time.monotonic() - run_start
+    print(f"\n   {total} cases in {elapsed:.1f}s ({total / elapsed * 60 if elapsed else 0:.1f} cases/min, {workers} workers)")
+
+    return records
+
+
+def build_latency_report(records: List[dict], workers: int) -> dict:
+    """
+    Latency percentiles overall, per query_rag stage, and per
+    category/difficulty/route. Only cases run now are measured: cached
+    records were timed under another run's conditions. With workers > 1
+    the timings include contention between concurrent cases.
+    """
+    cached_count = sum(1 for record in records if record.get('cached'))
+    records = [record for record in records if not record.get('cached')]
+
+    stages = {}
+    for record in records:
+        for stage, seconds in record.get('timings', {}).items():
+            stages.setdefault(stage, []).append(seconds)
+
+    tokens_per_second = [r['llm_stats']['tokens_per_second'] for r in records
+                         if r.get('llm_stats', {}).get('tokens_per_second')]
+
+    def grouped(field: str) -> dict:
+        groups = {}
+        for record in records:
+            groups.setdefault(record.get(field, 'unknown'), []).append(record['latency'])
+        return {name: latency_summary(values) for name, values in sorted(groups.items())}
+
+    return {
+        'workers': workers,
+        'measured_cases': len(records),
+        'cached_cases_excluded': cached_count,
+        'overall': latency_summary([r['latency'] for r in records]),
+        'stages': {stage: latency_summary(values) for stage, values in stages.items()},
+        'tokens_per_second': latency_summary(tokens_per_second),
+        'by_category': grouped('category'),
+        'by_difficulty': grouped('difficulty'),
+        'by_route': grouped('route'),
+    }
+
+
+def nan_to_none(value) -> Optional[float]:
+    return None if value is None or value != value else float(value)
+
+
+def score_with_ragas(completed: List[tuple], cache: Optional[ResultCache], judge: str = "openai",
+                     judge_workers: int = JUDGE_MAX_WORKERS, batch_size: Optional[int] = None):
+    """
+    Add per-case RAGAS scores to records that don't have them yet from this
+    judge (cached records keep theirs), persisting each scored case.
+    """
+    pending = [(test_case, record) for test_case, record in completed
+               if 'ragas' not in record or record.get('ragas_judge', 'openai') != judge]
+    if not pending:
+        print("All RAGAS scores reused from cache\n")
+        return
+
+    if judge == "stub":
+        print(f"Scoring {len(pending)} cases with the lexical stub judge\n")
+        rows = [lexical_judge_scores(record['question'], record['answer'], record['contexts'], record['ground_truth'])
+                for _, record in pending]
+    else:
+        # RAGAS configuration
+        ragas_llm, ragas_embeddings = configure_judge(judge)
+
+        print(f"Running RAGAS metrics on {len(pending)} cases with the {judge} judge "
+              f"({judge_workers} concurrent calls)...\n")
+
+        ragas_dataset = Dataset.from_dict({
+            "question": [record['question'] for _, record in pending],
+            "answer": [record['answer'] for _, record in pending],
+            "contexts": [record['contexts'] for _, record in pending],
+            "ground_truth": [record['ground_truth'] for _, record in pending],
+        })
+
+        ragas_results = evaluate(
+            ragas_dataset,
+            metrics=RAGAS_METRICS,
+            llm=ragas_llm,
+            embeddings=ragas_embeddings,
+            run_config=judge_run_config(judge_workers),
+            batch_size=batch_size,
+        )
+
+        print("\nRAGAS evaluation completed\n")
+        rows = ragas_results.to_pandas().to_dict('records')
+
+    for (test_case, record), row in zip(pending, rows):
+        record['ragas'] = {metric.name: nan_to_none(row.get(metric.name)) for metric in RAGAS_METRICS}
+        record['ragas_judge'] = judge
+        if cache:
+            cache.save(test_case, record)
+
+
+def run_evaluation(test_cases: List[dict], verbose: bool = False, workers: int = 1,
+                   timeout: Optional[float] = None, cache: Optional[ResultCache] = None,
+                   reuse: bool = True, judge: str = "openai", judge_workers: int = JUDGE_MAX_WORKERS,
+                   judge_batch_size: Optional[int] = None) -> dict:
+    """Execute complete evaluation using RAGAS."""
     print("\n" + "="*80)
     print("RAGAS EVALUATION")
     print("="*80)
 
-    for i, test_case in enumerate(test_cases, 1):
-        test_id = test_case['id']
-        query = test_case['query']
-        expected_answer = test_case['expected_answer']
-        relevant_docs = test_case['relevant_docs']
-        clinical_data = test_case.get('clinical_data')
-
-        print(f"\n[{i}/{len(test_cases)}] {test_id}")
-        if verbose:
-            print(f"   Query: {query[:80]}...")
-
-        start_time = time.time()
-
-        try:
-            # RAG execution
-            result = query_rag(
-                query_text=query,
-                top_k=TOP_K,
-                clinical_data=clinical_data
-            )
-
-            generated_answer = result['answer']
-            sources = result['sources']
-            contexts = get_retrieved_contexts(query, TOP_K)
-            retrieved_docs = extract_doc_ids_from_sources(sources)
-            latency = time.time() - start_time
-
-            # Manual metrics
-            bleu_scores = calculate_bleu(generated_answer, expected_answer)
-            rouge_scores = calculate_rouge(generated_answer, expected_answer)
-
-            # Store data for RAGAS
-            questions.append(query)
-            answers.append(generated_answer)
-            contexts_list.append(contexts)
-            ground_truths.append(expected_answer)
-            latencies.append(latency)
-            retrieved_docs_list.append(retrieved_docs)
-            relevant_docs_list.append(relevant_docs)
-            test_ids.append(test_id)
-            categories.append(test_case.get('category', 'unknown'))
-            difficulties.append(test_case.get('difficulty', 'medium'))
-            bleu_scores_list.append(bleu_scores)
-            rouge_scores_list.append(rouge_scores)
-            success_count += 1
-
-            print(f"   Completed in {latency:.2f}s")
-
-            if verbose:
-                print(f"   Answer: {generated_answer[:100]}...")
-                print(f"   Retrieved docs: {len(retrieved_docs)}")
-
-        except Exception as e:
-            print(f"   Error: {str(e)}")
-            continue
+    case_results = run_cases(test_cases, workers, timeout, verbose, cache, reuse)
+    completed = [(test_case, record) for test_case, record in zip(test_cases, case_results) if record is not None]
+    records = [record for _, record in completed]
+    success_count = len(records)
+
+    # Data collection
+    questions = [r['question'] for r in records]
+    answers = [r['answer'] for r in records]
+    contexts_list = [r['contexts'] for r in records]
+    ground_truths = [r['ground_truth'] for r in records]
+    latencies = [r['latency'] for r in records]
+    retrieved_docs_list = [r['retrieved_docs'] for r in records]
+    relevant_docs_list = [r['relevant_docs'] for r in records]
+    test_ids = [r['test_id'] for r in records]
+    categories = [r['category'] for r in records]
+    difficulties = [r['difficulty'] for r in records]
+    bleu_scores_list = [r['bleu'] for r in records]
+    rouge_scores_list = [r['rouge'] for r in records]
 
     # Coverage and latency
     total_cases = len(test_cases)
@@ -114,29 +300,7 @@ def run_evaluation(test_cases: List[dict], verbose: bool = False) -> dict:
     print(f"{'='*80}\n")
 
     # RAGAS evaluation
-    print("Running RAGAS metrics (may take 2-5 minutes)...\n")
-
-    ragas_dataset = Dataset.from_dict({
-        "question": questions,
-        "answer": answers,
-        "contexts": contexts_list,
-        "ground_truth": ground_truths,
-    })
-
-    ragas_results = evaluate(
-        ragas_dataset,
-        metrics=[
-            faithfulness,
-            answer_relevancy,
-            context_recall,
-            context_precision,
-            answer_correctness,
-        ],
-        llm=ragas_llm,
-        embeddings=ragas_embeddings,
-    )
-
-    print("\nRAGAS evaluation completed\n")
+    score_with_ragas(completed, cache, judge, judge_workers, judge_batch_size)
 
     # Manual precision/recall
     precision_recall_list = []
@@ -161,7 +325,7 @@ def run_evaluation(test_cases: List[dict], verbose: bool = False) -> dict:
             avg_rouge[key] = sum(scores[key] for scores in rouge_scores_list) / len(rouge_scores_list)
 
     # Process RAGAS results
-    ragas_dict = ragas_results.to_pandas().to_dict('list')
+    ragas_dict = {metric.name: [record['ragas'].get(metric.name) for record in records] for metric in RAGAS_METRICS}
 
     def safe_mean(values):
         """Calculate mean handling NaN values."""
@@ -181,6 +345,7 @@ def run_evaluation(test_cases: List[dict], verbose: bool = False) -> dict:
             'failed_cases': total_cases - success_count,
             'coverage_percentage': round(coverage, 2),
             'average_latency_seconds': round(avg_latency, 3),
+            'judge': judge,
         },
         'ragas_metrics': {
             'faithfulness': safe_mean(ragas_dict.get('faithfulness', [0])),
@@ -195,6 +360,7 @@ def run_evaluation(test_cases: List[dict], verbose: bool = False) -> dict:
             'bleu': {k: round(v, 3) for k, v in avg_bleu.items()} if avg_bleu else {},
             'rouge': {k: round(v, 3) for k, v in avg_rouge.items()} if avg_rouge else {},
         },
+        'latency': build_latency_report(records, workers),
         'detailed_results': []
     }
 
@@ -208,6 +374,11 @@ def run_evaluation(test_cases: List[dict], verbose: bool = False) -> dict:
             'answer': answers[i],
             'ground_truth': ground_truths[i],
             'latency_seconds': latencies[i],
+            'cached': records[i].get('cached', False),
+            'route': records[i].get('route'),
+            'timings': records[i].get('timings', {}),
+            'tokens_per_second': records[i].get('llm_stats', {}).get('tokens_per_second'),
+            'ragas': records[i]['ragas'],
             'retrieved_docs': retrieved_docs_list[i],
             'relevant_docs': relevant_docs_list[i],
             'precision': precision_recall_list[i]['precision'],
@@ -10,23 +10,59 @@ sys.path.insert(0, str(Path(__file__).parent.parent.parent))
 
 from data_loader import load_test_cases
 from evaluation import run_evaluation
-from reporting import print_summary_report
+from reporting import print_summary_report, print_cached_runs, print_diff_report, write_report_files
+from result_cache import ResultCache, list_runs, diff_runs
+from ragas_config import JUDGES, JUDGE_MAX_WORKERS
 
 
 def main():
     """Main orchestrator function."""
     parser = argparse.ArgumentParser(description="Evaluate RAG system using RAGAS")
     parser.add_argument('--verbose', '-v', action='store_true', help='Verbose mode')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Test cases run concurrently (default 4, 1 with --latency; match OLLAMA_NUM_PARALLEL)')
+    parser.add_argument('--latency', action='store_true',
+                        help='Latency run: rerun every case one at a time so timings have no contention or cached records')
+    parser.add_argument('--timeout', type=float, default=None, help='Per-case timeout in seconds')
+    cache_mode = parser.add_mutually_exclusive_group()
+    cache_mode.add_argument('--resume', action='store_true',
+                            help='Reuse cached results for unchanged cases and config (default)')
+    cache_mode.add_argument('--force', action='store_true', help='Rerun every case and overwrite the cache')
+    parser.add_argument('--list-runs', action='store_true', help='List cached runs and exit')
+    parser.add_argument('--diff', nargs=2, metavar=('BASE', 'OTHER'),
+                        help='Compare two cached runs by config hash (prefix) and exit')
+    parser.add_argument('--judge', choices=JUDGES, default='openai',
+                        help='RAGAS judge: OpenAI, local Ollama + local embeddings, or an offline lexical stub')
+    parser.add_argument('--judge-workers', type=int, default=JUDGE_MAX_WORKERS, help='Concurrent judge calls')
+    parser.add_argument('--judge-batch-size', type=int, default=None, help='Cases per RAGAS batch (default: all)')
+    parser.add_argument('--output-dir', type=Path, default=Path(__file__).parent.parent / "results",
+                        help='Where the JSON/CSV report is written')
     args = parser.parse_args()
 
+    if args.list_runs:
+        print_cached_runs(list_runs())
+        return
+    if args.diff:
+        print_diff_report(diff_runs(*args.diff))
+        return
+
+    workers = args.workers or (1 if args.latency else 4)
+    if args.latency and workers > 1:
+        print(f"Warning: --latency with {workers} workers; timings will include contention")
+
     try:
         test_cases = load_test_cases()
         print(f"\nLoaded {len(test_cases)} test cases")
 
-        results = run_evaluation(test_cases, verbose=args.verbose)
+        results = run_evaluation(test_cases, verbose=args.verbose, workers=workers, timeout=args.timeout,
+                                 cache=ResultCache(), reuse=not (args.force or args.latency), judge=args.judge,
+                                 judge_workers=args.judge_workers, judge_batch_size=args.judge_batch_size)
 
         print_summary_report(results)
 
+        json_path, csv_path = write_report_files(results, args.output_dir)
+        print(f"\nReport written to {json_path} and {csv_path}")
+
         print("\nEvaluation completed\n")
 
     except Exception as e:
@@ -1,7 +1,38 @@
 import os
+import sys
+from pathlib import Path
 from ragas.llms import LangchainLLMWrapper
 from ragas.embeddings import LangchainEmbeddingsWrapper
+from ragas.run_config import RunConfig
 from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+from langchain_community.cache import SQLiteCache
+from langchain.embeddings import CacheBackedEmbeddings
+from langchain.storage import LocalFileStore
+
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from config import LLM_MODEL, EMBEDDING_MODEL
+
+# Judge responses and embeddings are cached so unchanged cases cost nothing to re-score
+JUDGE_CACHE_DIR = Path(__file__).parent.parent / "results" / "judge_cache"
+
+JUDGES = ("openai", "ollama", "stub")
+OPENAI_JUDGE_MODEL = "gpt-4o-mini"
+OPENAI_JUDGE_EMBEDDINGS = "text-embedding-3-small"
+OLLAMA_JUDGE_MODEL = os.getenv("OLLAMA_JUDGE_MODEL", LLM_MODEL)
+
+JUDGE_MAX_WORKERS = 8 # Concurrent judge calls
+JUDGE_TIMEOUT = 180 # Seconds per judge call
+
+
+def judge_llm_cache() -> SQLiteCache:
+    JUDGE_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    return SQLiteCache(database_path=str(JUDGE_CACHE_DIR / "llm.db"))
+
+
+def cached_embeddings(embeddings, namespace: str) -> CacheBackedEmbeddings:
+    store = LocalFileStore(str(JUDGE_CACHE_DIR / "embeddings"))
+    return CacheBackedEmbeddings.from_bytes_store(embeddings, store, namespace=namespace)
 
 
 def configure_ragas_with_openai():
@@ -11,17 +42,54 @@ def configure_ragas_with_openai():
         raise ValueError("OPENAI_API_KEY not found in environment variables")
 
     openai_llm = ChatOpenAI(
-        model="gpt-4o-mini",
+        model=OPENAI_JUDGE_MODEL,
         api_key=api_key,
-        temperature=0
+        temperature=0,
+        cache=judge_llm_cache()
     )
 
     openai_embeddings = OpenAIEmbeddings(
-        model="text-embedding-3-small",
+        model=OPENAI_JUDGE_EMBEDDINGS,
         api_key=api_key
     )
 
     ragas_llm = LangchainLLMWrapper(openai_llm)
-    ragas_embeddings = LangchainEmbeddingsWrapper(openai_embeddings)
+    ragas_embeddings = LangchainEmbeddingsWrapper(cached_embeddings(openai_embeddings, OPENAI_JUDGE_EMBEDDINGS))
 
     return ragas_llm, ragas_embeddings
+
+
+def configure_ragas_with_ollama():
+    """Configure RAGAS to use a local Ollama model and local embeddings (no network)."""
+    from langchain_community.chat_models import ChatOllama
+    from langchain_community.embeddings import HuggingFaceEmbeddings
+
+    ollama_llm = ChatOllama(
+        model=OLLAMA_JUDGE_MODEL,
+        temperature=0,
+        format="json",  # RAGAS parses structured judge output
+        cache=judge_llm_cache()
+    )
+
+    local_embeddings = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
+
+    ragas_llm = LangchainLLMWrapper(ollama_llm)
+    ragas_embeddings = LangchainEmbeddingsWrapper(cached_embeddings(local_embeddings, EMBEDDING_MODEL))
+
+    return ragas_llm, ragas_embeddings
+
+
+def configure_judge(judge: str):
+    """RAGAS llm/embeddings for a judge backend; the stub judge needs neither."""
+    if judge == "openai":
+        return configure_ragas_with_openai()
+    if judge == "ollama":
+        return configure_ragas_with_ollama()
+    if judge == "stub":
+        return None, None
+    raise ValueError(f"Unknown judge '{judge}', expected one of {', '.join(JUDGES)}")
+
+
+def judge_run_config(max_workers: int = JUDGE_MAX_WORKERS) -> RunConfig:
+    """Bounded concurrency for judge calls (local models can't take OpenAI-level parallelism)."""
+    return RunConfig(max_workers=max_workers, timeout=JUDGE_TIMEOUT)
@@ -1,9 +1,12 @@
 import sys
+import csv
+import json
 from pathlib import Path
+from datetime import datetime
 
 sys.path.insert(0, str(Path(__file__).parent.parent.parent))
 
-from config import TOP_K
+from config import TOP_K, SIMILARITY_THRESHOLD
 
 
 def print_summary_report(results: dict):
@@ -23,6 +26,12 @@ def print_summary_report(results: dict):
     print(f"   Coverage: {metadata['coverage_percentage']}%")
     print(f"   Avg latency: {metadata['average_latency_seconds']}s")
 
+    latency = results.get('latency')
+    if latency and latency['overall']['count']:
+        print_latency_report(latency)
+    elif latency and latency.get('cached_cases_excluded'):
+        print(f"\nLATENCY: every case came from the cache; use --latency to time them")
+
     # RAGAS metrics (0-1 scale)
     print(f"\nRAGAS METRICS (0-1 scale):")
     print(f"   Faithfulness: {ragas['faithfulness']:.3f}")
@@ -73,3 +82,124 @@ def print_summary_report(results: dict):
         print("   NEEDS IMPROVEMENT - Consider significant optimizations")
 
     print("\n" + "="*80)
+
+
+def format_percentiles(summary: dict) -> str:
+    return f"p50 {summary['p50']:.2f}s | p90 {summary['p90']:.2f}s | p99 {summary['p99']:.2f}s | max {summary['max']:.2f}s"
+
+
+def print_latency_report(latency: dict):
+    """Latency distribution, per-stage breakdown and per-group percentiles."""
+    print(f"\nLATENCY ({latency['measured_cases']} cases run with {latency['workers']} workers):")
+    if latency['cached_cases_excluded']:
+        print(f"   {latency['cached_cases_excluded']} cached cases excluded (use --force or --latency to time them)")
+    if latency['workers'] > 1:
+        print(f"   Includes contention between concurrent cases; use --latency for sequential timings")
+    print(f"   Overall: {format_percentiles(latency['overall'])}")
+
+    print(f"\n   Stages (mean / p90):")
+    for stage, summary in latency['stages'].items():
+        print(f"      {stage:<8} {summary['mean']:.3f}s / {summary['p90']:.3f}s")
+
+    if latency['tokens_per_second']['count']:
+        tps = latency['tokens_per_second']
+        print(f"   LLM decode speed: {tps['mean']:.1f} tokens/s (p50 {tps['p50']:.1f})")
+
+    for title, groups in (("By category", latency['by_category']), ("By difficulty", latency['by_difficulty']),
+                          ("By route", latency.get('by_route', {}))):
+        print(f"\n   {title}:")
+        for name, summary in groups.items():
+            print(f"      {name:<16} n={summary['count']:<3} {format_percentiles(summary)}")
+
+
+def write_report_files(results: dict, output_dir: Path) -> tuple:
+    """
+    Write the full results as JSON and one CSV row per case (latency, stage
+    timings, tokens/sec and quality metrics). Returns both paths.
+    """
+    output_dir.mkdir(parents=True, exist_ok=True)
+    stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    json_path = output_dir / f"evaluation_{stamp}.json"
+    csv_path = output_dir / f"evaluation_{stamp}.csv"
+
+    with open(json_path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+
+    cases = results['detailed_results']
+    stages = sorted({stage for case in cases for stage in case.get('timings', {})})
+    ragas_metrics = sorted({metric for case in cases for metric in (case.get('ragas') or {})})
+    fields = ['test_id', 'category', 'difficulty', 'route', 'cached', 'latency_seconds'] + [f"{stage}_seconds" for stage in stages] + \
+             ['tokens_per_second', 'precision', 'recall'] + ragas_metrics
+
+    with open(csv_path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        for case in cases:
+            row = {field: case.get(field) for field in ('test_id', 'category', 'difficulty', 'route', 'cached', 'latency_seconds',
+                                                        'tokens_per_second', 'precision', 'recall')}
+            row.update({f"{stage}_seconds": seconds for stage, seconds in case.get('timings', {}).items()})
+            row.update(case.get('ragas') or {})
+            writer.writerow(row)
+
+    return json_path, csv_path
+
+
+def print_cached_runs(runs: list):
+    """List cached evaluation runs."""
+    print("\n" + "="*80)
+    print("CACHED EVALUATION RUNS")
+    print("="*80)
+    for run in runs:
+        config = run['config']
+        print(f"\n   {run['config_hash']}  {run['created']}  ({run['cases']} cases)")
+        print(f"      LLM: {config['llm_model']} | Embeddings: {config['embedding_model']}")
+        print(f"      top_k={config['top_k']} threshold={config['similarity_threshold']} "
+              f"chunks={config['chunk_size']}/{config['chunk_overlap']} "
+              f"prompt={config['prompt_hash']} index={config['index_version']}")
+    print("\n" + "="*80)
+
+
+def print_diff_report(diff: dict):
+    """Print per-case and average metric changes between two cached runs."""
+    print("\n" + "="*80)
+    print(f"RUN DIFF: {diff['base']} -> {diff['other']}")
+    print("="*80)
+
+    if diff['only_in_base'] or diff['only_in_other']:
+        print(f"\n   Only in {diff['base']}: {', '.join(diff['only_in_base']) or '-'}")
+        print(f"   Only in {diff['other']}: {', '.join(diff['only_in_other']) or '-'}")
+
+    print(f"\nAVERAGE CHANGE ({len(diff['cases'])} shared cases):")
+    for metric, delta in diff['average_deltas'].items():
+        print(f"   {metric}: {delta:+.3f}")
+
+    print(f"\nPER CASE:")
+    for case in diff['cases']:
+        changes = ", ".join(f"{metric} {delta:+.3f}" for metric, delta in case['deltas'].items())
+        marker = "answer changed" if case['answer_changed'] else "same answer"
+        print(f"   {case['test_id']} ({marker}): {changes}")
+
+    print("\n" + "="*80)
+
+
+def print_retrieval_sweep(sweep: dict):
+    """Print retrieval metrics for every (threshold, k) pair and the best nDCG setting."""
+    print("\n" + "="*80)
+    print("RETRIEVAL-ONLY EVALUATION")
+    print("="*80)
+    print(f"\n   {sweep['total_queries']} queries | retrieval {sweep['retrieval_seconds']:.2f}s | "
+          f"metrics {sweep['metrics_seconds'] * 1000:.1f}ms")
+
+    print(f"\n   {'threshold':>9} {'k':>4} {'recall':>8} {'precision':>10} {'MRR':>7} {'nDCG':>7}")
+    for t_index, threshold in enumerate(sweep['thresholds']):
+        for k_index, k in enumerate(sweep['k_values']):
+            print(f"   {threshold:>9.2f} {k:>4} "
+                  f"{sweep['recall'][t_index, k_index]:>8.3f} "
+                  f"{sweep['precision'][t_index, k_index]:>10.3f} "
+                  f"{sweep['mrr'][t_index, k_index]:>7.3f} "
+                  f"{sweep['ndcg'][t_index, k_index]:>7.3f}")
+
+    t_best, k_best = divmod(int(sweep['ndcg'].argmax()), len(sweep['k_values']))
+    print(f"\n   Best nDCG: threshold={sweep['thresholds'][t_best]:.2f}, k={sweep['k_values'][k_best]} "
+          f"(current: threshold={SIMILARITY_THRESHOLD}, k={TOP_K})")
+    print("\n" + "="*80)
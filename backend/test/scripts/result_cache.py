@@ -0,0 +1,152 @@
+import sys
+import json
+import os
+import hashlib
+from pathlib import Path
+from datetime import datetime
+from typing import List, Optional
+
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from config import (
+    EMBEDDING_MODEL, LLM_MODEL, TEMPERATURE, TOP_K, SIMILARITY_THRESHOLD,
+    CHUNK_SIZE, CHUNK_OVERLAP, PARENT_CHUNK_SIZE, SYSTEM_PROMPT, PROMPT_TEMPLATE,
+    COMPACT_SYSTEM_PROMPT, ROUTER_ENABLED, INFO_LLM_MODEL, INFO_NUM_PREDICT,
+    MMR_LAMBDA, MMR_MAX_CHUNKS, MMR_TOKEN_BUDGET
+)
+from utils.index_versions import get_active_version
+
+CACHE_DIR = Path(__file__).parent.parent / "results" / "cache"
+
+
+def stable_hash(value) -> str:
+    return hashlib.sha256(json.dumps(value, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+def current_config() -> dict:
+    """Everything that changes what a test case produces."""
+    index_version = get_active_version()
+    return {
+        'embedding_model': EMBEDDING_MODEL,
+        'llm_model': LLM_MODEL,
+        'temperature': TEMPERATURE,
+        'top_k': TOP_K,
+        'similarity_threshold': SIMILARITY_THRESHOLD,
+        'mmr': [MMR_LAMBDA, MMR_MAX_CHUNKS, MMR_TOKEN_BUDGET],
+        'chunk_size': CHUNK_SIZE,
+        'chunk_overlap': CHUNK_OVERLAP,
+        'parent_chunk_size': PARENT_CHUNK_SIZE,
+        'prompt_hash': stable_hash([SYSTEM_PROMPT, COMPACT_SYSTEM_PROMPT, PROMPT_TEMPLATE])[:12],
+        'router': [ROUTER_ENABLED, INFO_LLM_MODEL, INFO_NUM_PREDICT],
+        'index_version': index_version.name if index_version else None,
+    }
+
+
+class ResultCache:
+    """
+    Per-case evaluation results stored as results/cache/<config hash>/<case hash>.json.
+    A case is reused only if both the test case and the config are unchanged.
+    """
+
+    def __init__(self, config: Optional[dict] = None, cache_dir: Path = CACHE_DIR):
+        self.config = config or current_config()
+        self.config_hash = stable_hash(self.config)[:12]
+        self.run_dir = cache_dir / self.config_hash
+        self.run_dir.mkdir(parents=True, exist_ok=True)
+
+        config_path = self.run_dir / "config.json"
+        if not config_path.exists():
+            self._write(config_path, {'config': self.config, 'created': datetime.now().strftime('%Y-%m-%d %H:%M:%S')})
+
+    def _path(self, test_case: dict) -> Path:
+        return self.run_dir / f"{stable_hash(test_case)[:16]}.json"
+
+    @staticmethod
+    def _write(path: Path, data: dict):
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+
+    def load(self, test_case: dict) -> Optional[dict]:
+        path = self._path(test_case)
+        if not path.exists():
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def save(self, test_case: dict, record: dict):
+        self._write(self._path(test_case), record)
+
+
+def list_runs(cache_dir: Path = CACHE_DIR) -> List[dict]:
+    """Cached runs, newest first, with their config and number of cases."""
+    runs = []
+    for config_path in cache_dir.glob("*/config.json"):
+        with open(config_path, 'r', encoding='utf-8') as f:
+            info = json.load(f)
+        runs.append({
+            'config_hash': config_path.parent.name,
+            'created': info['created'],
+            'config': info['config'],
+            'cases': sum(1 for p in config_path.parent.glob("*.json") if p.name != "config.json"),
+        })
+    return sorted(runs, key=lambda run: run['created'], reverse=True)
+
+
+def load_run(prefix: str, cache_dir: Path = CACHE_DIR) -> dict:
+    """All cached records of one run (config hash or unique prefix), keyed by test_id."""
+    matches = [p for p in cache_dir.glob(f"{prefix}*") if p.is_dir()]
+    if len(matches) != 1:
+        raise ValueError(f"'{prefix}' matches {len(matches)} cached runs")
+
+    records = {}
+    for path in matches[0].glob("*.json"):
+        if path.name == "config.json":
+            continue
+        with open(path, 'r', encoding='utf-8') as f:
+            record = json.load(f)
+        records[record['test_id']] = record
+    return records
+
+
+def case_scores(record: dict) -> dict:
+    """Flat numeric scores of one cached case."""
+    scores = {
+        'latency': record['latency'],
+        'bleu_avg': record['bleu'].get('bleu_avg', 0),
+        'rouge_l_f1': record['rouge'].get('rouge_l_f1', 0),
+    }
+    scores.update(record.get('ragas', {}))
+    return scores
+
+
+def diff_runs(base_prefix: str, other_prefix: str, cache_dir: Path = CACHE_DIR) -> dict:
+    """Per-case and average score deltas (other - base) for cases in both runs."""
+    base, other = load_run(base_prefix, cache_dir), load_run(other_prefix, cache_dir)
+    shared = sorted(set(base) & set(other))
+
+    cases = []
+    for test_id in shared:
+        base_scores, other_scores = case_scores(base[test_id]), case_scores(other[test_id])
+        metrics = [m for m in base_scores if base_scores[m] is not None and other_scores.get(m) is not None]
+        cases.append({
+            'test_id': test_id,
+            'answer_changed': base[test_id]['answer'] != other[test_id]['answer'],
+            'deltas': {m: other_scores[m] - base_scores[m] for m in metrics},
+        })
+
+    metrics = sorted({m for case in cases for m in case['deltas']})
+    averages = {}
+    for metric in metrics:
+        values = [case['deltas'][metric] for case in cases if metric in case['deltas']]
+        averages[metric] = sum(values) / len(values)
+
+    return {
+        'base': base_prefix,
+        'other': other_prefix,
+        'only_in_base': sorted(set(base) - set(other)),
+        'only_in_other': sorted(set(other) - set(base)),
+        'cases': cases,
+        'average_deltas': averages,
+    }
@@ -1,25 +1,146 @@
+import os
+import json
 import sys
+import time
+import argparse
 from pathlib import Path
 from typing import List
+
+# Retrieval-only evaluation must work without network access
+os.environ.setdefault("HF_HUB_OFFLINE", "1")
+os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+os.environ.setdefault("ANONYMIZED_TELEMETRY", "False")
+
+import numpy as np
 from langchain_community.vectorstores import Chroma
 
 sys.path.insert(0, str(Path(__file__).parent.parent.parent))
 
-from config import CHROMA_PATH
+from core.query_data import expand_diet_query
 from utils.embedding_function import get_embedding_function
+from utils.index_versions import get_active_chroma_path
+from data_loader import load_test_cases, extract_doc_ids_from_sources
+from reporting import print_retrieval_sweep
+
+DEFAULT_K_VALUES = [1, 3, 5, 10, 15, 20]
+DEFAULT_THRESHOLDS = [0.0, 0.3, 0.35, 0.4, 0.45, 0.5]
+
+
+def retrieve_all(queries: List[str], max_k: int) -> tuple:
+    """
+    Embed every query in one batch and run a single collection query at
+    max_k. Queries are expanded the same way query_rag expands them.
+    Returns (doc_ids, similarities), both shaped (queries, max_k). Each
+    doc_ids cell lists the chunk's document followed by the documents merged
+    into it by deduplication; missing results have None and similarity -inf.
+    """
+    embedding_function = get_embedding_function()
+    db = Chroma(persist_directory=get_active_chroma_path(), embedding_function=embedding_function)
+
+    embeddings = embedding_function.embed_documents([expand_diet_query(q) for q in queries])
+    results = db._collection.query(query_embeddings=embeddings, n_results=max_k, include=["metadatas", "distances"])
+
+    doc_ids = np.full((len(queries), max_k), None, dtype=object)
+    similarities = np.full((len(queries), max_k), -np.inf)
+    for i, (metadatas, distances) in enumerate(zip(results["metadatas"], results["distances"])):
+        metadatas = [m or {} for m in metadatas]
+        for j, (doc_id, metadata) in enumerate(zip(extract_doc_ids_from_sources(metadatas), metadatas)):
+            doc_ids[i, j] = [doc_id] + json.loads(metadata.get("duplicate_doc_ids") or "[]")
+        similarities[i, :len(distances)] = 1 / (1 + np.asarray(distances))  # Same conversion as query_rag
+
+    return doc_ids, similarities
+
+
+def sweep_metrics(doc_ids: np.ndarray, similarities: np.ndarray, relevant_docs: List[List[str]],
+                  k_values: List[int], thresholds: List[float]) -> dict:
+    """
+    Document-level recall@k, precision@k, MRR and nDCG for every (k, threshold)
+    pair, averaged over queries. A chunk counts if it is in the top k and
+    above the threshold; each document counts once, at its first chunk, as in
+    calculate_manual_precision_recall. A deduplicated chunk stands for all of
+    its documents. Arrays are (thresholds, k, queries, rank).
+    """
+    n_queries, max_k = doc_ids.shape
+
+    # Per chunk: how many documents it adds to the row, and how many of those are relevant
+    new_docs = np.zeros((n_queries, max_k))
+    new_relevant = np.zeros((n_queries, max_k))
+    for i in range(n_queries):
+        relevant_set = set(relevant_docs[i])
+        seen = set()
+        for j, chunk_doc_ids in enumerate(doc_ids[i]):
+            added = [doc_id for doc_id in dict.fromkeys(chunk_doc_ids or []) if doc_id not in seen]
+            seen.update(added)
+            new_docs[i, j] = len(added)
+            new_relevant[i, j] = sum(doc_id in relevant_set for doc_id in added)
+    first = new_docs > 0
+    n_relevant = np.array([len(set(docs)) for docs in relevant_docs], dtype=float)
+
+    k = np.asarray(k_values)
+    t = np.asarray(thresholds)
+    in_top_k = np.arange(max_k)[None, :] < k[:, None]                  # (K, rank)
+    above = similarities[None, :, :] >= t[:, None, None]               # (T, queries, rank)
+    counted = in_top_k[None, :, None, :] & above[:, None, :, :] & first  # (T, K, queries, rank)
+    hits = counted & (new_relevant > 0)
+
+    retrieved_count = np.where(counted, new_docs, 0).sum(-1)
+    hit_count = np.where(counted, new_relevant, 0).sum(-1)
+    precision = np.divide(hit_count, retrieved_count, out=np.zeros(hit_count.shape), where=retrieved_count > 0)
+    recall = np.divide(hit_count, n_relevant, out=np.zeros(hit_count.shape), where=n_relevant > 0)
+
+    # Rank of each counted document among the counted documents of its row (1-based)
+    doc_rank = np.cumsum(counted, axis=-1)
+    reciprocal_rank = np.where(hits, 1.0 / np.maximum(doc_rank, 1), 0.0).max(-1)
+
+    # nDCG over document positions: a merged chunk's documents take consecutive positions, relevant ones first
+    counted_docs = np.where(counted, new_docs, 0)
+    docs_before = np.cumsum(counted_docs, axis=-1) - counted_docs
+    positions = int(new_docs.sum(-1).max()) if n_queries else 0
+    cumulative_discount = np.concatenate([[0.0], np.cumsum(1.0 / np.log2(np.arange(2, max(positions, max_k) + 2)))])
+    gains = cumulative_discount[(docs_before + new_relevant).astype(int)] - cumulative_discount[docs_before.astype(int)]
+    dcg = np.where(hits, gains, 0.0).sum(-1)
+    ideal_counts = np.minimum(n_relevant[None, None, :], np.maximum(k[None, :, None], retrieved_count)).astype(int)
+    ideal_dcg = cumulative_discount[ideal_counts]
+    ndcg = np.divide(dcg, ideal_dcg, out=np.zeros(dcg.shape), where=ideal_dcg > 0)
+
+    return {
+        'k_values': list(k_values),
+        'thresholds': list(thresholds),
+        'recall': recall.mean(-1),
+        'precision': precision.mean(-1),
+        'mrr': reciprocal_rank.mean(-1),
+        'ndcg': ndcg.mean(-1),
+    }
+
+
+def run_retrieval_evaluation(test_cases: List[dict], k_values: List[int] = DEFAULT_K_VALUES,
+                             thresholds: List[float] = DEFAULT_THRESHOLDS) -> dict:
+    """Single retrieval pass at max k, then metrics for the whole k x threshold grid."""
+    start = time.perf_counter()
+    doc_ids, similarities = retrieve_all([case['query'] for case in test_cases], max(k_values))
+    retrieval_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    sweep = sweep_metrics(doc_ids, similarities, [case['relevant_docs'] for case in test_cases], k_values, thresholds)
+    sweep['metrics_seconds'] = time.perf_counter() - start
+    sweep['retrieval_seconds'] = retrieval_seconds
+    sweep['total_queries'] = len(test_cases)
+
+    return sweep
+
 
+def main():
+    parser = argparse.ArgumentParser(description="Retrieval-only evaluation (no LLM, no network)")
+    parser.add_argument('--k', type=int, nargs='+', default=DEFAULT_K_VALUES, help='k values to sweep')
+    parser.add_argument('--thresholds', type=float, nargs='+', default=DEFAULT_THRESHOLDS,
+                        help='Similarity thresholds to sweep')
+    args = parser.parse_args()
 
-def get_retrieved_contexts(query: str, top_k: int) -> List[str]:
-    """Get contexts (documents) retrieved by the RAG system."""
-    db = Chroma(
-        persist_directory=CHROMA_PATH,
-        embedding_function=get_embedding_function()
-    )
+    test_cases = load_test_cases()
+    print(f"\nLoaded {len(test_cases)} test cases")
 
-    results = db.similarity_search_with_score(query, k=top_k)
+    print_retrieval_sweep(run_retrieval_evaluation(test_cases, sorted(args.k), args.thresholds))
 
-    if not results:
-        return []
 
-    contexts = [doc.page_content for doc, _ in results]
-    return contexts
+if __name__ == "__main__":
+    main()
@@ -1,56 +1,288 @@
 import sqlite3
 import json
+import re
+import base64
+import hashlib
+import threading
 from pathlib import Path
 from datetime import datetime
-from typing import List, Dict, Optional, Any
-from config import BASE_DIR
+from typing import List, Dict, Optional, Any, Tuple
+from config import BASE_DIR, CHAT_SEARCH_MAX_CANDIDATES
+from utils.ids import new_ulid, encode_ulid
+from utils.document_index_utils import get_document_catalog
 
 CHAT_DB_PATH = BASE_DIR / "data" / "chats.db"
 
-def init_database():
-    """Initialize the chat database with required tables and indexes."""
+BUSY_TIMEOUT_MS = 5000
+STATEMENT_CACHE_SIZE = 256
+
+# One connection per thread, reused across calls instead of reconnecting each time
+_local = threading.local()
+_connections = []
+_connections_lock = threading.Lock()
+_generation = 0  # Bumped by close_connections so threads reopen instead of reusing a closed handle
+
+# Database files whose schema is current; set up lazily so importing this module never touches a database
+_initialized_paths = set()
+_init_lock = threading.Lock()
+
+
+def get_connection() -> sqlite3.Connection:
+    """
+    Get this thread's connection to the chat database, opening and tuning it
+    on first use: WAL so reads don't block behind writes, synchronous=NORMAL
+    (durable under WAL except on power loss), a busy timeout for writer
+    contention, a larger prepared statement cache and foreign key
+    enforcement so deleting a chat cascades to its messages. The first
+    connection to a database file in this process creates the schema and
+    applies pending migrations.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is not None and _local.path == CHAT_DB_PATH and _local.generation == _generation:
+        return conn
+
     CHAT_DB_PATH.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(
+        CHAT_DB_PATH,
+        timeout=BUSY_TIMEOUT_MS / 1000,
+        cached_statements=STATEMENT_CACHE_SIZE,
+        check_same_thread=False  # Only close_connections touches it from another thread
+    )
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    conn.execute("PRAGMA foreign_keys=ON")  # Off by default; needed for ON DELETE CASCADE
 
-    with sqlite3.connect(CHAT_DB_PATH) as conn:
-        # Create chats table
-        conn.execute('''
-            CREATE TABLE IF NOT EXISTS chats (
-                id TEXT PRIMARY KEY,
-                title TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-
-        # Create messages table
-        conn.execute('''
-            CREATE TABLE IF NOT EXISTS messages (
-                id TEXT PRIMARY KEY,
-                chat_id TEXT NOT NULL,
-                role TEXT NOT NULL,
-                content TEXT NOT NULL,
-                citations TEXT,
-                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (chat_id) REFERENCES chats(id) ON DELETE CASCADE
-            )
-        ''')
-
-        # Create indexes for performance
-        conn.execute('CREATE INDEX IF NOT EXISTS idx_messages_chat_id ON messages(chat_id)')
-        conn.execute('CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON messages(timestamp)')
-        conn.execute('CREATE INDEX IF NOT EXISTS idx_chats_updated_at ON chats(updated_at)')
-
-        # Add sources column if it doesn't exist (for backward compatibility)
+    _local.conn = conn
+    _local.path = CHAT_DB_PATH
+    _local.generation = _generation
+    with _connections_lock:
+        _connections.append(conn)
+
+    if CHAT_DB_PATH not in _initialized_paths:
+        with _init_lock:
+            if CHAT_DB_PATH not in _initialized_paths:
+                with conn:
+                    create_schema(conn)
+                _initialized_paths.add(CHAT_DB_PATH)
+
+    return conn
+
+
+def close_connections():
+    """Close every pooled connection (on shutdown)."""
+    global _generation
+
+    with _connections_lock:
+        _generation += 1
+        for conn in _connections:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        _connections.clear()
+
+
+def init_database():
+    """Initialize the chat database now rather than on first use (e.g. at API startup)."""
+    get_connection()
+
+def create_schema(conn: sqlite3.Connection):
+    """Create the required tables and indexes, then apply pending migrations."""
+    # Create chats table
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS chats (
+            id TEXT PRIMARY KEY,
+            title TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Create messages table
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS messages (
+            id TEXT PRIMARY KEY,
+            chat_id TEXT NOT NULL,
+            role TEXT NOT NULL,
+            content TEXT NOT NULL,
+            citations TEXT,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (chat_id) REFERENCES chats(id) ON DELETE CASCADE
+        )
+    ''')
+
+    # Create indexes for performance (composite ones back keyset pagination)
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_messages_chat_id_id ON messages(chat_id, id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON messages(timestamp)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_chats_updated_at_id ON chats(updated_at, id)')
+
+    # Add sources column if it doesn't exist (for backward compatibility)
+    try:
+        conn.execute('ALTER TABLE messages ADD COLUMN sources TEXT')
+    except sqlite3.OperationalError:
+        pass  # Column already exists
+
+    run_migrations(conn)
+
+def migrate_sortable_ids(conn: sqlite3.Connection):
+    """
+    Rewrite legacy millisecond message IDs ('msg_<ms>') as ULIDs with the
+    same timestamp, so old and new messages sort together by ID.
+    """
+    rows = conn.execute("SELECT rowid, id FROM messages WHERE id LIKE 'msg_%'").fetchall()
+    for rowid, message_id in rows:
+        legacy_ms = message_id[len('msg_'):]
+        if not legacy_ms.isdigit():
+            continue
+        # Deterministic randomness keeps the migration reproducible
+        entropy = int.from_bytes(hashlib.sha256(message_id.encode()).digest()[:10], 'big')
+        conn.execute('UPDATE messages SET id = ? WHERE rowid = ?',
+                     (f"msg_{encode_ulid(int(legacy_ms), entropy)}", rowid))
+
+    # Superseded by the composite indexes
+    conn.execute('DROP INDEX IF EXISTS idx_messages_chat_id')
+    conn.execute('DROP INDEX IF EXISTS idx_chats_updated_at')
+
+def migrate_chat_summaries(conn: sqlite3.Connection):
+    """Rolling conversation summary per chat and the last message ID folded into it."""
+    conn.execute('ALTER TABLE chats ADD COLUMN summary TEXT')
+    conn.execute('ALTER TABLE chats ADD COLUMN summary_upto TEXT')
+
+def migrate_message_search(conn: sqlite3.Connection):
+    """
+    FTS5 index over message content, kept in sync by triggers (external
+    content table, so the text is not stored twice) and backfilled.
+    """
+    conn.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+            content,
+            content='messages',
+            content_rowid='rowid',
+            tokenize='unicode61 remove_diacritics 2',
+            prefix='4'
+        )
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+            INSERT INTO messages_fts(rowid, content) VALUES (new.rowid, new.content);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+            INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.rowid, old.content);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF content ON messages BEGIN
+            INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.rowid, old.content);
+            INSERT INTO messages_fts(rowid, content) VALUES (new.rowid, new.content);
+        END
+    ''')
+    conn.execute("INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')")
+
+def migrate_normalized_sources(conn: sqlite3.Connection):
+    """
+    Move per-message citation/source JSON into message_sources rows that
+    reference a shared documents table. Citations that were derived from
+    sources are rebuilt on read, so both JSON columns are cleared.
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS documents (
+            doc_id TEXT PRIMARY KEY,
+            title TEXT NOT NULL,
+            organization TEXT,
+            organization_acronym TEXT,
+            year INTEGER,
+            author TEXT,
+            link TEXT
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS message_sources (
+            message_id TEXT NOT NULL REFERENCES messages(id) ON DELETE CASCADE,
+            rank INTEGER NOT NULL,
+            doc_id TEXT NOT NULL REFERENCES documents(doc_id),
+            similarity REAL,
+            PRIMARY KEY (message_id, rank)
+        ) WITHOUT ROWID
+    ''')
+
+    rows = conn.execute('SELECT id, sources FROM messages WHERE sources IS NOT NULL').fetchall()
+    for message_id, sources_json in rows:
+        insert_message_sources(conn, message_id, json.loads(sources_json))
+
+    conn.execute('UPDATE messages SET sources = NULL, citations = NULL WHERE sources IS NOT NULL')
+
+def migrate_incremental_vacuum(conn: sqlite3.Connection):
+    """
+    Switch to auto_vacuum=INCREMENTAL so pages freed by deletes can be
+    returned in small steps. Changing the mode needs one full VACUUM, which
+    may renumber message rowids, so the FTS index is rebuilt afterwards.
+    """
+    conn.commit()  # VACUUM can't run inside a transaction
+    conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+    conn.execute('VACUUM')
+    conn.execute("INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')")
+
+# Applied in order; PRAGMA user_version records how many have run
+MIGRATIONS = [
+    migrate_sortable_ids,
+    migrate_chat_summaries,
+    migrate_message_search,
+    migrate_normalized_sources,
+    migrate_incremental_vacuum,
+]
+
+# VACUUM can't run in a transaction; these are safe to run again if interrupted
+NON_TRANSACTIONAL_MIGRATIONS = {migrate_incremental_vacuum}
+
+def run_migrations(conn: sqlite3.Connection):
+    """
+    Apply schema/data migrations newer than the database's user_version.
+    Each migration and its user_version bump commit in one transaction, so
+    a crash never leaves a migration applied but unrecorded. The version is
+    re-read under the write lock, so concurrent processes don't both apply it.
+    """
+    conn.commit()
+    while True:
+        conn.execute('BEGIN IMMEDIATE')
         try:
-            conn.execute('ALTER TABLE messages ADD COLUMN sources TEXT')
-        except sqlite3.OperationalError:
-            pass  # Column already exists
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+            if version >= len(MIGRATIONS):
+                conn.commit()
+                return
+
+            migration = MIGRATIONS[version]
+            print(f"Applying chat database migration {version + 1}: {migration.__name__}")
+            if migration in NON_TRANSACTIONAL_MIGRATIONS:
+                conn.commit()
+                migration(conn)
+                conn.commit()
+                conn.execute('BEGIN IMMEDIATE')
+                if conn.execute('PRAGMA user_version').fetchone()[0] != version:
+                    conn.commit()  # Another process recorded it meanwhile
+                    continue
+            else:
+                migration(conn)
+            conn.execute(f'PRAGMA user_version = {version + 1}')
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+def encode_cursor(*parts: str) -> str:
+    """Opaque pagination cursor."""
+    return base64.urlsafe_b64encode(json.dumps(parts).encode()).decode()
+
+def decode_cursor(cursor: str) -> list:
+    return json.loads(base64.urlsafe_b64decode(cursor.encode()))
 
 def create_chat(title: str) -> str:
     """Create a new chat thread and return its ID."""
-    chat_id = f"chat_{int(datetime.now().timestamp() * 1000)}"
+    chat_id = f"chat_{new_ulid()}"
 
-    with sqlite3.connect(CHAT_DB_PATH) as conn:
+    with get_connection() as conn:
         conn.execute('''
             INSERT INTO chats (id, title)
             VALUES (?, ?)
@@ -58,25 +290,85 @@ def create_chat(title: str) -> str:
 
     return chat_id
 
+def new_message_id() -> str:
+    """Monotonic, collision-free message ID that sorts in creation order."""
+    return f"msg_{new_ulid()}"
+
+def current_timestamp() -> str:
+    """UTC timestamp in the same format as SQLite's CURRENT_TIMESTAMP."""
+    return datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+
+def source_doc_id(source: Dict[str, Any]) -> str:
+    """Document ID for a source; sources from older indexes are matched by title."""
+    if source.get('doc_id'):
+        return source['doc_id']
+
+    doc = get_document_catalog().find_by_title(source.get('title', ''))
+    if doc:
+        return doc['id']
+
+    title_hash = hashlib.sha1((source.get('title') or '').encode('utf-8')).hexdigest()[:16]
+    return f"title:{title_hash}"
+
+def parse_similarity(value: Any) -> Optional[float]:
+    """'85.3%' -> 0.853"""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        return float(value.rstrip('%')) / 100
+    return float(value)
+
+def insert_message_sources(conn: sqlite3.Connection, message_id: str, sources: List[Dict[str, Any]]):
+    """Store a message's sources as rows referencing the documents table."""
+    source_rows = []
+    for rank, source in enumerate(sources):
+        doc_id = source_doc_id(source)
+        conn.execute('''
+            INSERT INTO documents (doc_id, title, organization, organization_acronym, year, author, link)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(doc_id) DO UPDATE SET
+                title = excluded.title,
+                organization = excluded.organization,
+                organization_acronym = excluded.organization_acronym,
+                year = excluded.year,
+                author = excluded.author,
+                link = excluded.link
+        ''', (doc_id, source.get('title') or doc_id, source.get('organization'), source.get('organization_acronym'),
+              source.get('year'), source.get('author'), source.get('link')))
+        source_rows.append((message_id, rank, doc_id, parse_similarity(source.get('similarity'))))
+
+    conn.executemany('''
+        INSERT OR REPLACE INTO message_sources (message_id, rank, doc_id, similarity)
+        VALUES (?, ?, ?, ?)
+    ''', source_rows)
+
+def build_citations(sources: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Citation entries shown by the frontend, derived from a message's sources."""
+    return [{
+        "id": f"cite-{i}",
+        "label": f"[{i + 1}]",
+        "organization": source["organization"],
+        "year": source["year"],
+        "title": source["title"],
+        "url": source["link"],
+        "excerpt": f"Similitud: {source['similarity']}"
+    } for i, source in enumerate(sources)]
+
 def save_message(chat_id: str, role: str, content: str, citations: Optional[List[Dict[str, Any]]] = None, sources: Optional[List[Dict[str, Any]]] = None) -> str:
     """Save a message to the database and return its ID."""
-    message_id = f"msg_{int(datetime.now().timestamp() * 1000)}"
+    message_id = new_message_id()
 
     try:
-        with sqlite3.connect(CHAT_DB_PATH) as conn:
-            citations_json = json.dumps(citations) if citations else None
-            sources_json = json.dumps(sources) if sources else None
-            print(f"Saving message: role={role}, content_length={len(content)}, citations_present={citations is not None}, sources_present={sources is not None}")
-
-            conn.execute('''
-                INSERT INTO messages (id, chat_id, role, content, citations, sources)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (message_id, chat_id, role, content, citations_json, sources_json))
-
-            # Update chat's updated_at timestamp
-            conn.execute('''
-                UPDATE chats SET updated_at = CURRENT_TIMESTAMP WHERE id = ?
-            ''', (chat_id,))
+        print(f"Saving message: role={role}, content_length={len(content)}, citations_present={citations is not None}, sources_present={sources is not None}")
+        save_messages([{
+            'id': message_id,
+            'chat_id': chat_id,
+            'role': role,
+            'content': content,
+            'citations': citations,
+            'sources': sources,
+            'timestamp': current_timestamp(),
+        }])
 
         print(f"Successfully saved message with ID: {message_id}")
         return message_id
@@ -86,67 +378,271 @@ def save_message(chat_id: str, role: str, content: str, citations: Optional[List
         traceback.print_exc()
         raise
 
-def get_chat_list(limit: int = 50) -> List[Dict[str, Any]]:
-    """Get list of chats ordered by most recent update."""
-    with sqlite3.connect(CHAT_DB_PATH) as conn:
-        rows = conn.execute('''
-            SELECT id, title, created_at, updated_at
-            FROM chats
-            ORDER BY updated_at DESC
-            LIMIT ?
-        ''', (limit,)).fetchall()
+def save_messages(messages: List[Dict[str, Any]]):
+    """
+    Insert a batch of messages in one transaction, updating each chat's
+    updated_at once per batch instead of once per message. Sources are
+    stored in message_sources; only citations that don't come from sources
+    are kept as JSON. Messages for chats that no longer exist are dropped,
+    and messages already stored (replayed from the writer's outbox) are
+    skipped, so a batch can be saved again safely.
+    """
+    chat_ids = list(dict.fromkeys(m['chat_id'] for m in messages))
+    message_ids = [m['id'] for m in messages]
+
+    with get_connection() as conn:
+        placeholders = ','.join('?' * len(chat_ids))
+        existing = {row[0] for row in conn.execute(f'SELECT id FROM chats WHERE id IN ({placeholders})', chat_ids)}
+        placeholders = ','.join('?' * len(message_ids))
+        stored = {row[0] for row in conn.execute(f'SELECT id FROM messages WHERE id IN ({placeholders})', message_ids)}
+    missing = [chat_id for chat_id in chat_ids if chat_id not in existing]
+    if missing:
+        print(f"Dropping messages for missing chats: {', '.join(missing)}")
+    messages = [m for m in messages if m['chat_id'] in existing and m['id'] not in stored]
+    chat_ids = [chat_id for chat_id in chat_ids if chat_id in existing]
+    if not messages:
+        return
+
+    rows = [(
+        m['id'], m['chat_id'], m['role'], m['content'],
+        json.dumps(m['citations']) if m.get('citations') and not m.get('sources') else None,
+        m['timestamp']
+    ) for m in messages]
+
+    with get_connection() as conn:
+        conn.executemany('''
+            INSERT INTO messages (id, chat_id, role, content, citations, timestamp)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', rows)
+        for m in messages:
+            if m.get('sources'):
+                insert_message_sources(conn, m['id'], m['sources'])
+        conn.executemany('''
+            UPDATE chats SET updated_at = CURRENT_TIMESTAMP WHERE id = ?
+        ''', [(chat_id,) for chat_id in chat_ids])
+
+def get_chat_list(limit: int = 50, cursor: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    Get a page of chats ordered by most recent update.
+    Returns the chats and the cursor for the next page (None on the last page).
+    """
+    with get_connection() as conn:
+        if cursor:
+            updated_at, chat_id = decode_cursor(cursor)
+            rows = conn.execute('''
+                SELECT id, title, created_at, updated_at
+                FROM chats
+                WHERE (updated_at, id) < (?, ?)
+                ORDER BY updated_at DESC, id DESC
+                LIMIT ?
+            ''', (updated_at, chat_id, limit + 1)).fetchall()
+        else:
+            rows = conn.execute('''
+                SELECT id, title, created_at, updated_at
+                FROM chats
+                ORDER BY updated_at DESC, id DESC
+                LIMIT ?
+            ''', (limit + 1,)).fetchall()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1][3], rows[-1][0])
 
         return [{
             'id': row[0],
             'title': row[1],
             'created_at': row[2],
             'updated_at': row[3]
-        } for row in rows]
+        } for row in rows], next_cursor
 
-def get_chat_messages(chat_id: str) -> List[Dict[str, Any]]:
-    """Get all messages for a specific chat."""
-    with sqlite3.connect(CHAT_DB_PATH) as conn:
-        rows = conn.execute('''
-            SELECT id, role, content, citations, sources, timestamp
-            FROM messages
-            WHERE chat_id = ?
-            ORDER BY timestamp ASC
-        ''', (chat_id,)).fetchall()
+def get_chat_list_version() -> Tuple[Optional[str], int, Optional[str]]:
+    """Cheap fingerprint of the chat list: latest updated_at, chat count, newest chat ID."""
+    with get_connection() as conn:
+        return tuple(conn.execute('SELECT MAX(updated_at), COUNT(*), MAX(id) FROM chats').fetchone())
+
+def get_chat_version(chat_id: str) -> Optional[Tuple[str, int, Optional[str]]]:
+    """Cheap fingerprint of a chat: updated_at, message count, newest message ID."""
+    with get_connection() as conn:
+        row = conn.execute('''
+            SELECT c.updated_at, COUNT(m.id), MAX(m.id)
+            FROM chats c
+            LEFT JOIN messages m ON m.chat_id = c.id
+            WHERE c.id = ?
+            GROUP BY c.id
+        ''', (chat_id,)).fetchone()
+        return tuple(row) if row else None
+
+def get_chat_messages(chat_id: str, limit: Optional[int] = None, before: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    Get messages for a specific chat in chronological order, with sources
+    and citations hydrated in the same query.
+    With a limit, returns the newest `limit` messages older than `before`
+    (a message ID) plus the cursor for the previous page.
+    """
+    if limit is None:
+        page_query = 'SELECT * FROM messages WHERE chat_id = ?'
+        params = (chat_id,)
+    else:
+        page_query = 'SELECT * FROM messages WHERE chat_id = ? AND id < ? ORDER BY id DESC LIMIT ?'
+        params = (chat_id, before or '\uffff', limit + 1)
+
+    with get_connection() as conn:
+        rows = conn.execute(f'''
+            SELECT m.id, m.role, m.content, m.citations, m.sources, m.timestamp,
+                   ms.similarity, d.doc_id, d.title, d.organization, d.organization_acronym,
+                   d.year, d.author, d.link
+            FROM ({page_query}) m
+            LEFT JOIN message_sources ms ON ms.message_id = m.id
+            LEFT JOIN documents d ON d.doc_id = ms.doc_id
+            ORDER BY m.id ASC, ms.rank ASC
+        ''', params).fetchall()
 
-        messages = []
-        for row in rows:
-            message = {
+    messages = {}
+    for row in rows:
+        message = messages.get(row[0])
+        if message is None:
+            message = messages[row[0]] = {
                 'id': row[0],
                 'role': row[1],
                 'content': row[2],
                 'timestamp': row[5]
             }
-            if row[3]:  # citations
+            if row[3]:  # citations not derived from sources
                 message['citations'] = json.loads(row[3])
-            if row[4]:  # sources
+            if row[4]:  # sources from before normalization
                 message['sources'] = json.loads(row[4])
-            messages.append(message)
 
-        return messages
+        if row[7] is not None:
+            message.setdefault('sources', []).append({
+                'doc_id': row[7],
+                'title': row[8],
+                'organization': row[9],
+                'organization_acronym': row[10],
+                'year': row[11],
+                'author': row[12],
+                'link': row[13],
+                'similarity': f"{row[6]*100:.1f}%" if row[6] is not None else None
+            })
+
+    messages = list(messages.values())
+    for message in messages:
+        if message.get('sources') and 'citations' not in message:
+            message['citations'] = build_citations(message['sources'])
+
+    next_cursor = None
+    if limit is not None and len(messages) > limit:
+        messages = messages[1:]
+        next_cursor = messages[0]['id']
+
+    return messages, next_cursor
+
+def build_fts_query(text: str) -> Optional[str]:
+    """
+    Turn free text into a safe FTS5 query: every word must match, quoted so
+    user input can't inject FTS syntax, with prefix matching on the last word
+    when it is long enough for the prefix index to keep it selective.
+    """
+    words = re.findall(r'\w+', text)
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    if len(words[-1]) >= 4:
+        terms[-1] += '*'
+    return ' '.join(terms)
+
+def search_messages(query: str, limit: int = 20, offset: int = 0) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+    """
+    Full-text search over message content, best matches first (BM25).
+    Returns the hits and the offset of the next page (None on the last page).
+    Only the CHAT_SEARCH_MAX_CANDIDATES most recent matches (by message ID,
+    so restored chats keep their age) are ranked, so a common term costs the
+    same as a rare one; older matches are not returned.
+    """
+    if limit < 1 or offset < 0:
+        raise ValueError("limit must be at least 1 and offset non-negative")
+
+    fts_query = build_fts_query(query)
+    limit = min(limit, CHAT_SEARCH_MAX_CANDIDATES - offset)
+    if fts_query is None or limit <= 0:
+        return [], None
+
+    with get_connection() as conn:
+        # Finding the cutoff walks the matches without scoring them; ordering by
+        # bm25() instead of rank keeps FTS5 from scoring every match, so only
+        # the candidates past the cutoff get scored and snippeted
+        cutoff = conn.execute('''
+            SELECT m.id FROM messages_fts
+            JOIN messages m ON m.rowid = messages_fts.rowid
+            WHERE messages_fts MATCH ?
+            ORDER BY m.id DESC
+            LIMIT 1 OFFSET ?
+        ''', (fts_query, CHAT_SEARCH_MAX_CANDIDATES - 1)).fetchone()
+
+        rows = conn.execute('''
+            SELECT m.id, m.chat_id, c.title, m.role, m.timestamp,
+                   snippet(messages_fts, 0, '<mark>', '</mark>', '…', 16),
+                   bm25(messages_fts) AS score
+            FROM messages_fts
+            JOIN messages m ON m.rowid = messages_fts.rowid
+            JOIN chats c ON c.id = m.chat_id
+            WHERE messages_fts MATCH ? AND m.id >= ?
+            ORDER BY score, m.id DESC
+            LIMIT ? OFFSET ?
+        ''', (fts_query, cutoff[0] if cutoff else '', limit + 1, offset)).fetchall()
+
+    next_offset = offset + limit if len(rows) > limit else None
+
+    return [{
+        'message_id': row[0],
+        'chat_id': row[1],
+        'chat_title': row[2],
+        'role': row[3],
+        'timestamp': row[4],
+        'snippet': row[5],
+        'score': -row[6]  # bm25() is lower-is-better
+    } for row in rows[:limit]], next_offset
+
+def get_messages_between(chat_id: str, after_id: Optional[str], before_id: Optional[str]) -> List[Dict[str, str]]:
+    """Role and content of a chat's messages with after_id < id < before_id, oldest first."""
+    with get_connection() as conn:
+        rows = conn.execute('''
+            SELECT id, role, content
+            FROM messages
+            WHERE chat_id = ? AND id > ? AND id < ?
+            ORDER BY id ASC
+        ''', (chat_id, after_id or '', before_id or '\uffff')).fetchall()
+
+        return [{'id': row[0], 'role': row[1], 'content': row[2]} for row in rows]
+
+def get_chat_summary(chat_id: str) -> Tuple[Optional[str], Optional[str]]:
+    """Get a chat's rolling summary and the last message ID it covers."""
+    with get_connection() as conn:
+        row = conn.execute('SELECT summary, summary_upto FROM chats WHERE id = ?', (chat_id,)).fetchone()
+        return (row[0], row[1]) if row else (None, None)
+
+def update_chat_summary(chat_id: str, summary: str, summary_upto: str):
+    """Store a chat's rolling summary."""
+    with get_connection() as conn:
+        conn.execute('''
+            UPDATE chats SET summary = ?, summary_upto = ? WHERE id = ?
+        ''', (summary, summary_upto, chat_id))
 
 def delete_chat(chat_id: str) -> bool:
-    """Delete a chat and all its messages."""
-    with sqlite3.connect(CHAT_DB_PATH) as conn:
+    """Delete a chat and all its messages (they cascade with foreign keys on)."""
+    with get_connection() as conn:
         cursor = conn.execute('DELETE FROM chats WHERE id = ?', (chat_id,))
-        return cursor.rowcount > 0
+    return cursor.rowcount > 0
 
 def get_chat_title(chat_id: str) -> Optional[str]:
     """Get the title of a specific chat."""
-    with sqlite3.connect(CHAT_DB_PATH) as conn:
+    with get_connection() as conn:
         row = conn.execute('SELECT title FROM chats WHERE id = ?', (chat_id,)).fetchone()
         return row[0] if row else None
 
 def update_chat_title(chat_id: str, title: str):
     """Update the title of a chat."""
-    with sqlite3.connect(CHAT_DB_PATH) as conn:
+    with get_connection() as conn:
         conn.execute('''
             UPDATE chats SET title = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?
-        ''', (title, chat_id))
-
-# Initialize database on import
-init_database()
\ No newline at end of file
+        ''', (title, chat_id))
\ No newline at end of file
@@ -0,0 +1,274 @@
+import gzip
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import List, Dict, Optional, Any
+
+from config import CHAT_ARCHIVE_DIR, CHAT_VACUUM_INTERVAL_SECONDS, CHAT_VACUUM_PAGES
+import utils.chat_db as chat_db
+
+# Chat IDs become file names, so anything outside this set is rejected
+_CHAT_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]+$')
+
+# chat_id -> (lock, threads using it); serializes restores of the same chat
+_restore_locks = {}
+_restore_locks_lock = threading.Lock()
+
+
+def archive_path(chat_id: str) -> Path:
+    if not _CHAT_ID_PATTERN.match(chat_id):
+        raise ValueError(f"Invalid chat ID: {chat_id!r}")
+    return CHAT_ARCHIVE_DIR / f"{chat_id}.json.gz"
+
+
+def is_archived(chat_id: str) -> bool:
+    try:
+        return archive_path(chat_id).exists()
+    except ValueError:
+        return False
+
+
+def list_archived() -> List[str]:
+    return sorted(p.name[:-len(".json.gz")] for p in CHAT_ARCHIVE_DIR.glob("*.json.gz"))
+
+
+def _fetch_dicts(conn, sql: str, params: tuple) -> List[Dict[str, Any]]:
+    cursor = conn.execute(sql, params)
+    columns = [column[0] for column in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def _insert_dicts(conn, table: str, rows: List[Dict[str, Any]]):
+    """INSERT OR IGNORE rows read back from an archive, keeping only real columns."""
+    if not rows:
+        return
+    table_columns = {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+    columns = [column for column in rows[0] if column in table_columns]
+    placeholders = ', '.join('?' * len(columns))
+    conn.executemany(
+        f'INSERT OR IGNORE INTO {table} ({", ".join(columns)}) VALUES ({placeholders})',
+        [tuple(row.get(column) for column in columns) for row in rows]
+    )
+
+
+def _write_archive(path: Path, snapshot: Dict[str, Any]):
+    """Write a gzip'd JSON snapshot atomically (temp file, fsync, rename)."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, "wb") as f:
+        with gzip.GzipFile(fileobj=f, mode="wb") as gz:
+            gz.write(json.dumps(snapshot, ensure_ascii=False).encode("utf-8"))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+@contextmanager
+def _restore_lock(chat_id: str):
+    """Per-chat lock, dropped once no thread is restoring that chat."""
+    with _restore_locks_lock:
+        lock, users = _restore_locks.get(chat_id, (threading.Lock(), 0))
+        _restore_locks[chat_id] = (lock, users + 1)
+    try:
+        with lock:
+            yield
+    finally:
+        with _restore_locks_lock:
+            lock, users = _restore_locks[chat_id]
+            if users == 1:
+                del _restore_locks[chat_id]
+            else:
+                _restore_locks[chat_id] = (lock, users - 1)
+
+
+def archive_chat(chat_id: str) -> bool:
+    """
+    Move a chat, its messages and their sources to compressed cold storage.
+    The archive is durable on disk before the rows are deleted.
+    """
+    path = archive_path(chat_id)
+
+    with chat_db.get_connection() as conn:
+        conn.execute('BEGIN IMMEDIATE')  # No writes to the chat between snapshot and delete
+        chats = _fetch_dicts(conn, 'SELECT * FROM chats WHERE id = ?', (chat_id,))
+        if not chats:
+            return False
+
+        snapshot = {
+            "chat": chats[0],
+            "messages": _fetch_dicts(conn, 'SELECT * FROM messages WHERE chat_id = ? ORDER BY id', (chat_id,)),
+            "message_sources": _fetch_dicts(conn, '''
+                SELECT ms.* FROM message_sources ms
+                JOIN messages m ON m.id = ms.message_id
+                WHERE m.chat_id = ?
+            ''', (chat_id,)),
+            "documents": _fetch_dicts(conn, '''
+                SELECT DISTINCT d.* FROM documents d
+                JOIN message_sources ms ON ms.doc_id = d.doc_id
+                JOIN messages m ON m.id = ms.message_id
+                WHERE m.chat_id = ?
+            ''', (chat_id,)),
+        }
+        _write_archive(path, snapshot)
+        conn.execute('DELETE FROM chats WHERE id = ?', (chat_id,))
+
+    return True
+
+
+def restore_chat(chat_id: str) -> bool:
+    """
+    Bring an archived chat back into the live database. Its updated_at is
+    bumped so the next retention run doesn't archive it straight away.
+    Concurrent restores of one chat are serialized; the ones that lose the
+    race return True once the winner has brought the chat back.
+    """
+    path = archive_path(chat_id)
+    if not path.exists():
+        return False
+
+    with _restore_lock(chat_id):
+        if not path.exists():
+            return chat_db.get_chat_title(chat_id) is not None
+        return _restore_archive(chat_id, path)
+
+
+def _restore_archive(chat_id: str, path: Path) -> bool:
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        snapshot = json.load(f)
+
+    with chat_db.get_connection() as conn:
+        _insert_dicts(conn, 'chats', [snapshot["chat"]])
+        _insert_dicts(conn, 'documents', snapshot["documents"])  # Existing catalog entries win
+        _insert_dicts(conn, 'messages', snapshot["messages"])
+        _insert_dicts(conn, 'message_sources', snapshot["message_sources"])
+        conn.execute('UPDATE chats SET updated_at = CURRENT_TIMESTAMP WHERE id = ?', (chat_id,))
+
+    path.unlink(missing_ok=True)  # Another process may have restored it too
+    print(f"Restored chat {chat_id} from archive ({len(snapshot['messages'])} messages)")
+    return True
+
+
+def delete_archive(chat_id: str) -> bool:
+    try:
+        archive_path(chat_id).unlink()
+        return True
+    except (FileNotFoundError, ValueError):
+        return False
+
+
+def select_expired_chats(retention_days: Optional[int], max_chats: Optional[int]) -> List[str]:
+    """Chats older than retention_days, plus any beyond the newest max_chats."""
+    expired = []
+    with chat_db.get_connection() as conn:
+        if retention_days is not None:
+            expired += [row[0] for row in conn.execute('''
+                SELECT id FROM chats WHERE updated_at < datetime('now', ?)
+            ''', (f'-{int(retention_days)} days',))]
+        if max_chats is not None:
+            expired += [row[0] for row in conn.execute('''
+                SELECT id FROM chats ORDER BY updated_at DESC, id DESC LIMIT -1 OFFSET ?
+            ''', (max_chats,))]
+
+    return list(dict.fromkeys(expired))
+
+
+def clean_orphans() -> Dict[str, int]:
+    """Delete messages whose chat is gone and sources whose message is gone."""
+    with chat_db.get_connection() as conn:
+        messages = conn.execute('''
+            DELETE FROM messages WHERE chat_id NOT IN (SELECT id FROM chats)
+        ''').rowcount
+        sources = conn.execute('''
+            DELETE FROM message_sources WHERE message_id NOT IN (SELECT id FROM messages)
+        ''').rowcount
+
+    return {"messages": messages, "message_sources": sources}
+
+
+def database_size() -> Dict[str, int]:
+    """Allocated and free bytes in the database file, plus the WAL size."""
+    conn = chat_db.get_connection()
+    page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+    page_count = conn.execute('PRAGMA page_count').fetchone()[0]
+    freelist = conn.execute('PRAGMA freelist_count').fetchone()[0]
+    wal_path = Path(f"{chat_db.CHAT_DB_PATH}-wal")
+
+    return {
+        "file_bytes": page_size * page_count,
+        "free_bytes": page_size * freelist,
+        "wal_bytes": wal_path.stat().st_size if wal_path.exists() else 0,
+    }
+
+
+def incremental_vacuum(max_pages: Optional[int] = CHAT_VACUUM_PAGES) -> int:
+    """Return up to max_pages free pages to the filesystem. Returns pages freed."""
+    conn = chat_db.get_connection()
+    before = conn.execute('PRAGMA freelist_count').fetchone()[0]
+    if before == 0:
+        return 0
+
+    # conn.execute() steps the pragma once (one page); executescript runs it to completion
+    pages = '' if max_pages is None else f'({int(max_pages)})'
+    conn.executescript(f'PRAGMA incremental_vacuum{pages};')
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+    return before - conn.execute('PRAGMA freelist_count').fetchone()[0]
+
+
+def format_bytes(size: int) -> str:
+    for unit in ("B", "KB", "MB"):
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+
+def run_maintenance(retention_days: Optional[int], max_chats: Optional[int], vacuum: bool = True) -> Dict[str, Any]:
+    """Archive expired chats, clean orphans and vacuum; report sizes and timings."""
+    report = {"size_before": database_size(), "timings": {}}
+
+    start = time.perf_counter()
+    expired = select_expired_chats(retention_days, max_chats)
+    report["archived"] = sum(archive_chat(chat_id) for chat_id in expired)
+    report["timings"]["archive"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    report["orphans"] = clean_orphans()
+    report["timings"]["orphans"] = time.perf_counter() - start
+
+    if vacuum:
+        start = time.perf_counter()
+        report["pages_freed"] = incremental_vacuum(max_pages=None)
+        report["timings"]["vacuum"] = time.perf_counter() - start
+
+    report["size_after"] = database_size()
+    return report
+
+
+class BackgroundVacuum:
+    """Periodically runs a bounded incremental vacuum on its own thread."""
+
+    def __init__(self, interval: float = CHAT_VACUUM_INTERVAL_SECONDS, max_pages: int = CHAT_VACUUM_PAGES):
+        self.interval = interval
+        self.max_pages = max_pages
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="chat-vacuum", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        self._stop_event.set()
+        self._thread.join(timeout=timeout)
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                start = time.perf_counter()
+                freed = incremental_vacuum(self.max_pages)
+                if freed:
+                    print(f"Chat vacuum freed {freed} pages in {time.perf_counter() - start:.2f}s")
+            except Exception as e:
+                print(f"Error during chat database vacuum: {e}")
@@ -0,0 +1,285 @@
+import atexit
+import json
+import queue
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import List, Dict, Optional, Any
+
+from config import CHAT_OUTBOX_PATH, CHAT_WRITER_RETRY_SECONDS, CHAT_WRITER_MAX_ATTEMPTS
+from utils.chat_db import new_message_id, current_timestamp, save_messages
+from utils.response_cache import invalidate_chat
+
+BATCH_SIZE = 200
+MAX_RETRIES = 5
+
+
+class ChatOutbox:
+    """
+    Messages the writer has acknowledged but not yet committed, kept in
+    their own SQLite file so a crash or a failing chat database doesn't
+    lose them. Rows are removed once their message commits and replayed
+    when the next writer starts. Messages that keep failing on their own
+    are quarantined: they stay here with their error and are not replayed.
+    """
+
+    def __init__(self, path: Path = CHAT_OUTBOX_PATH):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS outbox (
+                id TEXT PRIMARY KEY,
+                payload TEXT NOT NULL,
+                error TEXT
+            ) WITHOUT ROWID
+        ''')
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(outbox)")}
+        if "error" not in columns:
+            self.conn.execute("ALTER TABLE outbox ADD COLUMN error TEXT")
+        self._lock = threading.Lock()
+
+    def add(self, message: Dict[str, Any]):
+        with self._lock, self.conn:
+            self.conn.execute("INSERT INTO outbox (id, payload) VALUES (?, ?)",
+                              (message['id'], json.dumps(message)))
+
+    def remove(self, message_ids: List[str]):
+        with self._lock, self.conn:
+            self.conn.executemany("DELETE FROM outbox WHERE id = ?", [(message_id,) for message_id in message_ids])
+
+    def quarantine(self, message_id: str, error: str):
+        with self._lock, self.conn:
+            self.conn.execute("UPDATE outbox SET error = ? WHERE id = ?", (error, message_id))
+
+    def load(self) -> List[Dict[str, Any]]:
+        """Uncommitted messages in creation order, quarantined ones excluded."""
+        with self._lock:
+            rows = self.conn.execute("SELECT payload FROM outbox WHERE error IS NULL ORDER BY id").fetchall()
+        return [json.loads(payload) for (payload,) in rows]
+
+    def quarantined(self) -> int:
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM outbox WHERE error IS NOT NULL").fetchone()[0]
+
+    def close(self):
+        self.conn.close()
+
+
+class ChatWriter:
+    """
+    Write-behind persistence for chat messages.
+    Messages are recorded in the outbox with their final ID and timestamp,
+    then committed by a background thread in batched transactions. When a
+    batch fails every attempt it is split per chat, then per message, so
+    only the messages that fail on their own are held back. Those are
+    retried separately from new batches and quarantined in the outbox after
+    CHAT_WRITER_MAX_ATTEMPTS rounds. Readers call flush() to see their own
+    writes and learn whether their chat has messages held back.
+    """
+
+    def __init__(self, batch_size: int = BATCH_SIZE, outbox_path: Path = CHAT_OUTBOX_PATH):
+        self.batch_size = batch_size
+        self._outbox = ChatOutbox(outbox_path)
+        self._queue = queue.Queue()
+        self._pending = defaultdict(int)  # chat_id -> queued but uncommitted messages
+        self._held = []  # Messages that failed on their own, waiting for their next round
+        self._attempts = defaultdict(int)  # message id -> failed rounds
+        self._failed = set()  # chats with held messages
+        self._condition = threading.Condition()
+        self._stopping = False
+
+        # Messages acknowledged by a previous process that never committed them
+        replayed = self._outbox.load()
+        if replayed:
+            print(f"Chat writer replaying {len(replayed)} messages from the outbox")
+        for message in replayed:
+            self._pending[message['chat_id']] += 1
+            self._queue.put(message)
+
+        self._thread = threading.Thread(target=self._run, name="chat-writer", daemon=True)
+        self._thread.start()
+
+    def enqueue(self, chat_id: str, role: str, content: str,
+                citations: Optional[List[Dict[str, Any]]] = None,
+                sources: Optional[List[Dict[str, Any]]] = None) -> str:
+        """Record a message in the outbox, queue it for persistence and return its ID."""
+        if self._stopping:
+            raise RuntimeError("Chat writer is shut down")
+
+        message = {
+            'id': new_message_id(),
+            'chat_id': chat_id,
+            'role': role,
+            'content': content,
+            'citations': citations,
+            'sources': sources,
+            'timestamp': current_timestamp(),
+        }
+        self._outbox.add(message)
+
+        with self._condition:
+            self._pending[chat_id] += 1
+        self._queue.put(message)
+
+        return message['id']
+
+    def flush(self, chat_id: Optional[str] = None, timeout: Optional[float] = None) -> bool:
+        """
+        Block until every queued message (or those of one chat) is committed.
+        Returns False if the timeout expired first or some of those messages
+        are held back for a retry. Quarantined messages no longer count.
+        """
+        def failed():
+            return bool(self._failed) if chat_id is None else chat_id in self._failed
+
+        def done():
+            if chat_id is None:
+                return not any(self._pending.values()) or failed()
+            return self._pending.get(chat_id, 0) == 0 or failed()
+
+        with self._condition:
+            return self._condition.wait_for(done, timeout=timeout) and not failed()
+
+    def stop(self, timeout: Optional[float] = None):
+        """Commit everything still queued, then stop the background thread."""
+        self._stopping = True
+        self._queue.put(None)
+        self._thread.join(timeout=timeout)
+
+    def _next_batch(self, timeout: Optional[float] = None) -> tuple:
+        try:
+            first = self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return [], False
+        batch = [] if first is None else [first]
+        stop = first is None
+
+        while len(batch) < self.batch_size:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                stop = True
+            else:
+                batch.append(item)
+
+        return batch, stop
+
+    def _save(self, messages: List[Dict[str, Any]]) -> Optional[str]:
+        """Commit messages in one transaction; returns the error, None on success."""
+        try:
+            save_messages(messages)
+        except Exception as e:
+            return f"{type(e).__name__}: {e}"
+
+        try:
+            self._outbox.remove([message['id'] for message in messages])
+        except Exception as e:
+            # Committed anyway; leftover rows are skipped as already stored on replay
+            print(f"Error clearing {len(messages)} messages from the chat outbox: {e}")
+
+        for chat_id in dict.fromkeys(message['chat_id'] for message in messages):
+            invalidate_chat(chat_id)
+        self._settle(messages)
+        return None
+
+    def _settle(self, messages: List[Dict[str, Any]]):
+        """Messages are committed or quarantined: stop waiting for them."""
+        with self._condition:
+            for message in messages:
+                self._attempts.pop(message['id'], None)
+                self._pending[message['chat_id']] -= 1
+                if self._pending[message['chat_id']] <= 0:
+                    del self._pending[message['chat_id']]
+            self._condition.notify_all()
+
+    def _hold(self, message: Dict[str, Any], error: str):
+        self._attempts[message['id']] += 1
+        if self._attempts[message['id']] < CHAT_WRITER_MAX_ATTEMPTS:
+            self._held.append(message)
+            return
+
+        print(f"Quarantining chat message {message['id']} (chat {message['chat_id']}) "
+              f"after {CHAT_WRITER_MAX_ATTEMPTS} failed rounds: {error}")
+        try:
+            self._outbox.quarantine(message['id'], error)
+        except Exception as e:
+            print(f"Error quarantining chat message {message['id']}: {e}")
+        self._settle([message])
+
+    def _commit(self, batch: List[Dict[str, Any]]):
+        for attempt in range(1, MAX_RETRIES + 1):
+            error = self._save(batch)
+            if error is None:
+                print(f"Chat writer committed {len(batch)} messages")
+                return
+            print(f"Error committing {len(batch)} chat messages (attempt {attempt}/{MAX_RETRIES}): {error}")
+            if attempt < MAX_RETRIES:
+                time.sleep(0.1 * 2 ** attempt)
+
+        # Isolate the failure: each chat on its own, then each message of a failing chat
+        chats = defaultdict(list)
+        for message in batch:
+            chats[message['chat_id']].append(message)
+        for messages in chats.values():
+            if len(messages) > 1 and self._save(messages) is None:
+                continue
+            for message in messages:
+                error = self._save([message])
+                if error is not None:
+                    self._hold(message, error)
+
+    def _retry_held(self):
+        held, self._held = self._held, []
+        for message in held:
+            error = self._save([message])
+            if error is not None:
+                self._hold(message, error)
+
+    def _update_failed(self):
+        with self._condition:
+            self._failed = {message['chat_id'] for message in self._held}
+            self._condition.notify_all()
+
+    def _run(self):
+        next_retry = None
+        while True:
+            timeout = max(0.0, next_retry - time.monotonic()) if self._held else None
+            batch, stop = self._next_batch(timeout=timeout)
+
+            if batch:
+                self._commit(batch)
+            if self._held and next_retry is not None and time.monotonic() >= next_retry:
+                self._retry_held()
+            if self._held and (next_retry is None or time.monotonic() >= next_retry):
+                next_retry = time.monotonic() + CHAT_WRITER_RETRY_SECONDS
+            elif not self._held:
+                next_retry = None
+            self._update_failed()
+
+            if (stop or self._stopping) and self._queue.empty():
+                if self._held:
+                    print(f"Chat writer stopped with {len(self._held)} uncommitted messages, kept in the outbox")
+                self._outbox.close()
+                return
+
+
+_chat_writer = None
+_chat_writer_lock = threading.Lock()
+
+
+def get_chat_writer() -> ChatWriter:
+    """Get or start the shared chat writer."""
+    global _chat_writer
+
+    with _chat_writer_lock:
+        if _chat_writer is None:
+            _chat_writer = ChatWriter()
+            atexit.register(_chat_writer.stop)
+
+    return _chat_writer
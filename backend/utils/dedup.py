@@ -0,0 +1,101 @@
+import re
+import zlib
+from collections import defaultdict
+
+import numpy as np
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+
+def shingle(text: str, size: int = 5) -> set:
+    """Word n-gram shingles of a normalized text."""
+    words = re.findall(r"\w+", text.lower())
+    if len(words) <= size:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+class MinHasher:
+    """MinHash signatures using universal hashing (a*x + b) mod p."""
+
+    def __init__(self, num_perm: int = 128, seed: int = 42):
+        rng = np.random.default_rng(seed)
+        self.num_perm = num_perm
+        # a, b < 2**31 and 32-bit shingle hashes keep a*x + b below 2**64
+        self.a = rng.integers(1, 1 << 31, size=num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, 1 << 31, size=num_perm, dtype=np.uint64)
+
+    def signature(self, shingles: set) -> np.ndarray:
+        if not shingles:
+            return np.full(self.num_perm, _MAX_HASH, dtype=np.uint64)
+
+        # crc32 is stable across processes, unlike the builtin hash()
+        hashes = np.fromiter(
+            (zlib.crc32(s.encode("utf-8")) for s in shingles),
+            dtype=np.uint64,
+            count=len(shingles)
+        )
+        permuted = (np.outer(self.a, hashes) + self.b[:, None]) % np.uint64(_MERSENNE_PRIME)
+        return (permuted & np.uint64(_MAX_HASH)).min(axis=1)
+
+
+def find_near_duplicates(texts: list[str], threshold: float, num_perm: int = 128, bands: int = 32,
+                         groups: list = None) -> dict:
+    """
+    Group near-duplicate texts with MinHash + LSH banding.
+    Returns {duplicate_index: representative_index}, where the representative
+    is the earliest text in its cluster. With `groups` (one label per text),
+    a cluster never holds two texts of the same group, so only texts from
+    different groups are merged.
+    """
+    rows = num_perm // bands
+    hasher = MinHasher(num_perm)
+    signatures = np.stack([hasher.signature(shingle(t)) for t in texts]) if texts else np.empty((0, num_perm), dtype=np.uint64)
+
+    # Candidate pairs: texts sharing at least one identical band
+    candidates = set()
+    for band in range(bands):
+        buckets = defaultdict(list)
+        band_slice = signatures[:, band * rows:(band + 1) * rows]
+        for idx, row in enumerate(band_slice):
+            buckets[row.tobytes()].append(idx)
+        for members in buckets.values():
+            if len(members) < 2:
+                continue
+            first = members[0]
+            if groups is None:
+                candidates.update((first, other) for other in members[1:])
+                continue
+            # Pair each member with the first member of another group
+            second = next((m for m in members if groups[m] != groups[first]), None)
+            if second is None:
+                continue
+            for other in members[1:]:
+                anchor = first if groups[other] != groups[first] else second
+                candidates.add((min(anchor, other), max(anchor, other)))
+
+    # Union-find over verified pairs; lowest index wins as representative
+    parent = list(range(len(texts)))
+    members_groups = {i: {groups[i]} for i in range(len(texts))} if groups is not None else None
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i, j in candidates:
+        similarity = np.mean(signatures[i] == signatures[j])
+        if similarity >= threshold:
+            root_i, root_j = find(i), find(j)
+            if root_i == root_j:
+                continue
+            low, high = min(root_i, root_j), max(root_i, root_j)
+            if members_groups is not None:
+                if members_groups[low] & members_groups[high]:
+                    continue
+                members_groups[low] |= members_groups.pop(high)
+            parent[high] = low
+
+    return {i: find(i) for i in range(len(texts)) if find(i) != i}
@@ -1,7 +1,16 @@
 import json
+import re
+import threading
+import unicodedata
 from pathlib import Path
 from typing import Optional
 
+DOCUMENTS_INDEX_PATH = Path(__file__).parent.parent / "documents_index.json"
+
+# doc_id prefix for PDFs that have no entry in documents_index.json
+UNINDEXED_PREFIX = "file:"
+
+
 def load_documents_index(index_path: str = "documents_index.json") -> dict:
     """
     Load the documents index JSON file.
@@ -12,21 +21,51 @@ def load_documents_index(index_path: str = "documents_index.json") -> dict:
         return json.load(f)
 
 
-def find_document_by_path(location_in_pc: str, documents_index: Optional[dict] = None) -> Optional[dict]:
+def normalize_path(location: str) -> str:
+    """Path key relative to the PDF directory, e.g. 'oms/informe.pdf'."""
+    path = unicodedata.normalize("NFC", location.replace("\\", "/"))
+    for prefix in ("data/pdfs/", "data/"):
+        if prefix in path:
+            return path.split(prefix, 1)[1]
+    return path
+
+
+def normalize_title(title: str) -> str:
+    """Lowercase, accent-free, punctuation-free title key."""
+    decomposed = unicodedata.normalize("NFKD", title or "")
+    without_accents = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return " ".join(re.findall(r"\w+", without_accents.lower()))
+
+
+class DocumentCatalog:
     """
-    Find a document in the index by its location_in_pc path.
+    In-memory view of documents_index.json with hash indexes by path,
+    filename, normalized title and ID. The file is re-read only when its
+    mtime changes.
     """
-    if documents_index is None:
-        documents_index = load_documents_index()
 
-    search_path = location_in_pc.replace("data/pdfs/", "data/").replace("\\", "/")
+    def __init__(self, index_path: Path = DOCUMENTS_INDEX_PATH):
+        self.index_path = Path(index_path)
+        self._mtime = None
+        self._lock = threading.Lock()
+        self._build({})
 
-    for org_key, org_data in documents_index.get("organizations", {}).items():
-        for doc in org_data.get("documents", []):
-            doc_path = doc.get("location_in_pc", "").replace("\\", "/")
+    @classmethod
+    def from_index(cls, documents_index: dict) -> "DocumentCatalog":
+        """Catalog over an already loaded index dict (never reloaded from disk)."""
+        catalog = cls.__new__(cls)
+        catalog.index_path = None
+        catalog._mtime = None
+        catalog._lock = threading.Lock()
+        catalog._build(documents_index)
+        return catalog
 
-            if doc_path == search_path or doc_path.endswith(search_path.split("/")[-1]):
-                return {
+    def _build(self, documents_index: dict):
+        by_id, by_path, by_filename, by_title = {}, {}, {}, {}
+
+        for org_key, org_data in documents_index.get("organizations", {}).items():
+            for doc in org_data.get("documents", []):
+                entry = {
                     "id": doc.get("id"),
                     "title": doc.get("title"),
                     "year": doc.get("year"),
@@ -39,7 +78,97 @@ def find_document_by_path(location_in_pc: str, documents_index: Optional[dict] =
                     "location_in_pc": doc.get("location_in_pc")
                 }
 
-    return None
+                if entry["id"]:
+                    by_id[entry["id"]] = entry
+                location = entry["location_in_pc"] or ""
+                if location:
+                    path_key = normalize_path(location)
+                    by_path.setdefault(path_key, entry)
+                    by_filename.setdefault(path_key.split("/")[-1], entry)
+                if entry["title"]:
+                    by_title.setdefault(normalize_title(entry["title"]), entry)
+
+        self.documents_index = documents_index
+        self._by_id = by_id
+        self._by_path = by_path
+        self._by_filename = by_filename
+        self._by_title = by_title
+
+    def _refresh(self):
+        if self.index_path is None:
+            return
+
+        try:
+            mtime = self.index_path.stat().st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+
+        if mtime == self._mtime:
+            return
+
+        with self._lock:
+            if mtime == self._mtime:
+                return
+            if mtime is None:
+                self._build({})
+            else:
+                with open(self.index_path, 'r', encoding='utf-8') as f:
+                    self._build(json.load(f))
+            self._mtime = mtime
+
+    def get(self, doc_id: str) -> Optional[dict]:
+        self._refresh()
+        return self._by_id.get(doc_id)
+
+    def find_by_path(self, location_in_pc: str) -> Optional[dict]:
+        """Exact relative path first, then bare filename."""
+        self._refresh()
+        path_key = normalize_path(location_in_pc)
+        return self._by_path.get(path_key) or self._by_filename.get(path_key.split("/")[-1])
+
+    def find_by_title(self, title: str, partial: bool = False) -> Optional[dict]:
+        """
+        Exact normalized-title lookup. With partial, fall back to a
+        substring match in either direction (only scanned on a miss).
+        """
+        self._refresh()
+        key = normalize_title(title)
+        if not key:
+            return None
+
+        entry = self._by_title.get(key)
+        if entry or not partial:
+            return entry
+
+        for t, candidate in self._by_title.items():
+            if key in t or t in key:
+                return candidate
+        return None
+
+
+_catalog = None
+
+
+def get_document_catalog() -> DocumentCatalog:
+    """Get or create the shared document catalog."""
+    global _catalog
+
+    if _catalog is None:
+        _catalog = DocumentCatalog()
+
+    return _catalog
+
+
+def find_document_by_path(location_in_pc: str, documents_index: Optional[dict] = None) -> Optional[dict]:
+    """
+    Find a document in the index by its location_in_pc path.
+    """
+    if documents_index is None:
+        catalog = get_document_catalog()
+    else:
+        catalog = DocumentCatalog.from_index(documents_index)
+
+    return catalog.find_by_path(location_in_pc)
 
 
 def get_citation_info(location_in_pc: str) -> dict:
@@ -67,3 +196,32 @@ def get_citation_info(location_in_pc: str) -> dict:
             "author": "Autor no especificado",
             "link": None
         }
+
+
+def resolve_doc_id(doc_id: str) -> dict:
+    """
+    Full citation data for a chunk's compact doc_id: catalog entries for
+    indexed documents, defaults built from the file name otherwise.
+    """
+    doc_info = get_document_catalog().get(doc_id)
+
+    if doc_info:
+        return {
+            "doc_id": doc_id,
+            "title": doc_info["title"],
+            "organization": doc_info["organization"],
+            "organization_acronym": doc_info["organization_acronym"] or "",
+            "year": doc_info["year"],
+            "author": doc_info["author"] or "Autor no especificado",
+            "link": doc_info["link"]
+        }
+
+    return {
+        "doc_id": doc_id,
+        "title": Path(doc_id.removeprefix(UNINDEXED_PREFIX)).stem,
+        "organization": "Organización no especificada",
+        "organization_acronym": "",
+        "year": None,
+        "author": "Autor no especificado",
+        "link": None
+    }
@@ -0,0 +1,110 @@
+import hashlib
+import sqlite3
+from array import array
+from pathlib import Path
+from typing import Callable, List, Optional
+
+from config import EMBEDDING_CACHE_PATH
+
+
+def hash_text(text: str) -> str:
+    """Content hash used as the cache key for a chunk text."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Content-addressed embedding store keyed by (model name, text hash).
+    Vectors are stored as packed float32 blobs in SQLite.
+    """
+
+    def __init__(self, model_name: str, db_path: str = EMBEDDING_CACHE_PATH):
+        self.model_name = model_name
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+
+        self.conn = sqlite3.connect(self.db_path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                PRIMARY KEY (model, text_hash)
+            ) WITHOUT ROWID
+        ''')
+
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, hashes: List[str]) -> dict:
+        """Return {text_hash: vector} for the hashes present in the cache."""
+        found = {}
+        unique = list(dict.fromkeys(hashes))
+
+        # Stay under SQLite's bound-parameter limit
+        for i in range(0, len(unique), 500):
+            part = unique[i:i + 500]
+            placeholders = ",".join("?" * len(part))
+            rows = self.conn.execute(
+                f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                (self.model_name, *part)
+            ).fetchall()
+            for text_hash, blob in rows:
+                found[text_hash] = array("f", blob).tolist()
+
+        return found
+
+    def put_many(self, items: dict):
+        """Store {text_hash: vector} in a single transaction."""
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, vector) VALUES (?, ?, ?)",
+                [(self.model_name, h, array("f", vec).tobytes()) for h, vec in items.items()]
+            )
+
+    def lookup(self, texts: List[str]) -> tuple:
+        """
+        Split texts into cache hits and misses.
+        Returns (hashes, {text_hash: vector} hits, {text_hash: text} unique misses).
+        """
+        hashes = [hash_text(t) for t in texts]
+        cached = self.get_many(hashes)
+
+        # Unique texts that still need embedding
+        pending = {}
+        for text, text_hash in zip(texts, hashes):
+            if text_hash not in cached and text_hash not in pending:
+                pending[text_hash] = text
+
+        hit_count = sum(1 for h in hashes if h in cached)
+        self.hits += hit_count
+        self.misses += len(hashes) - hit_count
+
+        return hashes, cached, pending
+
+    def embed(self, texts: List[str], embed_fn: Callable[[List[str]], list], batch_size: int = 256) -> list:
+        """
+        Return embeddings for texts, computing only the cache misses
+        (in batches of batch_size) with embed_fn.
+        """
+        hashes, cached, pending = self.lookup(texts)
+
+        pending_items = list(pending.items())
+        for i in range(0, len(pending_items), batch_size):
+            batch = pending_items[i:i + batch_size]
+            vectors = embed_fn([text for _, text in batch])
+            new_items = {text_hash: vec for (text_hash, _), vec in zip(batch, vectors)}
+            self.put_many(new_items)
+            cached.update(new_items)
+
+        return [cached[h] for h in hashes]
+
+    @property
+    def hit_ratio(self) -> Optional[float]:
+        total = self.hits + self.misses
+        return self.hits / total if total else None
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,97 @@
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from config import EMBEDDING_MODEL, EMBEDDING_BATCH_SIZE
+
+# Per-process model, loaded once by the pool initializer
+_worker_model = None
+
+
+def _init_worker(model_name: str, threads: int):
+    """Pin the PyTorch thread pool and load the model inside a worker process."""
+    global _worker_model
+
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    torch.set_num_threads(threads)
+    _worker_model = SentenceTransformer(model_name, device="cpu")
+
+
+def _encode_batch(texts: list[str]) -> list:
+    return _worker_model.encode(texts, batch_size=len(texts), convert_to_numpy=True).tolist()
+
+
+class EmbeddingEngine:
+    """
+    Ingestion embedding engine.
+    Texts are sorted by token length so each batch pads to a similar length,
+    encoded across a pool of CPU worker processes, then returned in input order.
+    """
+
+    def __init__(self, workers: int, threads_per_worker: int, model_name: str = EMBEDDING_MODEL,
+                 batch_size: int = EMBEDDING_BATCH_SIZE):
+        from transformers import AutoTokenizer
+
+        self.workers = workers
+        self.batch_size = batch_size
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+
+        # spawn avoids forking a parent that may already hold torch threads
+        self.pool = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(model_name, threads_per_worker)
+        )
+
+        self.embedded = 0
+        self.elapsed = 0.0
+        self._first_submit = None
+
+    def token_lengths(self, texts: list[str]) -> list[int]:
+        encoded = self.tokenizer(texts, add_special_tokens=True, truncation=True)
+        return [len(ids) for ids in encoded["input_ids"]]
+
+    def submit(self, texts: list[str]) -> list:
+        """
+        Queue texts on the worker pool without waiting; pass the result to
+        collect(). Submitting the next texts before collecting keeps the
+        workers busy instead of idling at the end of each call.
+        """
+        if not texts:
+            return []
+        if self._first_submit is None:
+            self._first_submit = time.time()
+
+        lengths = self.token_lengths(texts)
+        order = sorted(range(len(texts)), key=lambda i: lengths[i])
+
+        batches = [order[i:i + self.batch_size] for i in range(0, len(order), self.batch_size)]
+        return [(batch, self.pool.submit(_encode_batch, [texts[i] for i in batch])) for batch in batches]
+
+    def collect(self, submission: list) -> list:
+        """Wait for a submit() and return its embeddings in input order."""
+        embeddings = [None] * sum(len(batch) for batch, _ in submission)
+        for batch, future in submission:
+            for idx, vector in zip(batch, future.result()):
+                embeddings[idx] = vector
+
+        self.embedded += len(embeddings)
+        if submission:
+            self.elapsed = time.time() - self._first_submit
+
+        return embeddings
+
+    def embed(self, texts: list[str]) -> list:
+        """Embed texts across the worker pool, preserving input order."""
+        return self.collect(self.submit(texts))
+
+    @property
+    def throughput(self) -> float:
+        """Chunks embedded per second so far."""
+        return self.embedded / self.elapsed if self.elapsed else 0.0
+
+    def close(self):
+        self.pool.shutdown(cancel_futures=True)
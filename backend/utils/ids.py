@@ -0,0 +1,47 @@
+import os
+import threading
+import time
+
+# Crockford base32, as used by the ULID spec
+_ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+_RANDOM_BITS = 80
+_RANDOM_MAX = (1 << _RANDOM_BITS) - 1
+
+_lock = threading.Lock()
+_last_ms = -1
+_last_random = 0
+
+
+def encode_ulid(timestamp_ms: int, randomness: int) -> str:
+    """26-character ULID: 48-bit millisecond timestamp + 80 bits of randomness."""
+    value = (timestamp_ms << _RANDOM_BITS) | randomness
+    chars = []
+    for _ in range(26):
+        chars.append(_ALPHABET[value & 31])
+        value >>= 5
+    return "".join(reversed(chars))
+
+
+def new_ulid() -> str:
+    """
+    Monotonic ULID. IDs created in the same millisecond increment the random
+    part, so they never collide and always sort in creation order.
+    """
+    global _last_ms, _last_random
+
+    with _lock:
+        now = int(time.time() * 1000)
+
+        if now <= _last_ms:
+            # Same millisecond (or clock went back): keep the last timestamp and count up
+            now = _last_ms
+            _last_random += 1
+            if _last_random > _RANDOM_MAX:
+                now += 1
+                _last_random = int.from_bytes(os.urandom(10), "big") >> 1
+        else:
+            # Leave headroom so increments within this millisecond can't overflow
+            _last_random = int.from_bytes(os.urandom(10), "big") >> 1
+
+        _last_ms = now
+        return encode_ulid(now, _last_random)
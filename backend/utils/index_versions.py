@@ -0,0 +1,115 @@
+import os
+import shutil
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+from config import INDEX_DIR, CHROMA_PATH, INDEX_GC_GRACE_SECONDS, INDEX_GC_INTERVAL_SECONDS
+
+POINTER_FILE = INDEX_DIR / "CURRENT"
+RETIRED_MARKER = "RETIRED"
+
+# (pointer mtime, resolved path) so readers only re-read the pointer when it changes
+_pointer_cache: tuple = (None, None)
+
+
+def get_active_version() -> Optional[Path]:
+    """Return the index version the pointer file designates, if any."""
+    global _pointer_cache
+
+    try:
+        mtime = POINTER_FILE.stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+    if _pointer_cache[0] != mtime:
+        name = POINTER_FILE.read_text(encoding="utf-8").strip()
+        _pointer_cache = (mtime, INDEX_DIR / name if name else None)
+
+    return _pointer_cache[1]
+
+
+def get_active_chroma_path() -> str:
+    """Chroma directory queries should read from; falls back to the legacy CHROMA_PATH."""
+    version = get_active_version()
+    if version is not None and version.exists():
+        return str(version)
+    return CHROMA_PATH
+
+
+def create_version_dir() -> Path:
+    """Create a fresh, not yet active, version directory for a new build."""
+    INDEX_DIR.mkdir(parents=True, exist_ok=True)
+    path = INDEX_DIR / f"v{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}"
+    path.mkdir()
+    return path
+
+
+def activate_version(path: Path):
+    """
+    Atomically point readers at a new version.
+    The previous version is marked as retired and removed later by gc_versions.
+    """
+    previous = get_active_version()
+
+    tmp_pointer = POINTER_FILE.with_suffix(".tmp")
+    with open(tmp_pointer, "w", encoding="utf-8") as f:
+        f.write(path.name)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_pointer, POINTER_FILE)
+
+    if previous is not None and previous != path and previous.exists():
+        (previous / RETIRED_MARKER).write_text(str(time.time()), encoding="utf-8")
+
+    print(f"Active index version: {path.name}")
+
+
+def gc_versions(grace_seconds: int = INDEX_GC_GRACE_SECONDS) -> list[str]:
+    """
+    Delete versions retired for longer than grace_seconds, giving queries
+    that started on an old version time to finish.
+    """
+    if not INDEX_DIR.exists():
+        return []
+
+    active = get_active_version()
+    removed = []
+
+    for path in INDEX_DIR.iterdir():
+        marker = path / RETIRED_MARKER
+        if not path.is_dir() or path == active or not marker.exists():
+            continue
+
+        retired_at = float(marker.read_text(encoding="utf-8") or 0)
+        if time.time() - retired_at >= grace_seconds:
+            shutil.rmtree(path, ignore_errors=True)
+            removed.append(path.name)
+
+    if removed:
+        print(f"Removed old index versions: {', '.join(removed)}")
+
+    return removed
+
+
+class BackgroundIndexGC:
+    """Periodically deletes index versions whose grace period has passed, on its own thread."""
+
+    def __init__(self, interval: float = INDEX_GC_INTERVAL_SECONDS):
+        self.interval = interval
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="index-gc", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        self._stop_event.set()
+        self._thread.join(timeout=timeout)
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                gc_versions()
+            except Exception as e:
+                print(f"Error during index version cleanup: {e}")
@@ -0,0 +1,56 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Optional
+
+from config import INDEX_DIR
+
+CHECKPOINT_PATH = INDEX_DIR / "ingest_checkpoint.json"
+
+
+def fingerprint_chunks(chunk_ids: list[str], texts: list[str]) -> str:
+    """Identify a chunk list so a resume only continues the exact same work."""
+    digest = hashlib.sha256()
+    for chunk_id, text in zip(chunk_ids, texts):
+        digest.update(chunk_id.encode("utf-8"))
+        digest.update(hashlib.sha256(text.encode("utf-8")).digest())
+    return digest.hexdigest()
+
+
+class IngestCheckpoint:
+    """
+    Durable record of an ingestion run: where it writes, which chunk list it
+    is processing and how many batches have been committed to Chroma.
+    """
+
+    def __init__(self, target: str, fingerprint: str, total_batches: int, reset: bool,
+                 completed_batches: int = 0, completed_files: Optional[list[str]] = None):
+        self.target = target
+        self.fingerprint = fingerprint
+        self.total_batches = total_batches
+        self.reset = reset
+        self.completed_batches = completed_batches
+        self.completed_files = completed_files or []
+
+    @classmethod
+    def load(cls, path: Path = CHECKPOINT_PATH) -> Optional["IngestCheckpoint"]:
+        if not path.exists():
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(**json.load(f))
+
+    def save(self, path: Path = CHECKPOINT_PATH):
+        """Write the checkpoint with fsync + rename so a crash never leaves it half-written."""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(".tmp")
+
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.__dict__, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def clear(path: Path = CHECKPOINT_PATH):
+        path.unlink(missing_ok=True)
@@ -0,0 +1,86 @@
+import sqlite3
+import threading
+import zlib
+from pathlib import Path
+from typing import List, Optional
+
+from utils.index_versions import get_active_chroma_path
+
+PARENT_STORE_NAME = "parents.sqlite"
+
+# One read connection per index version directory, shared by API threads.
+# Only the active version (and the one being read) is kept.
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+class ParentStore:
+    """
+    Parent sections of the small-to-big index, keyed by parent_id.
+    Text is zlib-compressed; the file lives inside the index version
+    directory so it is swapped and garbage-collected with the vectors.
+    """
+
+    def __init__(self, index_path: str):
+        self.db_path = Path(index_path) / PARENT_STORE_NAME
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS parents (
+                parent_id TEXT PRIMARY KEY,
+                doc_id TEXT NOT NULL,
+                content BLOB NOT NULL
+            ) WITHOUT ROWID
+        ''')
+        self._lock = threading.Lock()
+
+    def put_many(self, parents: dict):
+        """Store {parent_id: (doc_id, text)} in a single transaction."""
+        with self._lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO parents (parent_id, doc_id, content) VALUES (?, ?, ?)",
+                [(parent_id, doc_id, zlib.compress(text.encode("utf-8")))
+                 for parent_id, (doc_id, text) in parents.items()]
+            )
+
+    def get_many(self, parent_ids: List[str]) -> dict:
+        """Return {parent_id: text} for the ids present in the store."""
+        unique = list(dict.fromkeys(parent_ids))
+        if not unique:
+            return {}
+
+        placeholders = ",".join("?" * len(unique))
+        with self._lock:
+            rows = self.conn.execute(
+                f"SELECT parent_id, content FROM parents WHERE parent_id IN ({placeholders})", unique
+            ).fetchall()
+        return {parent_id: zlib.decompress(blob).decode("utf-8") for parent_id, blob in rows}
+
+    def count(self) -> int:
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM parents").fetchone()[0]
+
+    def close(self):
+        self.conn.close()
+
+
+def get_parent_store(index_path: str) -> Optional[ParentStore]:
+    """
+    Shared store for an index version, or None for indexes built without
+    parents. Stores of versions retired since the last call are dropped.
+    """
+    keep = {index_path, get_active_chroma_path()}
+    with _stores_lock:
+        # Not closed explicitly: a query still reading a retired store keeps its
+        # reference, and the connection closes when that query releases it
+        for path in [path for path in _stores if path not in keep]:
+            del _stores[path]
+
+        if index_path not in _stores:
+            if not (Path(index_path) / PARENT_STORE_NAME).exists():
+                return None
+            _stores[index_path] = ParentStore(index_path)
+        return _stores[index_path]
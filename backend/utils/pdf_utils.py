@@ -1,6 +1,6 @@
 import pdfplumber
 from pathlib import Path
-from .document_index_utils import load_documents_index, find_document_by_path
+from .document_index_utils import find_document_by_path, normalize_path, UNINDEXED_PREFIX
 
 def load_pdf(pdf_path: Path) -> str:
     """Load text and tables from a PDF."""
@@ -35,9 +35,6 @@ def get_default_metadata(pdf_path: Path) -> dict:
 
 def extract_document_metadata(pdf_path: Path, documents_index: dict = None) -> dict:
     """Extract metadata from documents_index.json based on file path."""
-    if documents_index is None:
-        documents_index = load_documents_index()
-
     path_str = str(pdf_path)
     if "data/" in path_str:
         relative_path = "data/" + path_str.split("data/")[1]
@@ -48,6 +45,7 @@ def extract_document_metadata(pdf_path: Path, documents_index: dict = None) -> d
 
     if doc_info:
         return {
+            "doc_id": doc_info["id"],
             "title": doc_info["title"],
             "organization": doc_info["organization"],
             "organization_acronym": doc_info.get("organization_acronym", ""),
@@ -56,7 +54,10 @@ def extract_document_metadata(pdf_path: Path, documents_index: dict = None) -> d
             "link": doc_info.get("link")
         }
 
-    return get_default_metadata(pdf_path)
+    return {
+        "doc_id": UNINDEXED_PREFIX + normalize_path(relative_path),
+        **get_default_metadata(pdf_path)
+    }
 
 
 def load_pdfs_from_directory(directory: Path) -> list[dict]:
@@ -65,11 +66,8 @@ def load_pdfs_from_directory(directory: Path) -> list[dict]:
     """
     documents = []
 
-    # Load documents index once for all PDFs
-    documents_index = load_documents_index()
-
-    # Recursively find all PDFs in directory and subdirectories
-    pdf_files = list(directory.rglob("*.pdf"))
+    # Recursively find all PDFs in directory and subdirectories (sorted so chunk order is reproducible)
+    pdf_files = sorted(directory.rglob("*.pdf"))
 
     print(f"Found {len(pdf_files)} PDF files")
 
@@ -77,10 +75,11 @@ def load_pdfs_from_directory(directory: Path) -> list[dict]:
         try:
             print(f"Loading: {pdf_path.name}")
             text = load_pdf(pdf_path)
-            metadata = extract_document_metadata(pdf_path, documents_index)
+            metadata = extract_document_metadata(pdf_path)
 
             documents.append({
                 "content": text,
+                "doc_id": metadata["doc_id"],
                 "source": str(pdf_path),
                 "filename": pdf_path.name,
                 "title": metadata["title"],
@@ -0,0 +1,145 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, NamedTuple
+
+import numpy as np
+
+from config import PREFETCH_MAX_ENTRIES, PREFETCH_TTL_SECONDS, PREFETCH_MIN_SIMILARITY
+
+
+class PrefetchEntry(NamedTuple):
+    retrieval: dict
+    embedding: np.ndarray # Unit-normalized embedding of the retrieval question
+    question_seconds: float # Embedding (plus condensing, for a query in a chat)
+    retrieval_seconds: float
+    stored_at: float
+
+
+def normalize_query(text: str) -> str:
+    """Case, punctuation and whitespace-insensitive form of a question."""
+    return " ".join(re.sub(r"[^\w\s]", " ", text.lower()).split())
+
+
+def unit_vector(embedding) -> np.ndarray:
+    vector = np.asarray(embedding, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+class PrefetchCache:
+    """
+    Retrieval results computed while the user is still typing. Keys end
+    with (top_k, index path), see query_data.prefetch_key; entries expire
+    after the TTL. A query without an exact entry can reuse the entry whose
+    embedding is most similar to its own, above min_similarity, within the
+    same top_k and index. Counts hits, misses and the seconds of work reused.
+    """
+
+    def __init__(self, max_entries: int = PREFETCH_MAX_ENTRIES, ttl: float = PREFETCH_TTL_SECONDS,
+                 min_similarity: float = PREFETCH_MIN_SIMILARITY):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.min_similarity = min_similarity
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"prefetches": 0, "exact_hits": 0, "similar_hits": 0, "misses": 0, "seconds_saved": 0.0}
+
+    def _expire(self):
+        now = time.monotonic()
+        for key in [key for key, entry in self._entries.items() if now - entry.stored_at > self.ttl]:
+            del self._entries[key]
+
+    def contains(self, key: tuple) -> bool:
+        with self._lock:
+            self._expire()
+            return key in self._entries
+
+    def put(self, key: tuple, retrieval: dict, embedding, question_seconds: float, retrieval_seconds: float):
+        entry = PrefetchEntry(retrieval, unit_vector(embedding), question_seconds, retrieval_seconds, time.monotonic())
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._stats["prefetches"] += 1
+
+    def get(self, key: tuple) -> Optional[dict]:
+        """Exact match; saves the embedding and the whole retrieval."""
+        with self._lock:
+            self._expire()
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._stats["exact_hits"] += 1
+            self._stats["seconds_saved"] += entry.question_seconds + entry.retrieval_seconds
+            return entry.retrieval
+
+    def get_similar(self, embedding, top_k: int, index_path: str) -> Optional[dict]:
+        """Nearest cached query by cosine similarity; saves the retrieval. Counts a miss otherwise."""
+        query_vector = unit_vector(embedding)
+        with self._lock:
+            self._expire()
+            candidates = [entry for key, entry in self._entries.items() if key[-2:] == (top_k, index_path)]
+            if candidates:
+                similarities = np.stack([entry.embedding for entry in candidates]) @ query_vector
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.min_similarity:
+                    self._stats["similar_hits"] += 1
+                    self._stats["seconds_saved"] += candidates[best].retrieval_seconds
+                    return candidates[best].retrieval
+            self._stats["misses"] += 1
+            return None
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._expire()
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+
+        lookups = stats["exact_hits"] + stats["similar_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["exact_hits"] + stats["similar_hits"]) / lookups if lookups else None
+        stats["seconds_saved"] = round(stats["seconds_saved"], 3)
+        return stats
+
+
+class PrefetchSlots:
+    """
+    One prefetch at a time per slot (a chat, or drafts outside any chat).
+    A draft waiting for its slot is dropped when a newer one arrives, so
+    pauses in typing never pile up stale work ahead of the real query.
+    """
+
+    def __init__(self):
+        self._slots = {}  # slot -> {"lock", "latest", "waiting"}
+        self._lock = threading.Lock()
+
+    def run(self, slot, work) -> dict:
+        token = object()
+        with self._lock:
+            state = self._slots.setdefault(slot, {"lock": threading.Lock(), "latest": None, "waiting": 0})
+            state["latest"] = token
+            state["waiting"] += 1
+
+        try:
+            with state["lock"]:
+                if state["latest"] is not token:
+                    return {"status": "superseded"}
+                return work()
+        finally:
+            with self._lock:
+                state["waiting"] -= 1
+                if not state["waiting"]:
+                    del self._slots[slot]
+
+
+_prefetch_cache = PrefetchCache()
+_prefetch_slots = PrefetchSlots()
+
+
+def get_prefetch_cache() -> PrefetchCache:
+    return _prefetch_cache
+
+
+def get_prefetch_slots() -> PrefetchSlots:
+    return _prefetch_slots
@@ -0,0 +1,72 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, NamedTuple
+
+from config import CHAT_CACHE_MAX_ENTRIES, CHAT_CACHE_TTL_SECONDS
+
+
+class CachedResponse(NamedTuple):
+    etag: str
+    last_modified: Optional[str]
+    body: bytes
+    stored_at: float
+
+
+class ResponseCache:
+    """
+    LRU of serialized chat GET responses. Keys are tuples whose first item
+    is the endpoint ("chats" or "chat") and, for "chat", the second is the
+    chat ID. The API and the chat writer invalidate entries after their
+    writes; the generation they bump only keeps a response built before a
+    write from being cached after it. The TTL bounds staleness from writes
+    made by other processes (e.g. the maintenance CLI).
+    """
+
+    def __init__(self, max_entries: int = CHAT_CACHE_MAX_ENTRIES, ttl: float = CHAT_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.generation = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple) -> Optional[CachedResponse]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() - entry.stored_at > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: tuple, etag: str, last_modified: Optional[str], body: bytes, generation: int) -> CachedResponse:
+        """Store a response built at `generation`; dropped if a write happened meanwhile."""
+        entry = CachedResponse(etag, last_modified, body, time.monotonic())
+        with self._lock:
+            if generation == self.generation:
+                self._entries[key] = entry
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return entry
+
+    def invalidate_chat(self, chat_id: Optional[str] = None):
+        """Drop the chat list pages and one chat's message pages (all chats if None)."""
+        with self._lock:
+            self.generation += 1
+            for key in list(self._entries):
+                if key[0] == "chats" or chat_id is None or key[1] == chat_id:
+                    del self._entries[key]
+
+
+_chat_cache = ResponseCache()
+
+
+def get_chat_cache() -> ResponseCache:
+    return _chat_cache
+
+
+def invalidate_chat(chat_id: Optional[str] = None):
+    _chat_cache.invalidate_chat(chat_id)
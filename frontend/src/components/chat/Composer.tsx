@@ -1,19 +1,33 @@
-import { useState, useRef, KeyboardEvent } from "react";
+import { useState, useRef, useEffect, KeyboardEvent } from "react";
 import { Button } from "@/components/ui/button";
 import { Textarea } from "@/components/ui/textarea";
 import { Send } from "lucide-react";
 import { quickPrompts } from "@/data/mockData";
 import { Badge } from "@/components/ui/badge";
+import { api } from "@/services/api";
+
+// Warm retrieval once the user pauses typing
+const PREFETCH_DEBOUNCE_MS = 400;
+const PREFETCH_MIN_CHARS = 12;
 
 interface ComposerProps {
   onSendMessage: (content: string) => void;
   disabled?: boolean;
+  chatId?: string;
 }
 
-export function Composer({ onSendMessage, disabled }: ComposerProps) {
+export function Composer({ onSendMessage, disabled, chatId }: ComposerProps) {
   const [input, setInput] = useState("");
   const textareaRef = useRef<HTMLTextAreaElement>(null);
 
+  useEffect(() => {
+    const draft = input.trim();
+    if (draft.length < PREFETCH_MIN_CHARS || disabled) return;
+
+    const timer = setTimeout(() => api.prefetch(draft, chatId), PREFETCH_DEBOUNCE_MS);
+    return () => clearTimeout(timer);
+  }, [input, disabled, chatId]);
+
   const handleSend = () => {
     if (input.trim() && !disabled) {
       onSendMessage(input.trim());
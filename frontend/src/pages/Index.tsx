@@ -294,7 +294,7 @@ const Index = () => {
       </SidebarInset>
 
       {/* Composer - Fixed vertically, follows horizontal layout */}
-      <Composer onSendMessage={handleSendMessage} disabled={isTyping} />
+      <Composer onSendMessage={handleSendMessage} disabled={isTyping} chatId={currentChatId} />
 
       {/* Clinical Data Dialog */}
       <ClinicalDataDialog
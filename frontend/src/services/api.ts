@@ -64,10 +64,12 @@ export interface Citation {
 
 export interface ChatListResponse {
   chats: Chat[];
+  next_cursor?: string | null;
 }
 
 export interface ChatMessagesResponse {
   messages: Message[];
+  next_cursor?: string | null;
 }
 
 export interface CreateChatRequest {
@@ -95,6 +97,22 @@ export const api = {
     return response.json();
   },
 
+  // Best effort: warms retrieval for a draft question, failures are ignored.
+  // The chat's id lets the server skip follow-ups and keep one prefetch per chat.
+  async prefetch(query: string, chatId?: string): Promise<void> {
+    try {
+      await fetch(`${API_BASE_URL}/api/prefetch`, {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({ query, chat_id: chatId }),
+      });
+    } catch {
+      // Prefetch only saves latency; the real query still works without it
+    }
+  },
+
   async health(): Promise<{ status: string }> {
     const response = await fetch(`${API_BASE_URL}/api/health`);
 